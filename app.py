@@ -1,15 +1,33 @@
 # app.py
 import os
+import io
+import hashlib
 import utils
 import datetime
 import json
 import re
 import math
+import time
 import base64 # Import for Base64 encoding
 import sqlalchemy # Needed for inspector check
+import chat_state
+import image_store
+import image_renditions
+import app_cache
+import unit_search
+import dashboard_summary
+import reference_data
+import unit_loader
+import current_units
+import step_intervals
+import step_rollup
+import step_analytics
+import report_engine
+import csv_export
+import date_ranges
 from flask import (
     Flask, render_template, request, redirect, url_for,
-    flash, session, abort, g, jsonify
+    flash, session, abort, g, jsonify, Response, send_file
 )
 from dotenv import load_dotenv
 # Import database connection components and SQLAlchemy
@@ -17,6 +35,7 @@ from db_connector import engine, SessionLocal # Or import get_db_session
 from sqlalchemy import text, func, or_ # Import func for date functions, or_ for queries
 from sqlalchemy.exc import SQLAlchemyError, IntegrityError
 import functools
+import contextlib
 from decimal import Decimal, InvalidOperation # For handling costs
 
 # --- App Configuration ---
@@ -26,6 +45,67 @@ app.config['SECRET_KEY'] = os.getenv('FLASK_SECRET_KEY', 'a_very_weak_default_se
 # Optional: Limit upload size (e.g., 16MB)
 # app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'} # Allowed image types
+DASHBOARD_PAGE_SIZE = 20
+COMPLETED_JOBS_PAGE_SIZE = 25 # Units per page on /completed_jobs
+NULL_SORT_DATE = current_units.NULL_SORT_DATE # Units without a dateIn sort after every dated unit
+reference_cache = reference_data.ReferenceData() # Pricing, techs and status colors; re-checked every REFERENCE_DATA_CHECK_INTERVAL seconds
+summary_counters = dashboard_summary.DashboardSummary() # Header counters; invalidated by create_po, unit_pickup and add_note
+dashboard_count_cache = app_cache.TTLCache(ttl_seconds=int(os.getenv('DASHBOARD_COUNT_TTL', '60'))) # Dashboard total-unit counts per filter
+# Set to 1 when a front-end server (Apache/lighttpd) honours X-Sendfile; otherwise the WSGI server's file_wrapper streams the file
+app.config['USE_X_SENDFILE'] = os.getenv('USE_X_SENDFILE', '0') == '1'
+CALENDAR_EVENTS_MAX_STALE = int(os.getenv('CALENDAR_EVENTS_MAX_STALE', '300')) # Longest a cached calendar range is reused without a full rebuild
+calendar_events_cache = app_cache.TTLCache(ttl_seconds=CALENDAR_EVENTS_MAX_STALE, max_entries=64) # (start, end, mode) -> (etag, JSON body)
+CALENDAR_AGGREGATE_THRESHOLD = int(os.getenv('CALENDAR_AGGREGATE_THRESHOLD', '400')) # aggregate=auto switches to daily counts above this many steps
+report_results = report_engine.ReportEngine() # (report, start_date, end_date) -> result; stale results are served while one refresh runs
+IMAGE_MAX_AGE = 7 * 24 * 3600 # Image URLs always map to the same bytes, so browsers can keep them for a week
+
+# --- Request-Scoped Database Connection ---
+# A request checks out at most one pool connection: on first use, shared by the auth decorator, the
+# route and its helpers, and returned to the pool in teardown_appcontext. Reads go through
+# db_connection(); writes go through db_transaction(), which commits on success and rolls back on error.
+# Work that runs on other threads or outlives the request (report refreshes, unit_loader, CSV and
+# chat streams, background syncs) keeps using engine directly.
+def _request_connection():
+    connection = g.get('db_connection')
+    if connection is None: connection = g.db_connection = engine.connect()
+    return connection
+
+@contextlib.contextmanager
+def db_connection():
+    """The request's connection, for reads. It stays checked out for the rest of the request, but the
+    implicit transaction its reads began ends when the outermost db_connection() block exits."""
+    connection = _request_connection()
+    g.db_connection_depth = g.get('db_connection_depth', 0) + 1
+    try:
+        yield connection
+    finally:
+        g.db_connection_depth -= 1
+        # Otherwise the read snapshot would outlive the block: later reads in the request (or a long
+        # stream) would miss writes committed on other connections, and the transaction stays open.
+        # A db_transaction() in progress owns the transaction and ends it itself.
+        if not g.db_connection_depth and not g.get('db_transaction_active') and connection.in_transaction(): connection.rollback()
+
+@contextlib.contextmanager
+def db_transaction():
+    """The request's connection inside a transaction. Earlier reads' implicit transaction is ended first;
+    a db_transaction() inside another one joins it."""
+    connection = _request_connection()
+    if g.get('db_transaction_active'):
+        yield connection
+        return
+    if connection.in_transaction(): connection.rollback() # Only reads can be pending here; start the writes fresh
+    g.db_transaction_active = True
+    try:
+        with connection.begin():
+            yield connection
+    finally:
+        g.db_transaction_active = False
+
+@app.teardown_appcontext
+def release_db_connection(exception=None):
+    """Returns the request's connection to the pool (rolling back anything left open)."""
+    connection = g.pop('db_connection', None)
+    if connection is not None: connection.close()
 
 # --- Template Context Processor ---
 @app.context_processor
@@ -33,6 +113,119 @@ def inject_now():
     # Injects the current UTC datetime into the template context.
     return {'now': datetime.datetime.now(datetime.UTC)} # Use timezone-aware UTC time
 
+# --- Chat State ---
+def _probe_chat_table():
+    """Checks once at startup whether the chat_messages table exists."""
+    if not engine: return False
+    try:
+        return sqlalchemy.inspect(engine).has_table("chat_messages")
+    except Exception as e:
+        print(f"Error checking for chat_messages table: {e}")
+        return False
+
+CHAT_TABLE_EXISTS = _probe_chat_table()
+if engine and not CHAT_TABLE_EXISTS: print("Warning: chat_messages table not found. Unread counts and unit chat history are disabled (run create_chat_table.py and restart).")
+unread_counter = chat_state.UnreadCounter()
+chat_broker = chat_state.ChatBroker() # Fans new messages out to open /api/chat/stream connections
+CHAT_STREAM_KEEPALIVE = 15 # Seconds between keepalive comments on an idle chat stream
+CHAT_PAGE_SIZE = 50 # Messages per /api/chat/messages page
+CHAT_PAGE_SIZE_MAX = 200
+CHAT_STREAM_MAX_SECONDS = int(os.getenv('CHAT_STREAM_MAX_SECONDS', '300')) # Streams are recycled so server threads don't stay pinned; EventSource reconnects
+
+def _fetch_unread_count(user_id):
+    """Loads a user's unread message count from MySQL (used to fill unread_counter)."""
+    try:
+        with db_connection() as connection:
+            sql_unread = text("SELECT COUNT(*) FROM chat_messages WHERE recipient_id = :user_id AND is_read = 0")
+            return connection.execute(sql_unread, {"user_id": user_id}).scalar_one_or_none() or 0
+    except Exception as e:
+        print(f"Error fetching unread count for user {user_id}: {e}") # Log error but continue
+        return None
+
+def load_user_context():
+    """Builds g.user from the session. The unread count comes from unread_counter, so this is normally query-free."""
+    user_id = session.get('user_id')
+    unread_count = 0
+    if user_id and engine and CHAT_TABLE_EXISTS:
+        unread_count = unread_counter.get(user_id, _fetch_unread_count)
+    g.user = {
+        'id': user_id,
+        'username': session.get('username'),
+        'role': session.get('role'),
+        'unread_messages': unread_count # Add unread count to g
+    }
+
+# --- Image Store Probe ---
+def _probe_image_store_columns():
+    """Checks once at startup whether images has the sha256 column added by create_image_store.py."""
+    if not engine: return False
+    try:
+        return any(col['name'] == 'sha256' for col in sqlalchemy.inspect(engine).get_columns('images'))
+    except Exception as e:
+        print(f"Error checking images table columns: {e}")
+        return False
+
+IMAGE_STORE_READY = _probe_image_store_columns()
+if engine and not IMAGE_STORE_READY: print("Warning: images.sha256 column not found. Uploads are stored as base64 until create_image_store.py is run.")
+
+# --- Search Table Probe ---
+def _probe_search_table():
+    """Checks once at startup whether create_search_table.py has created unit_search."""
+    if not engine: return False
+    try:
+        return sqlalchemy.inspect(engine).has_table("unit_search")
+    except Exception as e:
+        print(f"Error checking for unit_search table: {e}")
+        return False
+
+SEARCH_TABLE_EXISTS = _probe_search_table()
+if engine and not SEARCH_TABLE_EXISTS: print("Warning: unit_search table not found. Dashboard search uses unindexed LIKE scans until create_search_table.py is run.")
+
+# --- Current Units Projection Probe ---
+def _probe_current_units():
+    """Checks once at startup whether reconcile_current_units.py has created current_units."""
+    if not engine: return False
+    try:
+        return sqlalchemy.inspect(engine).has_table("current_units")
+    except Exception as e:
+        print(f"Error checking for current_units table: {e}")
+        return False
+
+CURRENT_UNITS_READY = _probe_current_units()
+if engine and not CURRENT_UNITS_READY: print("Warning: current_units table not found. Unit lists dedupe test_db with ROW_NUMBER until reconcile_current_units.py is run.")
+
+def refresh_current_units():
+    """Pulls new test_db rows into current_units (rate limited). A failure only leaves the projection briefly behind."""
+    if not CURRENT_UNITS_READY: return
+    try: current_units.sync_new_rows(engine)
+    except SQLAlchemyError as e: print(f"DB error syncing current_units: {e}")
+
+def units_table_sql():
+    """Table expression for "one row per stockNumber": current_units, or test_db when the projection is missing
+    (callers then dedupe with ROW_NUMBER as before)."""
+    return "current_units" if CURRENT_UNITS_READY else "test_db"
+
+# In-memory overlap index over newDaysInStep for the calendar and view_active (SQL is used while it is loading or stale)
+step_index = step_intervals.StepIntervalIndex()
+if os.getenv('STEP_INDEX_ENABLED', '1') == '1': step_index.start(engine)
+
+# --- Step Duration Rollup Probe ---
+def _probe_step_rollup():
+    """Checks once at startup whether create_step_rollup.py has created step_duration_daily."""
+    if not engine: return False
+    try:
+        return sqlalchemy.inspect(engine).has_table("step_duration_daily_state")
+    except Exception as e:
+        print(f"Error checking for step_duration_daily table: {e}")
+        return False
+
+STEP_ROLLUP_EXISTS = _probe_step_rollup()
+if engine and not STEP_ROLLUP_EXISTS: print("Warning: step_duration_daily table not found. The step-time report scans newDaysInStep until create_step_rollup.py is run.")
+step_rollup_refresher = step_rollup.RollupRefresher() # Report reads the rollup once this process has refreshed it at least once
+if STEP_ROLLUP_EXISTS: step_rollup_refresher.start(engine)
+
+rendition_pipeline = image_renditions.RenditionPipeline() # Makes thumb/medium copies of stored images in the background
+
 # --- Decorators ---
 def login_required(view):
     # Custom decorator to require login for accessing certain routes.
@@ -42,28 +235,8 @@ def login_required(view):
             flash("Please log in to access this page.", "warning")
             return redirect(url_for('login', next=request.url))
 
-        # Fetch unread message count and add to g.user
-        user_id = session.get('user_id')
-        unread_count = 0
-        if user_id and engine:
-             try:
-                 with engine.connect() as connection:
-                     # Check if chat_messages table exists before querying
-                     inspector = sqlalchemy.inspect(engine)
-                     if inspector.has_table("chat_messages"):
-                         sql_unread = text("SELECT COUNT(*) FROM chat_messages WHERE recipient_id = :user_id AND is_read = 0")
-                         unread_count = connection.execute(sql_unread, {"user_id": user_id}).scalar_one_or_none() or 0
-                     else:
-                         print("Warning: chat_messages table not found. Skipping unread count.")
-             except Exception as e:
-                 print(f"Error fetching unread count for user {user_id}: {e}") # Log error but continue
-
-        g.user = {
-            'id': user_id,
-            'username': session.get('username'),
-            'role': session.get('role'),
-            'unread_messages': unread_count # Add unread count to g
-        }
+        # Add user info and unread message count to g.user
+        load_user_context()
         return view(**kwargs)
     return wrapped_view
 
@@ -81,25 +254,7 @@ def admin_required(view):
             abort(403) # Forbidden
         # Ensure g.user is set if not already done by login_required being applied first
         if not hasattr(g, 'user') or g.user is None: # Check if g.user needs initialization
-             user_id = session.get('user_id')
-             unread_count = 0
-             if user_id and engine:
-                 try:
-                     with engine.connect() as connection:
-                         inspector = sqlalchemy.inspect(engine)
-                         if inspector.has_table("chat_messages"):
-                             sql_unread = text("SELECT COUNT(*) FROM chat_messages WHERE recipient_id = :user_id AND is_read = 0")
-                             unread_count = connection.execute(sql_unread, {"user_id": user_id}).scalar_one_or_none() or 0
-                         else:
-                              print("Warning: chat_messages table not found. Skipping unread count.")
-                 except Exception as e:
-                     print(f"Error fetching unread count for user {user_id}: {e}")
-             g.user = {
-                'id': user_id,
-                'username': session.get('username'),
-                'role': session.get('role'),
-                'unread_messages': unread_count
-             }
+             load_user_context()
         return view(**kwargs)
     return wrapped_view
 
@@ -133,11 +288,47 @@ def truncate_description(description):
     if first_index != -1: return description[:first_index].strip()
     else: return description
 
+def readable_minutes(total_minutes):
+    """Formats a duration in minutes as e.g. '2d 3h 15m', or 'N/A' for None."""
+    if total_minutes is None: return 'N/A'
+    days = int(total_minutes // (24 * 60))
+    remaining_minutes = total_minutes % (24 * 60)
+    hours = int(remaining_minutes // 60)
+    minutes = int(remaining_minutes % 60)
+    readable_time = ""
+    if days > 0: readable_time += f"{days}d "
+    if hours > 0: readable_time += f"{hours}h "
+    if minutes > 0 or not readable_time: readable_time += f"{minutes}m"
+    return readable_time.strip()
+
 def allowed_file(filename):
     """Checks if the file extension is allowed."""
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def encode_page_cursor(sort_value, row_id, direction):
+    """Builds an opaque keyset-pagination token from the boundary row of a page."""
+    if isinstance(sort_value, (datetime.date, datetime.datetime)): sort_value = sort_value.isoformat(sep=' ') if isinstance(sort_value, datetime.datetime) else sort_value.isoformat()
+    payload = json.dumps([sort_value, row_id, direction], default=str)
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_page_cursor(token):
+    """Returns (sort_value, row_id, direction) from encode_page_cursor(), or None if the token is missing/invalid."""
+    if not token: return None
+    try:
+        sort_value, row_id, direction = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        if direction not in ('next', 'prev') or not isinstance(row_id, int): return None
+        return sort_value, row_id, direction
+    except (ValueError, TypeError):
+        return None
+
+def serialize_chat_message(row):
+    """Converts a chat_messages row to a JSON-safe dict."""
+    message_dict = dict(row)
+    if isinstance(message_dict.get('timestamp'), datetime.datetime):
+        message_dict['timestamp'] = message_dict['timestamp'].isoformat()
+    return message_dict
+
 # --- Routes ---
 # ... (Login, Logout, Dashboard, Overview, API, Admin routes...) ...
 @app.route('/login', methods=['GET', 'POST'])
@@ -149,7 +340,7 @@ def login():
         if not username_input or not password_input: flash("Username and password are required.", "danger"); return redirect(url_for('login'))
         if not engine: flash("Database connection is not available.", "danger"); return render_template('login.html')
         try:
-            with engine.connect() as connection:
+            with db_connection() as connection:
                 # Uses 'id', 'userName', 'password', 'role' columns
                 sql = text("SELECT id, userName AS username, password, role FROM users WHERE userName = :username_param LIMIT 1")
                 result = connection.execute(sql, {"username_param": username_input}); user_row = result.fetchone();
@@ -169,94 +360,154 @@ def logout():
     # Logs the user out by clearing the session.
     session.clear(); flash("You have been logged out.", "info"); return redirect(url_for('login'))
 
+def dashboard_filters(connection, search_term):
+    """WHERE clause (over test_db/current_units aliased t), its parameters and the unit_search result
+    (or None) for the dashboard unit list; shared with the dashboard CSV export."""
+    base_where_clauses = []; params = {}
+    locations_to_exclude = ['FrontLine', 'sold', 'Deleted', 'Delivered'];
+    if locations_to_exclude: formatted_locations = ",".join([f"'{loc}'" for loc in locations_to_exclude]); base_where_clauses.append(f"t.location NOT IN ({formatted_locations})")
+    search_result = None
+    if search_term and SEARCH_TABLE_EXISTS:
+        # Indexed search (stock#, VIN tail, FULLTEXT make/model/location) narrows test_db to matching stock numbers
+        unit_search.sync_new_rows(engine)
+        search_result = unit_search.search(connection, search_term)
+        app.logger.debug("Dashboard search: %d match(es) in %.1f ms", len(search_result.relevance), search_result.elapsed_ms)
+    if search_result and search_result.complete:
+        if search_result.relevance:
+            params['search_stock_numbers'] = search_result.stock_numbers
+            base_where_clauses.append("t.stockNumber IN :search_stock_numbers")
+        else: base_where_clauses.append("1 = 0")
+    elif search_term: # No search table, or the indexed search may have missed matches (see SearchResult.complete)
+        search_like = f"%{search_term}%"; params['search'] = search_like
+        search_conditions = [ "t.stockNumber LIKE :search", "t.vin LIKE :search", "CAST(t.year AS CHAR) LIKE :search", "t.make LIKE :search", "t.model LIKE :search", "t.location LIKE :search" ]
+        base_where_clauses.append(f"({' OR '.join(search_conditions)})")
+    where_sql = "";
+    if base_where_clauses: where_sql = "WHERE " + " AND ".join(base_where_clauses)
+    return where_sql, params, search_result
+
+def ranked_units_sql(where_sql):
+    """Dashboard units matching where_sql with their sort_date; keep rows with rn = 1. current_units rows are
+    already unique and carry an indexed sort_date, so MySQL merges this into a range read on idx_sort;
+    test_db falls back to ROW_NUMBER."""
+    if CURRENT_UNITS_READY:
+        return f"""
+            SELECT t.id, t.stockNumber, t.vin, t.year, t.make, t.model, t.location, t.dateIn, t.sort_date, 1 as rn
+            FROM current_units t
+            {where_sql}
+        """
+    return f"""
+        SELECT
+            t.id, t.stockNumber, t.vin, t.year, t.make, t.model, t.location, t.dateIn,
+            COALESCE(t.dateIn, CAST('{NULL_SORT_DATE}' AS DATETIME)) as sort_date,
+            ROW_NUMBER() OVER(PARTITION BY t.stockNumber ORDER BY t.id DESC) as rn
+        FROM test_db t
+        {where_sql}
+    """
+
+def bind_dashboard_filters(statement, params):
+    """Binds the stock number list from unit_search as an expanding IN (...) parameter, when there is one."""
+    if 'search_stock_numbers' in params: return statement.bindparams(sqlalchemy.bindparam('search_stock_numbers', expanding=True))
+    return statement
+
 @app.route('/')
 @login_required
 def dashboard():
     # Shows the main dashboard after login, fetching summary data from MySQL.
     dashboard_data = {"username": g.user.get('username', 'User')}
-    page = request.args.get('page', 1, type=int); search_term = request.args.get('search', '', type=str).strip(); per_page = 20
+    page = request.args.get('page', 1, type=int); search_term = request.args.get('search', '', type=str).strip(); per_page = DASHBOARD_PAGE_SIZE
     total_items = 0; total_pages = 0
     autospa_services = [] # For PO Modal
 
     if not engine: flash("Database connection is not available.", "danger"); dashboard_data['units_list'] = []; dashboard_data['pagination'] = None
     else:
         try:
-            with engine.connect() as connection:
-                today_date = datetime.date.today()
-                # Dashboard Counts
-                # Count distinct stockNumbers with complete=1 in jobs
-                sql_detail_units = text("SELECT COUNT(DISTINCT stockNumber) FROM jobs WHERE complete = 1")
-                detail_units_count = connection.execute(sql_detail_units).scalar_one_or_none() or 0; dashboard_data['units_in_detail'] = detail_units_count
-                sql_ready_pickup = text("SELECT COUNT(*) FROM test_db WHERE location = 'Ready for Pickup'"); ready_pickup_count = connection.execute(sql_ready_pickup).scalar_one_or_none() or 0; dashboard_data['ready_pickup_count'] = ready_pickup_count
-                # Count notes added today (assuming 'dateTime' column exists)
-                sql_notes_today = text("SELECT COUNT(*) FROM notes WHERE DATE(dateTime) = :today")
-                notes_today_count = connection.execute(sql_notes_today, {"today": today_date}).scalar_one_or_none() or 0
-                dashboard_data['notes_today_count'] = notes_today_count
-
-                # Fetch Autospa Services for PO Modal
-                sql_services = text("SELECT service, cost FROM AutospaPricing ORDER BY service")
-                services_result = connection.execute(sql_services)
-                autospa_services = services_result.mappings().all()
-
-                # Filtered Units Table (Using ROW_NUMBER to prevent duplicates)
-                base_where_clauses = []; params = {}
-                locations_to_exclude = ['FrontLine', 'sold', 'Deleted', 'Delivered'];
-                if locations_to_exclude: formatted_locations = ",".join([f"'{loc}'" for loc in locations_to_exclude]); base_where_clauses.append(f"t.location NOT IN ({formatted_locations})")
-                if search_term:
-                    search_like = f"%{search_term}%"; params['search'] = search_like
-                    search_conditions = [ "t.stockNumber LIKE :search", "t.vin LIKE :search", "CAST(t.year AS CHAR) LIKE :search", "t.make LIKE :search", "t.model LIKE :search", "t.location LIKE :search" ]
-                    base_where_clauses.append(f"({' OR '.join(search_conditions)})")
-                where_sql = "";
-                if base_where_clauses: where_sql = "WHERE " + " AND ".join(base_where_clauses)
-
-                # Count distinct units using ROW_NUMBER
-                count_sql_string = f"""
-                    WITH RankedUnits AS (
-                        SELECT
-                            t.stockNumber,
-                            ROW_NUMBER() OVER(PARTITION BY t.stockNumber ORDER BY t.id DESC) as rn
-                        FROM test_db t
-                        {where_sql}
-                    )
-                    SELECT COUNT(*)
-                    FROM RankedUnits
-                    WHERE rn = 1
-                """
-                count_sql = text(count_sql_string)
-                count_params = {"search": params['search']} if 'search' in params else {}
-                total_items = connection.execute(count_sql, count_params).scalar_one()
+            with db_connection() as connection:
+                # Dashboard Counts (units in detail, ready for pickup, notes today), cached in process
+                dashboard_data.update(summary_counters.get(connection))
+
+                # Autospa Services for PO Modal
+                autospa_services = reference_cache.services(connection)
+
+                # Filtered Units Table: current_units has one row per stockNumber; without it, ROW_NUMBER dedupes test_db
+                refresh_current_units()
+                where_sql, params, search_result = dashboard_filters(connection, search_term)
+                def bind_search(statement): return bind_dashboard_filters(statement, params)
+
+                # Count distinct units using ROW_NUMBER (cached: the count only feeds the "Page X of Y" label)
+                count_params = {key: params[key] for key in ('search', 'search_stock_numbers') if key in params}
+                def load_total_items():
+                    if CURRENT_UNITS_READY: count_sql = bind_search(text(f"SELECT COUNT(*) FROM current_units t {where_sql}"))
+                    else:
+                        count_sql = bind_search(text(f"""
+                            WITH RankedUnits AS (
+                                SELECT
+                                    t.stockNumber,
+                                    ROW_NUMBER() OVER(PARTITION BY t.stockNumber ORDER BY t.id DESC) as rn
+                                FROM test_db t
+                                {where_sql}
+                            )
+                            SELECT COUNT(*)
+                            FROM RankedUnits
+                            WHERE rn = 1
+                        """))
+                    return connection.execute(count_sql, count_params).scalar_one()
+                total_items = dashboard_count_cache.get_or_load((where_sql, search_term), load_total_items)
                 total_pages = math.ceil(total_items / per_page)
-                offset = (page - 1) * per_page
 
-                # Fetch distinct units using ROW_NUMBER
+                # Keyset pagination on (dateIn, id): the cursor marks the last (or first) row of the
+                # page we came from, so any page is a range read instead of OFFSET over every earlier row.
+                # Old ?page=N links without a cursor still fall back to OFFSET.
+                cursor = decode_page_cursor(request.args.get('cursor', ''))
+                keyset_sql = ""; offset = 0
+                if cursor:
+                    cursor_date, cursor_id, direction = cursor
+                    comparison = '<' if direction == 'next' else '>'
+                    keyset_sql = f"AND (sort_date {comparison} :cursor_date OR (sort_date = :cursor_date AND id {comparison} :cursor_id))"
+                    params['cursor_date'] = cursor_date; params['cursor_id'] = cursor_id
+                else:
+                    direction = 'next'
+                    offset = (page - 1) * per_page
+                order_sql = "sort_date DESC, id DESC" if direction == 'next' else "sort_date ASC, id ASC"
+
+                # Fetch distinct units (one row per stockNumber, see ranked_units_sql)
                 data_sql_string = f"""
-                    WITH RankedUnits AS (
-                        SELECT
-                            t.id, t.stockNumber, t.vin, t.year, t.make, t.model, t.location, t.dateIn, rs.color as location_color,
-                            ROW_NUMBER() OVER(PARTITION BY t.stockNumber ORDER BY t.id DESC) as rn
-                        FROM test_db t
-                        LEFT JOIN reconStatus rs ON t.location = rs.status
-                        {where_sql}
-                    )
-                    SELECT id, stockNumber, vin, year, make, model, location, dateIn, location_color
+                    WITH RankedUnits AS ({ranked_units_sql(where_sql)})
+                    SELECT id, stockNumber, vin, year, make, model, location, dateIn, sort_date
                     FROM RankedUnits
-                    WHERE rn = 1
-                    ORDER BY dateIn DESC
+                    WHERE rn = 1 {keyset_sql}
+                    ORDER BY {order_sql}
                     LIMIT :limit OFFSET :offset
                 """
-                data_sql = text(data_sql_string)
-                params['limit'] = per_page
+                data_sql = bind_search(text(data_sql_string))
+                params['limit'] = per_page + 1 # One extra row tells us whether another page exists
                 params['offset'] = offset
 
-                units_result = connection.execute(data_sql, params); units_list_processed = []
-                for unit in units_result.mappings().all():
-                    unit_dict = dict(unit); location_color = unit_dict.get('location_color'); unit_dict['text_color'] = get_text_color_for_bg(location_color)
+                unit_rows = connection.execute(data_sql, params).mappings().all()
+                has_more = len(unit_rows) > per_page
+                unit_rows = unit_rows[:per_page]
+                if direction == 'prev': unit_rows = list(reversed(unit_rows))
+                has_next = has_more if direction == 'next' else True
+                has_prev = (cursor is not None or page > 1) if direction == 'next' else has_more
+
+                units_list_processed = []
+                for unit in unit_rows:
+                    unit_dict = dict(unit); location_color = reference_cache.location_color(unit_dict.get('location'), connection); unit_dict['location_color'] = location_color; unit_dict['text_color'] = get_text_color_for_bg(location_color)
                     if is_valid_hex_color(location_color) and not location_color.startswith('#'): unit_dict['location_color'] = '#' + location_color
                     elif not is_valid_hex_color(location_color): unit_dict['location_color'] = None
+                    if search_result: unit_dict['relevance'] = search_result.relevance.get(unit_dict.get('stockNumber'))
                     units_list_processed.append(unit_dict)
 
                 dashboard_data['units_list'] = units_list_processed
-                dashboard_data['pagination'] = { 'page': page, 'per_page': per_page, 'total_items': total_items, 'total_pages': total_pages }; dashboard_data['search_term'] = search_term
+                dashboard_data['pagination'] = {
+                    'page': page, 'per_page': per_page, 'total_items': total_items, 'total_pages': total_pages,
+                    'has_next': has_next and bool(unit_rows), 'has_prev': has_prev and bool(unit_rows),
+                    'next_cursor': encode_page_cursor(unit_rows[-1]['sort_date'], unit_rows[-1]['id'], 'next') if unit_rows else None,
+                    'prev_cursor': encode_page_cursor(unit_rows[0]['sort_date'], unit_rows[0]['id'], 'prev') if unit_rows else None,
+                }
+                dashboard_data['search_term'] = search_term
+                dashboard_data['search_ms'] = round(search_result.elapsed_ms, 1) if search_result else None
+                if search_result and search_result.truncated: dashboard_data['search_fallback'] = f"more than {unit_search.MAX_RESULTS} indexed matches"
+                elif search_result and search_result.short_words: dashboard_data['search_fallback'] = f"words shorter than {unit_search.FULLTEXT_MIN_WORD} characters"
         except SQLAlchemyError as e: print(f"DB error fetching dashboard: {e}"); flash("Could not load dashboard data.", "warning"); dashboard_data['units_list'] = []; dashboard_data['pagination'] = None; dashboard_data['search_term'] = search_term
         except Exception as e: print(f"Unexpected error fetching dashboard: {e}"); flash("Error loading dashboard data.", "warning"); dashboard_data['units_list'] = []; dashboard_data['pagination'] = None; dashboard_data['search_term'] = search_term
 
@@ -267,7 +518,7 @@ def dashboard():
 # --- Route for Overview Calendar ---
 @app.route('/overview')
 @login_required
-def overview_calendar(): return render_template('overview.html')
+def overview_calendar(): return render_template('overview.html', aggregate_threshold=CALENDAR_AGGREGATE_THRESHOLD)
 
 # --- API Route for Calendar Events ---
 @app.route('/api/overview/events')
@@ -280,26 +531,60 @@ def api_overview_events():
         if view_end: datetime.date.fromisoformat(view_end)
     except ValueError: print(f"Invalid date format: start={start_param}, end={end_param}"); return jsonify({"error": "Invalid date format"}), 400
     if not view_start or not view_end: print(f"Missing start/end date: start={start_param}, end={end_param}"); return jsonify({"error": "Missing start or end date parameters"}), 400
+    # aggregate=day returns units per step per day instead of one event per step interval; aggregate=auto does so
+    # only when the range holds more than ?threshold= steps (zoomed-out views)
+    aggregate = request.args.get('aggregate', '', type=str)
+    if aggregate not in ('', 'day', 'auto'): return jsonify({"error": "aggregate must be 'day' or 'auto'"}), 400
+    threshold = max(1, request.args.get('threshold', CALENDAR_AGGREGATE_THRESHOLD, type=int))
     calendar_events = [];
     if not engine: print("API Error: DB connection unavailable."); return jsonify([])
     try:
-        with engine.connect() as connection:
-            sql = text(""" SELECT nds.stockNumber, nds.step, nds.dateIn, nds.dateOut, ns.color as step_color FROM newDaysInStep nds LEFT JOIN newStatus ns ON nds.step = ns.status WHERE nds.dateIn IS NOT NULL AND nds.dateIn < :end_dt AND (nds.dateOut IS NULL OR nds.dateOut > :start_dt) ORDER BY nds.dateIn """)
-            result = connection.execute(sql, {"start_dt": view_start, "end_dt": view_end}); step_data = result.mappings().all()
-            default_bg_color = '#3B82F6'
-            for item in step_data:
-                start_date_obj = item.get('dateIn'); end_date_obj = item.get('dateOut'); step_name = str(item.get('step', ''))
-                start_str = None; end_str = None
-                if isinstance(start_date_obj, (datetime.date, datetime.datetime)): start_str = start_date_obj.strftime('%Y-%m-%d')
-                if isinstance(end_date_obj, (datetime.date, datetime.datetime)): end_str = end_date_obj.strftime('%Y-%m-%d')
-                db_color = item.get('step_color'); event_color = default_bg_color
-                if is_valid_hex_color(db_color): event_color = db_color if db_color.startswith('#') else '#' + db_color
-                text_color = get_text_color_for_bg(event_color)
-                event = { 'title': str(item.get('stockNumber', 'N/A')), 'start': start_str, 'end': end_str if end_str else None, 'extendedProps': { 'description': step_name }, 'backgroundColor': event_color, 'borderColor': event_color, 'textColor': text_color, 'allDay': True }
-                if event['start']: calendar_events.append(event)
+        with db_connection() as connection:
+            # Cheap change token: any new step, closed step or step color edit changes it. The MAX()es each read one end of an
+            # index (no COUNT(*), which scans the whole table); deletes and other writes move the table's UPDATE_TIME where the
+            # server reports it, and everything else is picked up once the time bucket rolls over (CALENDAR_EVENTS_MAX_STALE).
+            token_row = connection.execute(text(""" SELECT MAX(id) AS max_id, MAX(dateIn) AS max_in, MAX(dateOut) AS max_out, (SELECT UPDATE_TIME FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'newDaysInStep') AS updated FROM newDaysInStep """)).one()
+            token = f"{view_start}|{view_end}|{aggregate}|{threshold}|{tuple(token_row)}|{reference_cache.version('step_colors', connection)}|{int(time.time() // CALENDAR_EVENTS_MAX_STALE)}"
+            etag = hashlib.sha1(token.encode()).hexdigest()
+            if request.if_none_match.contains(etag): # FullCalendar refetch with nothing changed
+                response = Response(status=304); response.set_etag(etag); response.headers['Cache-Control'] = 'no-cache'
+                return response
+            cache_key = (view_start, view_end, aggregate, threshold)
+            cached = calendar_events_cache.get(cache_key)
+            if cached and cached[0] == etag: body = cached[1]
+            else:
+                # The index only serves the body when it has caught up with token_row; otherwise a body older than the
+                # token would be cached (and revalidated by browsers) under the new ETag
+                if step_index.is_fresh() and step_index.covers(token_row.max_id, token_row.max_out): step_data = step_index.overlapping(datetime.date.fromisoformat(view_start), datetime.date.fromisoformat(view_end))
+                else:
+                    sql = text(""" SELECT nds.stockNumber, nds.step, nds.dateIn, nds.dateOut FROM newDaysInStep nds WHERE nds.dateIn IS NOT NULL AND nds.dateIn < :end_dt AND (nds.dateOut IS NULL OR nds.dateOut > :start_dt) ORDER BY nds.dateIn """)
+                    result = connection.execute(sql, {"start_dt": view_start, "end_dt": view_end}); step_data = result.mappings().all()
+                default_bg_color = '#3B82F6'
+                if aggregate == 'day' or (aggregate == 'auto' and len(step_data) > threshold):
+                    # Sweep-line over interval endpoints: one event per run of days with the same count, per step
+                    runs = step_intervals.daily_step_counts(step_data, datetime.date.fromisoformat(view_start), datetime.date.fromisoformat(view_end), datetime.date.today())
+                    for step_name, first_day, end_day, count in runs:
+                        db_color = reference_cache.step_color(step_name, connection); event_color = default_bg_color
+                        if is_valid_hex_color(db_color): event_color = db_color if db_color.startswith('#') else '#' + db_color
+                        calendar_events.append({ 'title': f"{step_name}: {count}", 'start': first_day.isoformat(), 'end': end_day.isoformat(), 'extendedProps': { 'description': step_name, 'count': count, 'aggregate': True }, 'backgroundColor': event_color, 'borderColor': event_color, 'textColor': get_text_color_for_bg(event_color), 'allDay': True })
+                    step_data = []
+                for item in step_data:
+                    start_date_obj = item.get('dateIn'); end_date_obj = item.get('dateOut'); step_name = str(item.get('step', ''))
+                    start_str = None; end_str = None
+                    if isinstance(start_date_obj, (datetime.date, datetime.datetime)): start_str = start_date_obj.strftime('%Y-%m-%d')
+                    if isinstance(end_date_obj, (datetime.date, datetime.datetime)): end_str = end_date_obj.strftime('%Y-%m-%d')
+                    db_color = reference_cache.step_color(item.get('step'), connection); event_color = default_bg_color
+                    if is_valid_hex_color(db_color): event_color = db_color if db_color.startswith('#') else '#' + db_color
+                    text_color = get_text_color_for_bg(event_color)
+                    event = { 'title': str(item.get('stockNumber', 'N/A')), 'start': start_str, 'end': end_str if end_str else None, 'extendedProps': { 'description': step_name }, 'backgroundColor': event_color, 'borderColor': event_color, 'textColor': text_color, 'allDay': True }
+                    if event['start']: calendar_events.append(event)
+                body = json.dumps(calendar_events)
+                calendar_events_cache.set(cache_key, (etag, body))
     except SQLAlchemyError as e: print(f"DB error fetching API overview events: {e}"); return jsonify([])
     except Exception as e: print(f"Unexpected error fetching API overview events: {e}"); return jsonify([])
-    return jsonify(calendar_events)
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag); response.headers['Cache-Control'] = 'no-cache' # Browser keeps the body but revalidates every refetch
+    return response
 
 # --- Admin Routes ---
 @app.route('/admin/create_user', methods=['GET', 'POST'])
@@ -318,9 +603,9 @@ def create_user():
         try: hashed_password_output = utils.hash_password(password_input)
         except Exception as e: print(f"Error hashing password: {e}"); flash("Failed to process password.", "danger"); return render_template('admin/create_user.html', username=username_input, selected_role=role)
         try:
-            with engine.connect() as connection:
+            with db_connection() as connection:
                 sql = text("INSERT INTO users (userName, password, role) VALUES (:username_param, :password_param, :role)")
-                with connection.begin(): connection.execute(sql, { "username_param": username_input, "password_param": hashed_password_output, "role": role })
+                with db_transaction(): connection.execute(sql, { "username_param": username_input, "password_param": hashed_password_output, "role": role })
             flash(f"User '{username_input}' created successfully!", "success"); return redirect(url_for('create_user'))
         except IntegrityError: flash(f"Username '{username_input}' already exists.", "danger")
         except SQLAlchemyError as e: print(f"DB error creating user: {e}"); flash("Failed to create user.", "danger")
@@ -335,10 +620,26 @@ def view_active_jobs():
     if not engine: flash("Database connection is not available.", "danger")
     else:
         try:
-            with engine.connect() as connection:
+            with db_connection() as connection:
                 current_year = datetime.datetime.now().year
-                sql = text(""" SELECT nds.id as step_id, nds.stockNumber, nds.step, nds.dateIn, nds.dateOut, t.year, t.make, t.model FROM newDaysInStep nds LEFT JOIN test_db t ON nds.stockNumber = t.stockNumber WHERE nds.dateIn IS NOT NULL AND nds.dateOut IS NOT NULL AND DATE(nds.dateIn) = DATE(nds.dateOut) AND YEAR(nds.dateIn) = :current_year ORDER BY nds.dateIn DESC LIMIT 100 """)
-                result = connection.execute(sql, {"current_year": current_year}); steps_list = result.mappings().all()
+                refresh_current_units()
+                if step_index.is_fresh():
+                    # Steps started and finished on the same day this year, newest first, from the interval index
+                    year_steps = step_index.started_between(*date_ranges.year_range(current_year), newest_first=True)
+                    steps_list = [dict(step, step_id=step['id']) for step in year_steps
+                                  if step['dateOut'] is not None and step['dateIn'].date() == step['dateOut'].date()][:100]
+                    stock_numbers = list({step['stockNumber'] for step in steps_list if step['stockNumber']})
+                    if stock_numbers:
+                        sql_units = text(f"SELECT stockNumber, year, make, model FROM {units_table_sql()} WHERE stockNumber IN :sns").bindparams(sqlalchemy.bindparam('sns', expanding=True))
+                        units = {row['stockNumber']: row for row in connection.execute(sql_units, {"sns": stock_numbers}).mappings()}
+                        for step in steps_list:
+                            unit = units.get(step['stockNumber']) or {}
+                            step.update(year=unit.get('year'), make=unit.get('make'), model=unit.get('model'))
+                    return render_template('view_active.html', steps=steps_list)
+                sql = text(f""" SELECT nds.id as step_id, nds.stockNumber, nds.step, nds.dateIn, nds.dateOut, t.year, t.make, t.model FROM newDaysInStep nds LEFT JOIN {units_table_sql()} t ON nds.stockNumber = t.stockNumber WHERE nds.dateIn IS NOT NULL AND nds.dateOut IS NOT NULL AND nds.dateIn >= :year_start AND nds.dateIn < :year_end AND nds.dateOut >= DATE(nds.dateIn) AND nds.dateOut < DATE(nds.dateIn) + INTERVAL 1 DAY ORDER BY nds.dateIn DESC LIMIT 100 """)
+                # dateIn is range-filtered (index-friendly); the same-day test only runs on the rows in that range
+                year_start, year_end = date_ranges.year_range(current_year)
+                result = connection.execute(sql, {"year_start": year_start, "year_end": year_end}); steps_list = result.mappings().all()
         except SQLAlchemyError as e: print(f"DB error fetching active steps list: {e}"); flash("Could not load active steps list.", "danger")
         except Exception as e: print(f"Unexpected error fetching active steps list: {e}"); flash("Error loading active steps list.", "danger")
     return render_template('view_active.html', steps=steps_list)
@@ -351,12 +652,23 @@ def admin_services():
     if not engine: flash("Database connection is not available.", "danger")
     else:
         try:
-            with engine.connect() as connection:
-                 sql = text("SELECT id, service, cost FROM AutospaPricing ORDER BY service"); result = connection.execute(sql); services_data = result.mappings().all()
+            with db_connection() as connection:
+                 services_data = reference_cache.services(connection)
         except SQLAlchemyError as e: print(f"DB error fetching services: {e}"); flash("Could not load services.", "danger")
         except Exception as e: print(f"Unexpected error fetching services: {e}"); flash("Error loading services.", "danger")
     return render_template('admin/services.html', services=services_data)
 
+@app.route('/admin/reference_data', methods=['GET', 'POST'])
+@login_required
+@admin_required
+def admin_reference_data():
+    """GET returns reference-data cache metrics; POST drops the cache (optionally ?name=<dataset>) after editing a table by hand."""
+    if request.method == 'POST':
+        name = request.args.get('name') or None
+        if name and name not in reference_cache.datasets: return jsonify({"error": f"Unknown dataset '{name}'"}), 400
+        reference_cache.invalidate(name)
+    return jsonify(reference_cache.stats())
+
 @app.route('/admin/manage_users')
 @login_required
 @admin_required
@@ -367,7 +679,7 @@ def manage_users():
         flash("Database connection is not available.", "danger")
     else:
         try:
-            with engine.connect() as connection:
+            with db_connection() as connection:
                 # Fetch all users except potentially the super admin if needed
                 # Adjust query as necessary
                 sql = text("SELECT id, userName, role FROM users ORDER BY userName ASC")
@@ -403,8 +715,8 @@ def admin_reset_password(user_id):
         # Hash the new password
         hashed_password_output = utils.hash_password(new_password)
 
-        with engine.connect() as connection:
-            with connection.begin():
+        with db_connection() as connection:
+            with db_transaction():
                 # Get username for flash message (optional)
                 sql_get_user = text("SELECT userName FROM users WHERE id = :uid")
                 username = connection.execute(sql_get_user, {"uid": user_id}).scalar_one_or_none()
@@ -434,122 +746,60 @@ def admin_reset_password(user_id):
 def unit_info(stock_number):
     """Displays details for a specific unit."""
     unit_details = { "stockNumber": stock_number }
-    steps_history = []
-    notes_list = []
     current_jobs = []
-    tech_list = []
-    inventory_exists = False
-    inventory_data = None
-    checkout_complete = False
-    images = []
-    pos = []
-    autospa_services = [] # For PO Modal
-    unit_chats = [] # Initialize chat list
+    bundle = unit_loader.UnitBundle(stock_number=stock_number)
 
     if not engine: flash("Database connection is not available.", "danger")
     else:
         try:
-            with engine.connect() as connection:
-                # Fetch main unit info
-                sql_main = text("SELECT * FROM test_db WHERE stockNumber = :sn LIMIT 1")
-                result_main = connection.execute(sql_main, {"sn": stock_number}); unit_db_data = result_main.mappings().first()
-                if unit_db_data: unit_details.update(unit_db_data)
-                else: flash(f"Could not find details for unit {stock_number}.", "warning")
-
-                # Fetch latest inventory data (if exists)
-                sql_get_inv = text("""
-                    SELECT stockNumber, lockingNutsIn, manualsIn, jacksIn, tunneauCoverIn,
-                           floorMatsIn, cargoMatsIn, blockHeaterCordIn, changed,
-                           lockingNutsOut, manualsOut, jacksOut, tunneauCoverOut,
-                           floorMatsOut, cargoMatsOut, blockHeaterCordOut, checkOut
-                    FROM unitInventory WHERE stockNumber = :sn ORDER BY changed DESC LIMIT 1
-                """)
-                inventory_result = connection.execute(sql_get_inv, {"sn": stock_number})
-                inventory_data = inventory_result.mappings().first()
-                inventory_exists = inventory_data is not None
-                if inventory_data and inventory_data.get('checkOut') == 1:
-                    checkout_complete = True
-
-                # Fetch Images
-                sql_images = text("SELECT image FROM images WHERE stockNumber = :sn ORDER BY id")
-                images_result = connection.execute(sql_images, {"sn": stock_number})
-                images = [row['image'] for row in images_result.mappings().all()]
-
-                # Fetch steps history
-                sql_steps = text("SELECT id, step, dateIn, dateOut FROM newDaysInStep WHERE stockNumber = :sn ORDER BY dateIn DESC")
-                steps_result = connection.execute(sql_steps, {"sn": stock_number}); steps_history = steps_result.mappings().all()
-                # Fetch notes
-                sql_notes = text("SELECT id, notes, dateTime, status FROM notes WHERE stockNumber = :sn ORDER BY dateTime DESC")
-                notes_result = connection.execute(sql_notes, {"sn": stock_number}); notes_list = notes_result.mappings().all()
-                # Fetch current jobs from JOBS table
-                sql_current_jobs = text(""" SELECT j.id as job_id, j.status, j.dateAdded, j.job1, j.priority, j.notes as job_notes, j.tech as assigned_tech_id, tech.techName as assigned_tech_name
-                                            FROM jobs j LEFT JOIN techs tech ON j.tech = tech.techNumber
-                                            WHERE j.stockNumber = :sn AND (j.status IS NULL OR j.status != 'Completed') ORDER BY j.dateAdded DESC """)
-                jobs_result = connection.execute(sql_current_jobs, {"sn": stock_number})
-                processed_jobs = []
-                for job in jobs_result.mappings().all():
-                    job_dict = dict(job)
-                    original_job1 = job_dict.get('job1')
-                    job_dict['job_description_display'] = truncate_description(original_job1)
-                    processed_jobs.append(job_dict)
-                current_jobs = processed_jobs
-
-                # Fetch list of techs for assignment dropdown
-                sql_techs = text("SELECT techNumber, techName FROM techs ORDER BY techName")
-                techs_result = connection.execute(sql_techs); tech_list = techs_result.mappings().all()
-
-                # Fetch POs
-                sql_pos = text("""
-                    SELECT po, dateIn, service, status
-                    FROM preApproved
-                    WHERE stockNumber = :sn
-                    ORDER BY dateIn DESC
-                """)
-                pos_result = connection.execute(sql_pos, {"sn": stock_number})
-                pos = pos_result.mappings().all()
-
-                # Fetch Autospa Services for PO Modal
-                sql_services = text("SELECT service, cost FROM AutospaPricing ORDER BY service")
-                services_result = connection.execute(sql_services)
-                autospa_services = services_result.mappings().all()
-
-                # Fetch chat messages related to this stock number
-                inspector = sqlalchemy.inspect(engine)
-                if inspector.has_table("chat_messages"):
-                    sql_chats = text("""
-                        SELECT cm.message_id, cm.sender_id, cm.recipient_id, cm.message_text, cm.timestamp, cm.is_read,
-                               sender.userName as sender_username, recipient.userName as recipient_username
-                        FROM chat_messages cm
-                        JOIN users sender ON cm.sender_id = sender.id
-                        JOIN users recipient ON cm.recipient_id = recipient.id
-                        WHERE cm.stockNumber = :sn
-                        ORDER BY cm.timestamp ASC
-                    """)
-                    chats_result = connection.execute(sql_chats, {"sn": stock_number})
-                    unit_chats = chats_result.mappings().all()
-                else:
-                    print("Warning: chat_messages table not found. Skipping chat fetch for unit info.")
-
-
+            # Only the header and open jobs are loaded here (partly on this request's connection, partly on
+            # free loader workers); the other sections are fetched by the page from unit_section when first shown
+            with db_connection() as connection:
+                bundle = unit_loader.load_unit(engine, stock_number, reference_cache, connection)
+            if bundle.unit: unit_details.update(bundle.unit)
+            elif 'main' not in bundle.errors: flash(f"Could not find details for unit {stock_number}.", "warning")
+            if bundle.errors: flash("Could not load all unit details.", "warning")
+
+            for job in bundle.jobs:
+                job_dict = dict(job)
+                job_dict['job_description_display'] = truncate_description(job_dict.get('job1'))
+                current_jobs.append(job_dict)
         except Exception as e: print(f"Error fetching unit details for {stock_number}: {e}"); flash("Could not load all unit details.", "warning")
 
     # Pass all data to the template
-    return render_template('unit_info.html',
+    response = app.make_response(render_template('unit_info.html',
                            unit=unit_details,
-                           steps=steps_history,
-                           notes=notes_list,
                            jobs=current_jobs,
-                           techs=tech_list,
-                           inventory_exists=inventory_exists,
-                           inventory_data=inventory_data,
-                           checkout_complete=checkout_complete,
-                           images=images,
-                           pos=pos,
-                           autospa_services=autospa_services,
-                           unit_chats=unit_chats) # <-- Pass chats
-
-
-
+                           techs=bundle.techs,
+                           inventory_exists=bundle.inventory is not None,
+                           inventory_data=bundle.inventory,
+                           checkout_complete=bundle.checkout_complete,
+                           autospa_services=bundle.services))
+    if bundle.timings: response.headers['Server-Timing'] = bundle.server_timing()
+    return response
+
+# --- Lazily Loaded unit_info Sections ---
+UNIT_SECTION_TEMPLATES = {
+    'steps': '_unit_steps.html', 'notes': '_unit_notes.html', 'chats': '_unit_chats.html',
+    'pos': '_unit_pos.html', 'images': '_unit_images.html',
+}
+
+@app.route('/unit/<string:stock_number>/<any(steps, notes, chats, pos, images):section>')
+@login_required
+def unit_section(stock_number, section):
+    """Returns one page of a unit_info section as an HTML fragment in JSON (?offset=, ?limit=)."""
+    offset = max(0, request.args.get('offset', 0, type=int))
+    limit = request.args.get('limit', unit_loader.SECTION_PAGE_SIZE, type=int)
+    rows = []; has_more = False
+    if not engine: return jsonify({"error": "Database connection is not available."}), 503
+    if section != 'chats' or CHAT_TABLE_EXISTS:
+        try:
+            with db_connection() as connection:
+                rows, has_more = unit_loader.load_section(connection, section, stock_number, offset, limit)
+        except SQLAlchemyError as e: print(f"DB error fetching {section} for unit {stock_number}: {e}"); return jsonify({"error": f"Database error loading {section}."}), 500
+    html = render_template(UNIT_SECTION_TEMPLATES[section], items=rows, offset=offset, stock_number=stock_number)
+    return jsonify({"section": section, "html": html, "count": len(rows), "offset": offset,
+                    "next_offset": offset + len(rows), "has_more": has_more})
 
 # --- Route for Ready for Pickup List ---
 @app.route('/ready_pickup')
@@ -560,8 +810,9 @@ def ready_for_pickup():
     if not engine: flash("Database connection is not available.", "danger")
     else:
         try:
-            with engine.connect() as connection:
-                sql = text(""" SELECT id, stockNumber, vin, year, make, model, location, dateIn FROM test_db WHERE location = 'Ready for Pickup' ORDER BY dateIn DESC """)
+            with db_connection() as connection:
+                refresh_current_units()
+                sql = text(f""" SELECT id, stockNumber, vin, year, make, model, location, dateIn FROM {units_table_sql()} WHERE location = 'Ready for Pickup' ORDER BY dateIn DESC """)
                 result = connection.execute(sql); units_list = result.mappings().all()
         except SQLAlchemyError as e: print(f"DB error fetching ready for pickup list: {e}"); flash("Could not load ready for pickup list.", "danger")
         except Exception as e: print(f"Unexpected error fetching ready for pickup list: {e}"); flash("Error loading ready for pickup list.", "danger")
@@ -575,12 +826,15 @@ def unit_pickup(stock_number):
     """Updates the unit's location and access2 when picked up."""
     if not engine: flash("Database connection is not available.", "danger"); return redirect(url_for('ready_for_pickup'))
     try:
-        with engine.connect() as connection:
-            with connection.begin():
+        with db_connection() as connection:
+            with db_transaction():
                 sql = text(""" UPDATE test_db SET location = :new_location, access2 = :new_access2 WHERE stockNumber = :stock_num """)
                 result = connection.execute(sql, { "new_location": "Autospa Pickup", "new_access2": "Autosp Admin", "stock_num": stock_number })
+                if result.rowcount > 0 and SEARCH_TABLE_EXISTS: unit_search.sync_unit(connection, stock_number) # Keep location search current
+                if result.rowcount > 0 and CURRENT_UNITS_READY: current_units.sync_unit(connection, stock_number)
                 if result.rowcount > 0: flash(f"Unit {stock_number} marked as picked up.", "success")
                 else: flash(f"Unit {stock_number} not found or already updated.", "warning")
+            if result.rowcount > 0: summary_counters.invalidate('ready_pickup_count') # After commit, so a re-count sees the change
     except SQLAlchemyError as e: print(f"DB error updating unit {stock_number}: {e}"); flash("Database error marking unit as picked up.", "danger")
     except Exception as e: print(f"Unexpected error updating unit {stock_number}: {e}"); flash("An unexpected error occurred.", "danger")
     return redirect(url_for('ready_for_pickup'))
@@ -596,8 +850,8 @@ def assign_job(job_id):
     if priority is None: priority = '' # Store empty string if nothing entered
     if not engine: flash("Database connection is not available.", "danger"); return redirect(request.referrer or url_for('dashboard'))
     try:
-        with engine.connect() as connection:
-            with connection.begin():
+        with db_connection() as connection:
+            with db_transaction():
                 # Get stock number from JOBS table
                 sql_get_stock = text("SELECT stockNumber FROM jobs WHERE id = :jid LIMIT 1")
                 stock_result = connection.execute(sql_get_stock, {"jid": job_id}).scalar_one_or_none()
@@ -607,8 +861,7 @@ def assign_job(job_id):
                 sql_update = text("UPDATE jobs SET tech = :tid, priority = :priority WHERE id = :jid")
                 result = connection.execute(sql_update, {"tid": tech_id, "jid": job_id, "priority": priority})
                 if result.rowcount > 0:
-                    sql_tech_name = text("SELECT techName FROM techs WHERE techNumber = :tid LIMIT 1")
-                    tech_name = connection.execute(sql_tech_name, {"tid": tech_id}).scalar_one_or_none() or f"Tech ID {tech_id}"
+                    tech_name = next((tech['techName'] for tech in reference_cache.techs(connection) if str(tech['techNumber']) == str(tech_id)), None) or f"Tech ID {tech_id}"
                     flash(f"Job {job_id} assigned to {tech_name} with priority '{priority}'.", "success")
                 else: flash(f"Could not update Job ID {job_id}.", "warning")
     except SQLAlchemyError as e: print(f"DB error assigning job {job_id}: {e}"); flash("Database error assigning job.", "danger")
@@ -623,8 +876,8 @@ def stock_in_unit(stock_number):
     print(f"DEBUG (stock_in_unit): Received POST for stock number {stock_number}")
     if not engine: flash("Database connection is not available.", "danger"); return redirect(url_for('unit_info', stock_number=stock_number))
     try:
-        with engine.connect() as connection:
-            with connection.begin(): # Start transaction
+        with db_connection() as connection:
+            with db_transaction(): # Start transaction
                 print(f"DEBUG (stock_in_unit): Checking existing inventory...")
                 sql_check = text("SELECT COUNT(*) FROM unitInventory WHERE stockNumber = :sn")
                 count = connection.execute(sql_check, {"sn": stock_number}).scalar_one()
@@ -695,8 +948,8 @@ def check_out_unit(stock_number):
             WHERE stockNumber = :stock_num
         """)
 
-        with engine.connect() as connection:
-            with connection.begin(): # Use transaction
+        with db_connection() as connection:
+            with db_transaction(): # Use transaction
                 print(f"DEBUG (check_out_unit): Attempting to update inventory. Data: {update_data}")
                 result = connection.execute(sql, update_data)
                 print(f"DEBUG (check_out_unit): UPDATE result rowcount: {result.rowcount}")
@@ -711,37 +964,93 @@ def check_out_unit(stock_number):
 @app.route('/unit/add_image/<string:stock_number>', methods=['POST'])
 @login_required
 def add_image(stock_number):
-    """Handles image upload, encodes to Base64, and saves to DB."""
+    """Handles image upload, streams it into the image store, and records its hash in the DB."""
     if 'image_file' not in request.files: flash('No file part in the request.', 'warning'); return redirect(url_for('unit_info', stock_number=stock_number))
     file = request.files['image_file']
     if file.filename == '': flash('No selected file.', 'warning'); return redirect(url_for('unit_info', stock_number=stock_number))
 
     if file and allowed_file(file.filename):
         try:
-            image_bytes = file.read()
-            base64_encoded_data = base64.b64encode(image_bytes)
-            base64_string = base64_encoded_data.decode('utf-8')
-
-            image_data = {
-                'stockNumber': stock_number,
-                'image': base64_string,
-            }
-
             if not engine: flash("Database connection is not available.", "danger"); return redirect(url_for('unit_info', stock_number=stock_number))
-            with engine.connect() as connection:
-                with connection.begin():
-                    sql = text("""
-                        INSERT INTO images (stockNumber, image)
-                        VALUES (:stockNumber, :image)
-                    """)
+            if IMAGE_STORE_READY:
+                # Copy the upload to disk in chunks; only the hash and metadata go into MySQL
+                sha256, byte_size, sniffed_type = image_store.save_stream(file.stream)
+                image_data = {
+                    'stockNumber': stock_number,
+                    'sha256': sha256,
+                    'content_type': sniffed_type, # From the file's bytes; the client's Content-Type is not trusted
+                    'byte_size': byte_size,
+                }
+                sql = text("""
+                    INSERT INTO images (stockNumber, sha256, content_type, byte_size)
+                    VALUES (:stockNumber, :sha256, :content_type, :byte_size)
+                """)
+            else:
+                # Legacy schema: store Base64 text in images.image
+                image_data = {
+                    'stockNumber': stock_number,
+                    'image': base64.b64encode(file.read()).decode('utf-8'),
+                }
+                sql = text("""
+                    INSERT INTO images (stockNumber, image)
+                    VALUES (:stockNumber, :image)
+                """)
+
+            with db_connection() as connection:
+                with db_transaction():
                     connection.execute(sql, image_data)
+            if 'sha256' in image_data: rendition_pipeline.submit(image_data['sha256']) # Row is committed; build thumbnails off the request thread
             flash('Image uploaded successfully!', 'success')
+        except image_store.UnsupportedImageType: flash('Invalid file type. Allowed types are: png, jpg, jpeg, gif, webp', 'warning')
         except FileNotFoundError: flash('Error reading uploaded file.', 'danger')
         except SQLAlchemyError as e: print(f"DB error saving image for {stock_number}: {e}"); flash('Database error saving image.', 'danger')
         except Exception as e: print(f"Unexpected error saving image for {stock_number}: {e}"); flash('An unexpected error occurred while saving the image.', 'danger')
     else: flash('Invalid file type. Allowed types are: png, jpg, jpeg, gif, webp', 'warning')
     return redirect(url_for('unit_info', stock_number=stock_number))
 
+@app.route('/unit/<string:stock_number>/image/<int:image_id>')
+@login_required
+def unit_image(stock_number, image_id):
+    """Serves one unit image with an ETag (its SHA-256) so browsers can revalidate or cache it.
+
+    ?size=thumb or ?size=medium serves a generated rendition; while it is pending
+    (or if it failed) the original is served instead.
+    """
+    size = request.args.get('size', 'original')
+    if size != 'original' and size not in image_renditions.RENDITIONS: abort(404)
+    if not engine: abort(404)
+    columns = "id, sha256, content_type, image" if IMAGE_STORE_READY else "id, NULL AS sha256, NULL AS content_type, image"
+    try:
+        with db_connection() as connection:
+            sql = text(f"SELECT {columns} FROM images WHERE id = :image_id AND stockNumber = :sn")
+            row = connection.execute(sql, {"image_id": image_id, "sn": stock_number}).mappings().first()
+    except SQLAlchemyError as e:
+        print(f"DB error fetching image {image_id} for {stock_number}: {e}"); abort(404)
+    if not row: abort(404)
+
+    sha256 = row['sha256']
+    if sha256 and size != 'original':
+        rendition_path = rendition_pipeline.get_path(sha256, size)
+        if rendition_path:
+            return send_file(rendition_path, mimetype='image/jpeg', etag=f"{sha256}-{size}",
+                             conditional=True, max_age=IMAGE_MAX_AGE)
+    # A rendition request answered with the original must only be cached briefly, until the rendition is ready
+    max_age = IMAGE_MAX_AGE if size == 'original' else 60
+    if sha256 and image_store.exists(sha256):
+        # conditional=True answers If-None-Match with 304; the file itself goes out via sendfile/file_wrapper
+        # Rows written before content types were sniffed may carry a client-supplied type; only serve image types inline
+        content_type = row['content_type'] if row['content_type'] in image_store.ALLOWED_CONTENT_TYPES else 'application/octet-stream'
+        return send_file(image_store.blob_path(sha256), mimetype=content_type,
+                         etag=sha256, conditional=True, max_age=max_age)
+    if row['image']:
+        # Row not yet converted by migrate_images.py: decode the Base64 text
+        try: image_bytes = base64.b64decode(row['image'])
+        except (ValueError, TypeError): print(f"Invalid Base64 data for image {image_id}"); abort(404)
+        return send_file(io.BytesIO(image_bytes), mimetype=image_store.sniff_content_type(image_bytes[:16], 'image/jpeg'),
+                         etag=hashlib.sha256(image_bytes).hexdigest(), conditional=True, max_age=max_age)
+    print(f"Image {image_id} for {stock_number} has no stored data (sha256={sha256})")
+    abort(404)
+
 # --- Route to Handle Note Addition ---
 @app.route('/unit/add_note/<string:stock_number>', methods=['POST'])
 @login_required
@@ -772,11 +1081,12 @@ def add_note(stock_number):
         """)
         # --- END MODIFIED ---
 
-        with engine.connect() as connection:
-            with connection.begin():
+        with db_connection() as connection:
+            with db_transaction():
                 print(f"DEBUG (add_note): Attempting to insert note. Data: {note_data}")
                 connection.execute(sql, note_data)
                 print(f"DEBUG (add_note): INSERT appeared successful.")
+        summary_counters.invalidate('notes_today_count')
         flash('Note added successfully.', 'success')
 
     except SQLAlchemyError as e:
@@ -812,15 +1122,16 @@ def notes_history():
         flash("Database connection is not available.", "danger")
     else:
         try:
-            with engine.connect() as connection:
+            with db_connection() as connection:
                 # Assuming 'dateTime' column exists and stores date/time
                 sql = text("""
                     SELECT stockNumber, notes, dateTime, status
                     FROM notes
-                    WHERE DATE(dateTime) = :selected_date
+                    WHERE dateTime >= :day_start AND dateTime < :day_end
                     ORDER BY dateTime DESC
                 """)
-                result = connection.execute(sql, {"selected_date": selected_date})
+                day_start, day_end = date_ranges.day_range(selected_date) # Half-open range instead of DATE(dateTime), so the dateTime index is usable
+                result = connection.execute(sql, {"day_start": day_start, "day_end": day_end})
                 notes_for_date = result.mappings().all()
         except SQLAlchemyError as e:
             print(f"DB error fetching notes for date {selected_date}: {e}")
@@ -845,15 +1156,6 @@ def create_po(stock_number):
     custom_service_costs = request.form.getlist('custom_service_cost[]')
     now = datetime.datetime.now(datetime.UTC) # Use timezone-aware UTC
 
-    # --- DEBUGGING: Print received form data ---
-    print(f"DEBUG (create_po): Received POST for stock# {stock_number}")
-    print(f"DEBUG (create_po): Source = {source}")
-    print(f"DEBUG (create_po): PO Number = {po_number}")
-    print(f"DEBUG (create_po): Standard Services = {standard_services}")
-    print(f"DEBUG (create_po): Custom Names = {custom_service_names}")
-    print(f"DEBUG (create_po): Custom Costs = {custom_service_costs}")
-    # --- END DEBUGGING ---
-
     # Basic validation
     if source == 'dashboard' and not po_number:
         flash('PO Number is required when creating from Dashboard.', 'warning')
@@ -868,28 +1170,31 @@ def create_po(stock_number):
         return redirect(request.referrer or url_for('dashboard'))
 
     services_to_add = [] # List to hold tuples of (service_name, cost)
-    cost_map = {}        # Dictionary for standard service costs
+    job_status = 'Approved' if source == 'dashboard' else 'Pending'
 
     try:
-        # --- Step 1: Get costs and compile services (outside transaction) ---
-        with engine.connect() as connection: # Connection just for fetching costs
-             if standard_services:
-                 sql_get_costs = text("SELECT service, cost FROM AutospaPricing")
-                 cost_map = {row['service']: row['cost'] for row in connection.execute(sql_get_costs).mappings()}
-                 for service_name in standard_services:
-                    cost = cost_map.get(service_name)
-                    if cost is not None:
-                        try:
-                            services_to_add.append((service_name, Decimal(cost)))
-                        except (InvalidOperation, TypeError):
-                             print(f"Warning: Invalid cost format '{cost}' for standard service '{service_name}'. Skipping.")
-                             flash(f"Invalid cost format for standard service '{service_name}'. Skipping.", "warning")
-                    else:
-                        print(f"Warning: Cost not found for standard service '{service_name}'. Skipping.")
-                        flash(f"Cost not found for standard service '{service_name}'. Skipping.", "warning")
+        # One connection and transaction: price the selected services, then write every row with one
+        # batched (executemany) INSERT per table
+        with db_transaction() as connection:
+            # --- Step 1: Get costs for the selected standard services and compile services ---
+            cost_map = {}
+            if standard_services:
+                sql_costs = text("SELECT service, cost FROM AutospaPricing WHERE service IN :services").bindparams(sqlalchemy.bindparam('services', expanding=True))
+                cost_map = {row.service: row.cost for row in connection.execute(sql_costs, {"services": list(set(standard_services))})}
+            for service_name in standard_services:
+                cost = cost_map.get(service_name)
+                if cost is not None:
+                    try:
+                        services_to_add.append((service_name, Decimal(cost)))
+                    except (InvalidOperation, TypeError):
+                        print(f"Warning: Invalid cost format '{cost}' for standard service '{service_name}'. Skipping.")
+                        flash(f"Invalid cost format for standard service '{service_name}'. Skipping.", "warning")
+                else:
+                    print(f"Warning: Cost not found for standard service '{service_name}'. Skipping.")
+                    flash(f"Cost not found for standard service '{service_name}'. Skipping.", "warning")
 
-             # Add custom services
-             for i, name in enumerate(custom_service_names):
+            # Add custom services
+            for i, name in enumerate(custom_service_names):
                 name = name.strip()
                 if name and i < len(custom_service_costs):
                     try:
@@ -899,70 +1204,34 @@ def create_po(stock_number):
                     except InvalidOperation:
                         print(f"Warning: Invalid cost format '{custom_service_costs[i]}' for custom service '{name}'. Skipping.")
                         flash(f"Invalid cost format for custom service '{name}'. Skipping.", "warning")
-                    except IndexError:
-                         print(f"Warning: Missing cost for custom service '{name}'. Skipping.")
-                         flash(f"Missing cost for custom service '{name}'. Skipping.", "warning")
-
-        # --- Step 2: Validate if there's anything to add ---
-        if not services_to_add:
-             flash('No valid services to add.', 'warning')
-             print("DEBUG (create_po): No valid services compiled.")
-             return redirect(request.referrer or url_for('unit_info', stock_number=stock_number))
-
-        print(f"DEBUG (create_po): Compiled services_to_add = {services_to_add}")
-
-        # --- Step 3: Perform inserts within a single transaction ---
-        with engine.connect() as connection: # New connection for the transaction
-            with connection.begin(): # Start the transaction
-                job_status = 'Approved' if source == 'dashboard' else 'Pending'
-                print(f"DEBUG (create_po): Determined job_status = {job_status}")
-
-                for service_name, cost in services_to_add:
-                    # 1. Insert into jobs table
-                    job1_description = service_name # Use only service name
-
-                    # Assumes 'jobs' table has stockNumber, job1, status, priority, complete
-                    sql_insert_job = text("""
-                        INSERT INTO jobs (stockNumber, job1, status, priority, complete)
-                        VALUES (:stockNumber, :job1, :status, :priority, :complete)
-                    """)
-                    job_params = {
-                        'stockNumber': stock_number,
-                        'job1': job1_description,
-                        'status': job_status,
-                        'priority': 0, # Set default priority
-                        'complete': 1 # Set complete to 1
-                        # 'dateAdded': now, # Removed - Assuming DB handles this
-                        # 'poNumber': po_number if po_number else None # Removed - Column doesn't exist
-                    }
 
-                    print(f"DEBUG (create_po): Attempting to insert into jobs: {job_params}")
-                    connection.execute(sql_insert_job, job_params)
-                    print(f"DEBUG (create_po): Inserted into jobs for service: {service_name}")
-
-                    # 2. Insert into preApproved table ONLY if source is dashboard and PO# exists
-                    if source == 'dashboard' and po_number:
-                        # Assumes 'preApproved' table has stockNumber, po, service, status, dateIn
-                        sql_insert_preapproved = text("""
-                            INSERT INTO preApproved (stockNumber, po, service, status, dateIn)
-                            VALUES (:stockNumber, :po, :service, :status, :dateIn)
-                        """)
-                        preapp_params = {
-                            'stockNumber': stock_number,
-                            'po': po_number,
-                            'service': service_name, # Use the specific service name
-                            'status': 'Approved', # Always Approved for preApproved table
-                            'dateIn': now
-                        }
-                        print(f"DEBUG (create_po): Attempting to insert into preApproved: {preapp_params}")
-                        connection.execute(sql_insert_preapproved, preapp_params)
-                        print(f"DEBUG (create_po): Inserted into preApproved for service: {service_name}")
-                    elif source == 'dashboard':
-                         print(f"DEBUG (create_po): Skipping preApproved insert because PO Number is missing (source: dashboard).")
-                    else:
-                         print(f"DEBUG (create_po): Skipping preApproved insert because source is '{source}'.")
+            # --- Step 2: Validate if there's anything to add ---
+            if not services_to_add:
+                flash('No valid services to add.', 'warning')
+                return redirect(request.referrer or url_for('unit_info', stock_number=stock_number))
 
+            # --- Step 3: Batch inserts ---
+            # Assumes 'jobs' table has stockNumber, job1, status, priority, complete (dateAdded is set by the DB)
+            sql_insert_job = text("""
+                INSERT INTO jobs (stockNumber, job1, status, priority, complete)
+                VALUES (:stockNumber, :job1, :status, :priority, :complete)
+            """)
+            connection.execute(sql_insert_job, [
+                {'stockNumber': stock_number, 'job1': service_name, 'status': job_status, 'priority': 0, 'complete': 1}
+                for service_name, _ in services_to_add])
+
+            # preApproved rows ONLY if source is dashboard and PO# exists
+            if source == 'dashboard' and po_number:
+                # Assumes 'preApproved' table has stockNumber, po, service, status, dateIn
+                sql_insert_preapproved = text("""
+                    INSERT INTO preApproved (stockNumber, po, service, status, dateIn)
+                    VALUES (:stockNumber, :po, :service, :status, :dateIn)
+                """)
+                connection.execute(sql_insert_preapproved, [
+                    {'stockNumber': stock_number, 'po': po_number, 'service': service_name, 'status': 'Approved', 'dateIn': now}
+                    for service_name, _ in services_to_add])
             # Transaction commits here if successful
+        summary_counters.invalidate('units_in_detail')
 
         flash(f"Successfully added {len(services_to_add)} service(s) as jobs.", "success")
         if source == 'dashboard' and po_number:
@@ -970,10 +1239,7 @@ def create_po(stock_number):
 
     except SQLAlchemyError as e:
         print(f"DB ERROR (create_po): {e}") # Log DB errors
-        flash('Database error processing request.', 'danger')
-        # Rollback might happen automatically with 'with connection.begin()' on error,
-        # but explicitly mentioning it helps understanding.
-        print("DB Transaction likely rolled back.")
+        flash('Database error processing request.', 'danger') # db_transaction() rolled the transaction back
     except Exception as e:
         print(f"UNEXPECTED ERROR (create_po): {e}") # Log other errors
         flash('An unexpected error occurred.', 'danger')
@@ -985,33 +1251,41 @@ def create_po(stock_number):
         return redirect(url_for('unit_info', stock_number=stock_number))
 
 # --- Route for Completed Jobs by Unit ---
-# Using standard decorator registration
+# Units are grouped in SQL and paged by stockNumber (keyset: ?after= / ?before= the boundary stock number),
+# which idx_jobs_complete_stock_added serves in index order; each unit's jobs are fetched only when it is expanded.
 @app.route('/completed_jobs')
 @login_required
 def completed_jobs_by_unit():
-    """Displays units with completed jobs and lists those jobs."""
-    completed_jobs_grouped = {}
+    """Displays units with completed jobs, one page at a time; job lists load from completed_jobs_for_unit."""
+    units = []; pagination = None
+    after = request.args.get('after', '', type=str); before = request.args.get('before', '', type=str)
     if not engine:
         flash("Database connection is not available.", "danger")
     else:
         try:
-            with engine.connect() as connection:
-                # Fetch all jobs marked as complete, ordered by stock number then date
-                sql = text("""
-                    SELECT j.stockNumber, j.job1, j.dateAdded, j.status
+            with db_connection() as connection:
+                if before: keyset_sql = "AND j.stockNumber < :before"; order_sql = "DESC"
+                elif after: keyset_sql = "AND j.stockNumber > :after"; order_sql = "ASC"
+                else: keyset_sql = ""; order_sql = "ASC"
+                sql = text(f"""
+                    SELECT j.stockNumber, COUNT(*) AS job_count, MAX(j.dateAdded) AS last_added
                     FROM jobs j
-                    WHERE j.complete = 1
-                    ORDER BY j.stockNumber, j.dateAdded DESC
+                    WHERE j.complete = 1 AND j.stockNumber IS NOT NULL {keyset_sql}
+                    GROUP BY j.stockNumber
+                    ORDER BY j.stockNumber {order_sql}
+                    LIMIT :limit
                 """)
-                result = connection.execute(sql)
-                all_completed_jobs = result.mappings().all()
-
-                # Group jobs by stockNumber in Python
-                for job in all_completed_jobs:
-                    sn = job['stockNumber']
-                    if sn not in completed_jobs_grouped:
-                        completed_jobs_grouped[sn] = []
-                    completed_jobs_grouped[sn].append(job)
+                # One extra row tells us whether another page exists in the direction we are moving
+                rows = connection.execute(sql, {"after": after, "before": before, "limit": COMPLETED_JOBS_PAGE_SIZE + 1}).mappings().all()
+                has_more = len(rows) > COMPLETED_JOBS_PAGE_SIZE
+                units = [dict(row) for row in rows[:COMPLETED_JOBS_PAGE_SIZE]]
+                if before: units.reverse()
+                if units:
+                    pagination = {
+                        'has_prev': has_more if before else bool(after),
+                        'has_next': has_more if not before else True,
+                        'prev_before': units[0]['stockNumber'], 'next_after': units[-1]['stockNumber'],
+                    }
 
         except SQLAlchemyError as e:
             print(f"DB error fetching completed jobs: {e}")
@@ -1021,111 +1295,150 @@ def completed_jobs_by_unit():
             flash("An unexpected error occurred while fetching completed jobs.", "danger")
 
     return render_template('completed_jobs_by_unit.html',
-                           grouped_jobs=completed_jobs_grouped)
+                           units=units, pagination=pagination)
 
-# --- Route for Reports Page ---
-@app.route('/reports')
+@app.route('/completed_jobs/<string:stock_number>')
 @login_required
-def reports_page():
-    """Displays various reports."""
-    report_data = {}
-    # --- Date Range Handling ---
+def completed_jobs_for_unit(stock_number):
+    """Returns one unit's completed jobs as an HTML fragment in JSON, for expanding it on the completed jobs page."""
+    if not engine: return jsonify({"error": "Database connection is not available."}), 503
+    try:
+        with db_connection() as connection:
+            sql = text("""
+                SELECT j.job1, j.dateAdded, j.status
+                FROM jobs j
+                WHERE j.complete = 1 AND j.stockNumber = :sn
+                ORDER BY j.dateAdded DESC
+            """)
+            jobs = connection.execute(sql, {"sn": stock_number}).mappings().all()
+    except SQLAlchemyError as e: print(f"DB error fetching completed jobs for unit {stock_number}: {e}"); return jsonify({"error": "Database error loading jobs."}), 500
+    return jsonify({"stock_number": stock_number, "count": len(jobs), "html": render_template('_completed_jobs.html', jobs=jobs)})
+
+# --- Report Queries (shared by the report loaders and the CSV exports) ---
+def overdue_units_sql():
+    """Units past their promise date that are not in a final location."""
+    final_locations = "'FrontLine', 'Sold', 'Delivered', 'Wholesale'" # Adjust as needed
+    return text(f"""
+        SELECT stockNumber, vin, year, make, model, location, promiseDate
+        FROM {units_table_sql()}
+        WHERE promiseDate IS NOT NULL
+          AND promiseDate < CURDATE()
+          AND (location IS NULL OR location NOT IN ({final_locations}))
+        ORDER BY promiseDate ASC
+    """)
+
+def units_by_location_sql():
+    """Unit count per location."""
+    return text(f"""
+        SELECT location, COUNT(*) as count
+        FROM {units_table_sql()}
+        GROUP BY location
+        ORDER BY location ASC
+    """)
+
+def parse_report_dates(args):
+    """(start_date, end_date, warning) from ?start_date=&end_date=, defaulting to the last 30 days.
+    warning is a message for the user when the given dates were unusable, otherwise None."""
     default_end_date = datetime.date.today()
     default_start_date = default_end_date - datetime.timedelta(days=30)
-    start_date_str = request.args.get('start_date', default_start_date.isoformat())
-    end_date_str = request.args.get('end_date', default_end_date.isoformat())
-
     try:
-        start_date = datetime.date.fromisoformat(start_date_str)
-        end_date = datetime.date.fromisoformat(end_date_str)
-        # Ensure end_date is not before start_date
-        if end_date < start_date:
-            flash("End date cannot be before start date.", "warning")
-            end_date = start_date # Or reset both to default
+        start_date = datetime.date.fromisoformat(args.get('start_date', default_start_date.isoformat()))
+        end_date = datetime.date.fromisoformat(args.get('end_date', default_end_date.isoformat()))
     except ValueError:
-        flash("Invalid date format provided. Using default range.", "warning")
-        start_date = default_start_date
-        end_date = default_end_date
-        start_date_str = start_date.isoformat()
-        end_date_str = end_date.isoformat()
-
-    report_data['start_date'] = start_date_str
-    report_data['end_date'] = end_date_str
-    # --- End Date Range Handling ---
-
-    if not engine:
-        flash("Database connection is not available.", "danger")
-        return render_template('reports.html', reports=report_data)
-
-    try:
-        with engine.connect() as connection:
-            # --- Report 1: Units Overdue ---
-            final_locations = "'FrontLine', 'Sold', 'Delivered', 'Wholesale'" # Adjust as needed
-            sql_overdue = text(f"""
-                SELECT stockNumber, vin, year, make, model, location, promiseDate
-                FROM test_db
-                WHERE promiseDate IS NOT NULL
-                  AND promiseDate < CURDATE()
-                  AND (location IS NULL OR location NOT IN ({final_locations}))
-                ORDER BY promiseDate ASC
-            """)
-            report_data['overdue_units'] = connection.execute(sql_overdue).mappings().all()
-
-            # --- Report 2: Units by Location ---
-            sql_locations = text("""
-                SELECT location, COUNT(*) as count
-                FROM test_db
-                GROUP BY location
-                ORDER BY location ASC
-            """)
-            report_data['units_by_location'] = connection.execute(sql_locations).mappings().all()
-
-            # --- Report 3: Average Time in Steps (ALL Steps, with Date Filter) ---
+        return default_start_date, default_end_date, "Invalid date format provided. Using default range."
+    # Ensure end_date is not before start_date
+    if end_date < start_date: return start_date, start_date, "End date cannot be before start date."
+    return start_date, end_date, None
+
+# --- Report Loaders (run by the report engine, possibly on a background thread, so each opens its own connection) ---
+def load_overdue_units_report():
+    refresh_current_units()
+    with engine.connect() as connection:
+        return [dict(row) for row in connection.execute(overdue_units_sql()).mappings()]
+
+def load_units_by_location_report():
+    refresh_current_units()
+    with engine.connect() as connection:
+        return [dict(row) for row in connection.execute(units_by_location_sql()).mappings()]
+
+def load_step_times_report(start_date, end_date):
+    """Average/shortest/longest time per step for steps started from start_date through end_date."""
+    with engine.connect() as connection:
+        # Read from the daily rollup once it has been refreshed; until then (or without
+        # create_step_rollup.py) aggregate newDaysInStep directly.
+        if step_rollup_refresher.refreshed_at is not None:
+            avg_time_results = step_rollup.report(connection, start_date, end_date)
+        else:
+            range_start, range_end = date_ranges.days_range(start_date, end_date)
             sql_avg_time = text("""
                 SELECT
                     step,
                     AVG(TIMESTAMPDIFF(MINUTE, dateIn, dateOut)) as avg_minutes,
+                    MIN(TIMESTAMPDIFF(MINUTE, dateIn, dateOut)) as min_minutes,
+                    MAX(TIMESTAMPDIFF(MINUTE, dateIn, dateOut)) as max_minutes,
                     COUNT(*) as step_count
                 FROM newDaysInStep
-                WHERE dateIn IS NOT NULL
-                  AND dateOut IS NOT NULL
-                  AND dateIn >= :start_date
-                  AND dateIn <= :end_date -- Filter by dateIn within the range
+                WHERE dateOut IS NOT NULL
+                  AND dateIn >= :range_start
+                  AND dateIn < :range_end
                 GROUP BY step
                 ORDER BY step
             """)
             avg_time_results = connection.execute(sql_avg_time, {
-                "start_date": start_date,
-                "end_date": end_date
+                "range_start": range_start,
+                "range_end": range_end
             }).mappings().all()
 
-            # Convert minutes to a more readable format
-            processed_avg_times = []
-            for row in avg_time_results:
-                avg_minutes = row['avg_minutes']
-                if avg_minutes is not None:
-                    days = int(avg_minutes // (24 * 60))
-                    remaining_minutes = avg_minutes % (24 * 60)
-                    hours = int(remaining_minutes // 60)
-                    minutes = int(remaining_minutes % 60)
-                    readable_time = ""
-                    if days > 0: readable_time += f"{days}d "
-                    if hours > 0: readable_time += f"{hours}h "
-                    if minutes > 0 or not readable_time: readable_time += f"{minutes}m"
-                    processed_avg_times.append({
-                        'step': row['step'],
-                        'avg_time_readable': readable_time.strip(),
-                        'count': row['step_count']
-                    })
-                else:
-                    processed_avg_times.append({
-                        'step': row['step'],
-                        'avg_time_readable': 'N/A',
-                        'count': row['step_count']
-                    })
+    # Convert minutes to a more readable format
+    return [{
+        'step': row['step'],
+        'avg_time_readable': readable_minutes(row['avg_minutes']),
+        'min_time_readable': readable_minutes(row['min_minutes']),
+        'max_time_readable': readable_minutes(row['max_minutes']),
+        'count': row['step_count']
+    } for row in avg_time_results]
+
+def load_step_distributions_report(start_date, end_date):
+    """Step-duration percentiles and histograms for steps started from start_date through end_date."""
+    range_start, range_end = date_ranges.days_range(start_date, end_date)
+    with engine.connect() as connection:
+        return step_analytics.step_durations(connection, range_start, range_end)
+
+# --- Route for Reports Page ---
+@app.route('/reports')
+@login_required
+def reports_page():
+    """Displays various reports."""
+    report_data = {}
+    # --- Date Range Handling ---
+    start_date, end_date, date_warning = parse_report_dates(request.args)
+    if date_warning: flash(date_warning, "warning")
+    report_data['start_date'] = start_date.isoformat()
+    report_data['end_date'] = end_date.isoformat()
+    # --- End Date Range Handling ---
 
-            report_data['average_step_times'] = processed_avg_times
+    if not engine:
+        flash("Database connection is not available.", "danger")
+        return render_template('reports.html', reports=report_data)
 
+    try:
+        # Each report is served from the report engine: cached results right away (refreshed in the
+        # background once stale), and one query for concurrent identical requests
+        results = {
+            'overdue_units': report_results.get('overdue_units', None, None, load_overdue_units_report),
+            'units_by_location': report_results.get('units_by_location', None, None, load_units_by_location_report),
+            'average_step_times': report_results.get('average_step_times', start_date, end_date, lambda: load_step_times_report(start_date, end_date)),
+            'step_distributions': report_results.get('step_distributions', start_date, end_date, lambda: load_step_distributions_report(start_date, end_date)),
+        }
+        for name, result in results.items(): report_data[name] = result.value
+        report_data['ages'] = {name: int(result.age_seconds) for name, result in results.items()}
+
+        # Display fields for the distributions (the cached value is shared with the JSON endpoint, so copy rows)
+        distributions = report_data['step_distributions']
+        report_data['step_distributions'] = dict(distributions, steps=[
+            dict(row, histogram_peak=max(row['histogram']) or 1,
+                 **{f"p{p}_readable": readable_minutes(row[f"p{p}_minutes"]) for p in distributions['percentiles']})
+            for row in distributions['steps']])
 
     except SQLAlchemyError as e:
         print(f"DB error fetching reports: {e}")
@@ -1137,6 +1450,122 @@ def reports_page():
     return render_template('reports.html', reports=report_data)
 
 
+@app.route('/api/reports/step_durations')
+@login_required
+def api_step_durations():
+    """JSON step-duration percentiles and histograms for ?start_date=&end_date= (inclusive, default last 30 days), for charting."""
+    start_date, end_date, date_warning = parse_report_dates(request.args)
+    if date_warning: return jsonify({"error": date_warning}), 400
+    if not engine: return jsonify({"error": "Database connection is not available"}), 503
+    try:
+        result = report_results.get('step_distributions', start_date, end_date, lambda: load_step_distributions_report(start_date, end_date))
+    except SQLAlchemyError as e:
+        print(f"DB error fetching step durations: {e}")
+        return jsonify({"error": "Database error"}), 500
+    return jsonify(dict(result.value, start_date=start_date.isoformat(), end_date=end_date.isoformat(), age_seconds=int(result.age_seconds)))
+
+
+# --- CSV Export Routes ---
+# Large exports are read in keyset-paged batches (csv_export.stream_pages) with the same filters and order as the
+# page they come from; the reports page's own results (already in memory) are written from the report engine's cache.
+UNIT_EXPORT_COLUMNS = (('Stock #', 'stockNumber'), ('VIN', 'vin'), ('Year', 'year'), ('Make', 'make'), ('Model', 'model'), ('Location', 'location'), ('Date In', 'dateIn'))
+STEP_EXPORT_SQL = """
+    SELECT id, stockNumber, step, dateIn, dateOut, TIMESTAMPDIFF(MINUTE, dateIn, dateOut) AS minutes
+    FROM newDaysInStep
+    WHERE dateOut IS NOT NULL AND dateIn >= :range_start AND dateIn < :range_end {keyset_sql}
+    ORDER BY dateIn, id
+    LIMIT :limit
+"""
+
+def csv_response(body, filename):
+    """Download response for CSV text or a generator of CSV chunks."""
+    return Response(body, mimetype='text/csv', headers={'Content-Disposition': f'attachment; filename="{filename}"', 'Cache-Control': 'no-store'})
+
+@app.route('/export/dashboard.csv')
+@login_required
+def export_dashboard():
+    """Every unit in the dashboard list for ?search= (all pages), newest first."""
+    if not engine: flash("Database connection is not available.", "danger"); return redirect(url_for('dashboard'))
+    search_term = request.args.get('search', '', type=str).strip()
+    refresh_current_units()
+    filters = {} # The search runs once, on the first batch's connection
+    def fetch_page(connection, last_row, limit):
+        if not filters: filters['where_sql'], filters['params'], _ = dashboard_filters(connection, search_term)
+        params = dict(filters['params'], limit=limit); keyset_sql = ""
+        if last_row is not None: # Same (sort_date, id) keyset as the dashboard's Next link
+            keyset_sql = "AND (sort_date < :cursor_date OR (sort_date = :cursor_date AND id < :cursor_id))"
+            params['cursor_date'] = last_row['sort_date']; params['cursor_id'] = last_row['id']
+        sql = bind_dashboard_filters(text(f"""
+            WITH RankedUnits AS ({ranked_units_sql(filters['where_sql'])})
+            SELECT id, sort_date, stockNumber, vin, year, make, model, location, dateIn
+            FROM RankedUnits
+            WHERE rn = 1 {keyset_sql}
+            ORDER BY sort_date DESC, id DESC
+            LIMIT :limit
+        """), params)
+        return connection.execute(sql, params).mappings().all()
+    return csv_response(csv_export.stream_pages(engine, UNIT_EXPORT_COLUMNS, fetch_page), f"units_{datetime.date.today().isoformat()}.csv")
+
+@app.route('/export/completed_jobs.csv')
+@login_required
+def export_completed_jobs():
+    """Every completed job, grouped by stock number as on the completed jobs page."""
+    if not engine: flash("Database connection is not available.", "danger"); return redirect(url_for('completed_jobs_by_unit'))
+    def fetch_page(connection, last_row, limit):
+        params = {"limit": limit}; keyset_sql = ""
+        if last_row is not None:
+            # Keyset on (stockNumber ASC, dateAdded DESC, id DESC); MySQL sorts NULL dateAdded last when descending
+            if last_row['dateAdded'] is None: after_in_unit = "(j.dateAdded IS NULL AND j.id < :cursor_id)"
+            else: after_in_unit = "(j.dateAdded < :cursor_added OR j.dateAdded IS NULL OR (j.dateAdded = :cursor_added AND j.id < :cursor_id))"
+            keyset_sql = f"AND (j.stockNumber > :cursor_sn OR (j.stockNumber = :cursor_sn AND {after_in_unit}))"
+            params.update(cursor_sn=last_row['stockNumber'], cursor_added=last_row['dateAdded'], cursor_id=last_row['id'])
+        sql = text(f"""
+            SELECT j.id, j.stockNumber, j.job1, j.dateAdded, j.status
+            FROM jobs j
+            WHERE j.complete = 1 {keyset_sql}
+            ORDER BY j.stockNumber, j.dateAdded DESC, j.id DESC
+            LIMIT :limit
+        """)
+        return connection.execute(sql, params).mappings().all()
+    columns = (('Stock #', 'stockNumber'), ('Job', 'job1'), ('Date Added', 'dateAdded'), ('Status', 'status'))
+    return csv_response(csv_export.stream_pages(engine, columns, fetch_page), f"completed_jobs_{datetime.date.today().isoformat()}.csv")
+
+@app.route('/export/reports/<any(overdue_units, units_by_location, step_times, steps):report>.csv')
+@login_required
+def export_report(report):
+    """One report from the reports page for ?start_date=&end_date=. steps is every completed step in the range."""
+    if not engine: flash("Database connection is not available.", "danger"); return redirect(url_for('reports_page'))
+    start_date, end_date, date_warning = parse_report_dates(request.args)
+    if date_warning: flash(date_warning, "warning"); return redirect(url_for('reports_page'))
+    filename = f"{report}_{start_date.isoformat()}_{end_date.isoformat()}.csv"
+    if report == 'step_times':
+        try: result = report_results.get('average_step_times', start_date, end_date, lambda: load_step_times_report(start_date, end_date))
+        except SQLAlchemyError as e:
+            print(f"DB error exporting step times: {e}"); flash("Error generating report export.", "danger"); return redirect(url_for('reports_page'))
+        columns = (('Step', 'step'), ('Average Duration', 'avg_time_readable'), ('Shortest', 'min_time_readable'), ('Longest', 'max_time_readable'), ('Steps', 'count'))
+        return csv_response(csv_export.rows(columns, result.value), filename)
+    if report == 'steps':
+        range_start, range_end = date_ranges.days_range(start_date, end_date)
+        columns = (('Stock #', 'stockNumber'), ('Step', 'step'), ('Date In', 'dateIn'), ('Date Out', 'dateOut'), ('Minutes', 'minutes'))
+        def fetch_page(connection, last_row, limit):
+            params = {"range_start": range_start, "range_end": range_end, "limit": limit}; keyset_sql = ""
+            if last_row is not None:
+                keyset_sql = "AND (dateIn > :cursor_in OR (dateIn = :cursor_in AND id > :cursor_id))"
+                params['cursor_in'] = last_row['dateIn']; params['cursor_id'] = last_row['id']
+            return connection.execute(text(STEP_EXPORT_SQL.format(keyset_sql=keyset_sql)), params).mappings().all()
+        return csv_response(csv_export.stream_pages(engine, columns, fetch_page), filename)
+    # overdue_units and units_by_location are the reports page's own (undated) results, already held by the report engine
+    filename = f"{report}_{datetime.date.today().isoformat()}.csv"
+    if report == 'overdue_units':
+        columns = UNIT_EXPORT_COLUMNS[:-1] + (('Promise Date', 'promiseDate'),); loader = load_overdue_units_report
+    else:
+        columns = (('Location', 'location'), ('Count', 'count')); loader = load_units_by_location_report
+    try: result = report_results.get(report, None, None, loader)
+    except SQLAlchemyError as e:
+        print(f"DB error exporting {report}: {e}"); flash("Error generating report export.", "danger"); return redirect(url_for('reports_page'))
+    return csv_response(csv_export.rows(columns, result.value), filename)
+
+
 # --- UNCOMMENTED: NEW CHAT ROUTES ---
 
 @app.route('/chat')
@@ -1155,7 +1584,7 @@ def get_chat_users():
     if not engine:
         return jsonify({"error": "Database connection unavailable"}), 500
     try:
-        with engine.connect() as connection:
+        with db_connection() as connection:
             # Fetch id and userName, excluding the current user
             sql = text("SELECT id, userName FROM users WHERE id != :current_user_id ORDER BY userName ASC")
             result = connection.execute(sql, {"current_user_id": current_user_id})
@@ -1177,7 +1606,7 @@ def get_conversations():
     if not engine:
         return jsonify({"error": "Database connection unavailable"}), 500
     try:
-        with engine.connect() as connection:
+        with db_connection() as connection:
             # Find distinct users the current user has sent to or received from
             # Also get the timestamp of the latest message and unread count for each convo
             sql = text("""
@@ -1215,42 +1644,75 @@ def get_conversations():
 @app.route('/api/chat/messages/<int:other_user_id>')
 @login_required
 def get_messages(other_user_id):
-    """API endpoint to get messages between current user and another user."""
+    """API endpoint to get messages between current user and another user.
+
+    Returns one bounded page, oldest first. With no cursor it is the latest page;
+    ?after_id=N returns messages newer than N (the delta since the last fetch) and
+    ?before_id=N returns the page just older than N (scrollback). The X-Has-More
+    header says whether more messages exist past this page in the same direction.
+    """
     messages = []
     user_id = g.user.get('id')
+    after_id = request.args.get('after_id', type=int)
+    before_id = request.args.get('before_id', type=int)
+    limit = max(1, min(request.args.get('limit', CHAT_PAGE_SIZE, type=int), CHAT_PAGE_SIZE_MAX))
+    if after_id is not None and before_id is not None:
+        return jsonify({"error": "Use either after_id or before_id, not both"}), 400
     if not engine:
         return jsonify({"error": "Database connection unavailable"}), 500
+
+    # Each half of the UNION is an equality lookup on idx_sender_recipient (sender_id, recipient_id),
+    # then filtered and ordered by message_id, so a page costs the same however long the conversation is.
+    if after_id is not None: cursor_sql = "AND message_id > :cursor_id"; direction = "ASC"
+    elif before_id is not None: cursor_sql = "AND message_id < :cursor_id"; direction = "DESC"
+    else: cursor_sql = ""; direction = "DESC"
+    half_sql = f"""
+        SELECT message_id, sender_id, recipient_id, message_text, timestamp, stockNumber
+        FROM chat_messages
+        WHERE sender_id = {{sender}} AND recipient_id = {{recipient}} {cursor_sql}
+        ORDER BY message_id {direction}
+        LIMIT :fetch_limit
+    """
+    sql_fetch = text(f"""
+        SELECT m.message_id, m.sender_id, m.recipient_id, m.message_text, m.timestamp, m.stockNumber,
+               sender.userName as sender_username
+        FROM (
+            ({half_sql.format(sender=':current_user_id', recipient=':other_user_id')})
+            UNION ALL
+            ({half_sql.format(sender=':other_user_id', recipient=':current_user_id')})
+        ) m
+        JOIN users sender ON m.sender_id = sender.id
+        ORDER BY m.message_id {direction}
+        LIMIT :fetch_limit
+    """)
+    params = {"current_user_id": user_id, "other_user_id": other_user_id, "fetch_limit": limit + 1} # One extra row tells us whether there is more
+    if cursor_sql: params['cursor_id'] = after_id if after_id is not None else before_id
+    marked_read = 0
     try:
-        with engine.connect() as connection:
+        with db_connection() as connection:
             # Begin transaction to fetch messages AND mark them as read
-            with connection.begin():
-                # Mark messages from the other user to the current user as read
-                sql_mark_read = text("""
-                    UPDATE chat_messages
-                    SET is_read = 1
-                    WHERE sender_id = :other_user_id AND recipient_id = :current_user_id AND is_read = 0
-                """)
-                connection.execute(sql_mark_read, {"other_user_id": other_user_id, "current_user_id": user_id})
-
-                # Fetch the conversation history
-                sql_fetch = text("""
-                    SELECT cm.message_id, cm.sender_id, cm.recipient_id, cm.message_text, cm.timestamp, cm.stockNumber,
-                           sender.userName as sender_username
-                    FROM chat_messages cm
-                    JOIN users sender ON cm.sender_id = sender.id
-                    WHERE (cm.sender_id = :current_user_id AND cm.recipient_id = :other_user_id)
-                       OR (cm.sender_id = :other_user_id AND cm.recipient_id = :current_user_id)
-                    ORDER BY cm.timestamp ASC
-                """)
-                result = connection.execute(sql_fetch, {"current_user_id": user_id, "other_user_id": other_user_id})
+            with db_transaction():
+                # Mark messages from the other user to the current user as read (skipped for scrollback).
+                # Always run: the cached unread count can lag other workers, so it only learns the result (rowcount).
+                if before_id is None:
+                    sql_mark_read = text("""
+                        UPDATE chat_messages
+                        SET is_read = 1
+                        WHERE sender_id = :other_user_id AND recipient_id = :current_user_id AND is_read = 0
+                    """)
+                    mark_result = connection.execute(sql_mark_read, {"other_user_id": other_user_id, "current_user_id": user_id})
+                    marked_read = mark_result.rowcount or 0
+
+                # Fetch one page of the conversation
+                rows = connection.execute(sql_fetch, params).mappings().all()
+                has_more = len(rows) > limit
+                rows = rows[:limit]
+                if direction == "DESC": rows = list(reversed(rows))
                 # Convert datetime objects to ISO format strings for JSON serialization
-                for row in result.mappings().all():
-                    message_dict = dict(row)
-                    if isinstance(message_dict.get('timestamp'), datetime.datetime):
-                        message_dict['timestamp'] = message_dict['timestamp'].isoformat()
-                    messages.append(message_dict)
+                messages = [serialize_chat_message(row) for row in rows]
 
             # Transaction commits here if successful
+        unread_counter.decrement(user_id, marked_read)
 
     except SQLAlchemyError as e:
         print(f"DB error fetching messages between {user_id} and {other_user_id}: {e}")
@@ -1258,7 +1720,9 @@ def get_messages(other_user_id):
     except Exception as e:
         print(f"Unexpected error fetching messages: {e}")
         return jsonify({"error": "An unexpected error occurred"}), 500
-    return jsonify(messages)
+    response = jsonify(messages)
+    response.headers['X-Has-More'] = '1' if has_more else '0'
+    return response
 
 
 @app.route('/api/chat/send', methods=['POST'])
@@ -1278,6 +1742,9 @@ def send_message():
     if not recipient_id or not message_text:
         return jsonify({"error": "Recipient ID and message text are required"}), 400
 
+    try: recipient_id = int(recipient_id)
+    except (TypeError, ValueError): return jsonify({"error": "Invalid recipient ID"}), 400
+
     # Validate recipient_id (optional but recommended)
     # ... (add check if recipient_id exists in users table) ...
 
@@ -1285,8 +1752,8 @@ def send_message():
         return jsonify({"error": "Database connection unavailable"}), 500
 
     try:
-        with engine.connect() as connection:
-            with connection.begin():
+        with db_connection() as connection:
+            with db_transaction():
                 sql = text("""
                     INSERT INTO chat_messages (sender_id, recipient_id, message_text, stockNumber)
                     VALUES (:sender_id, :recipient_id, :message_text, :stockNumber)
@@ -1298,9 +1765,18 @@ def send_message():
                     "stockNumber": stock_number if stock_number else None # Store NULL if empty
                 }
                 result = connection.execute(sql, params)
-                # Optionally return the newly created message ID or the message itself
-                # last_id = result.lastrowid # This might vary depending on DBAPI driver
-                # For simplicity, just return success
+                # Read the stored row back so stream subscribers get the real id and timestamp
+                sql_new = text("""
+                    SELECT cm.message_id, cm.sender_id, cm.recipient_id, cm.message_text, cm.timestamp, cm.stockNumber,
+                           sender.userName as sender_username
+                    FROM chat_messages cm
+                    JOIN users sender ON cm.sender_id = sender.id
+                    WHERE cm.message_id = :message_id
+                """)
+                new_row = connection.execute(sql_new, {"message_id": result.lastrowid}).mappings().first()
+                new_message = serialize_chat_message(new_row) if new_row else None
+        unread_counter.increment(recipient_id)
+        if new_message: chat_broker.publish(new_message)
     except SQLAlchemyError as e:
         print(f"DB error sending message from {sender_id} to {recipient_id}: {e}")
         return jsonify({"error": "Could not send message"}), 500
@@ -1308,7 +1784,57 @@ def send_message():
         print(f"Unexpected error sending message: {e}")
         return jsonify({"error": "An unexpected error occurred"}), 500
 
-    return jsonify({"success": True, "message": "Message sent"}), 201 # 201 Created
+    return jsonify({"success": True, "message": "Message sent", "chat_message": new_message}), 201 # 201 Created
+
+
+def _mark_message_read(message_id, user_id):
+    """Marks one pushed message as read for its recipient (short-lived connection, not held by the stream)."""
+    try:
+        with engine.connect() as connection:
+            with connection.begin():
+                sql = text("UPDATE chat_messages SET is_read = 1 WHERE message_id = :message_id AND recipient_id = :user_id AND is_read = 0")
+                result = connection.execute(sql, {"message_id": message_id, "user_id": user_id})
+        unread_counter.decrement(user_id, result.rowcount or 0)
+    except SQLAlchemyError as e:
+        print(f"DB error marking message {message_id} read for user {user_id}: {e}")
+
+
+@app.route('/api/chat/stream/<int:other_user_id>')
+@login_required
+def stream_messages(other_user_id):
+    """Server-Sent Events stream of new messages between the current user and another user.
+
+    Fed by chat_broker from send_message. Messages in the open conversation are sent as
+    'message' events (and marked read); messages from anyone else are sent as 'notify'
+    events so the client can refresh its conversation list. A 'resync' event means
+    messages were dropped and the client should refetch the conversation.
+    """
+    user_id = g.user.get('id')
+    subscription = chat_broker.subscribe(user_id)
+
+    def generate():
+        try:
+            yield "retry: 3000\n\n"
+            deadline = time.monotonic() + CHAT_STREAM_MAX_SECONDS
+            while time.monotonic() < deadline:
+                message = subscription.get(timeout=CHAT_STREAM_KEEPALIVE)
+                if subscription.overflowed:
+                    subscription.overflowed = False
+                    yield "event: resync\ndata: {}\n\n"
+                if message is None:
+                    yield ": keepalive\n\n" # Also lets the server notice closed connections
+                    continue
+                participants = {message.get('sender_id'), message.get('recipient_id')}
+                if participants == {user_id, other_user_id}:
+                    if message.get('recipient_id') == user_id: _mark_message_read(message['message_id'], user_id)
+                    yield f"id: {message['message_id']}\nevent: message\ndata: {json.dumps(message)}\n\n"
+                elif message.get('recipient_id') == user_id:
+                    yield f"event: notify\ndata: {json.dumps({'sender_id': message.get('sender_id')})}\n\n"
+        finally:
+            chat_broker.unsubscribe(subscription)
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 # --- END UNCOMMENTED ---
 
@@ -1326,5 +1852,5 @@ if __name__ == '__main__':
     if engine is None or SessionLocal is None: print("\n--- WARNING: DATABASE CONNECTION FAILED ---\n")
     # Import sqlalchemy here only if needed for the check below
     import sqlalchemy
-    app.run(debug=True, host='0.0.0.0', port=5001)
+    app.run(debug=True, host='0.0.0.0', port=5001, threaded=True) # Threaded so open chat streams don't block other requests
 
@@ -0,0 +1,56 @@
+# app_cache.py
+import threading
+import time
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Small thread-safe in-process cache where every entry expires after ttl_seconds.
+
+    Used for values that are expensive to compute and may be slightly stale, such as
+    row counts. Each worker process has its own copy.
+    """
+
+    def __init__(self, ttl_seconds, max_entries=256):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = {} # key -> (value, stored_at)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None: return default
+            if time.monotonic() - entry[1] >= self.ttl_seconds:
+                del self._entries[key]
+                return default
+            return entry[0]
+
+    def set(self, key, value):
+        with self._lock:
+            if len(self._entries) >= self.max_entries and key not in self._entries:
+                # Drop the oldest entry; these caches are small so a linear scan is fine
+                oldest_key = min(self._entries, key=lambda k: self._entries[k][1])
+                del self._entries[oldest_key]
+            self._entries[key] = (value, time.monotonic())
+
+    def get_or_load(self, key, loader):
+        """Returns the cached value for key, calling loader() and caching its result on a miss."""
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = loader()
+            self.set(key, value)
+        return value
+
+    def age(self, key):
+        """Seconds since key was stored, or None if it is not cached."""
+        with self._lock:
+            entry = self._entries.get(key)
+            return None if entry is None else time.monotonic() - entry[1]
+
+    def invalidate(self, key=None):
+        """Drops one entry, or everything if key is None."""
+        with self._lock:
+            if key is None: self._entries.clear()
+            else: self._entries.pop(key, None)
@@ -0,0 +1,131 @@
+# chat_state.py
+import os
+import queue
+import threading
+import time
+
+# How long a cached unread count is trusted before it is re-read from MySQL.
+# Each worker process keeps its own counts, so this bounds how far a worker can
+# drift when another worker (or another system) changes chat_messages.
+UNREAD_TTL_SECONDS = int(os.getenv('CHAT_UNREAD_TTL', '120'))
+# Messages buffered per open chat stream before the client is told to resync.
+STREAM_QUEUE_SIZE = int(os.getenv('CHAT_STREAM_QUEUE_SIZE', '200'))
+
+
+class UnreadCounter:
+    """Per-user unread chat message counts, cached in process.
+
+    The count is loaded once per user (via the loader passed to get()) and then
+    kept current by the chat routes calling increment() / decrement().
+    The loader runs outside the lock, so every change bumps a per-user generation;
+    a load that overlapped a change is returned but not cached, since it may have
+    read the table before (or after) the change was applied.
+    """
+
+    def __init__(self, ttl_seconds=UNREAD_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._counts = {} # user_id -> (count, loaded_at)
+        self._generations = {} # user_id -> number of changes seen, cached or not
+        self._epoch = 0 # Bumped by invalidate() of every user
+        self._lock = threading.Lock()
+
+    def _generation(self, user_id):
+        return self._epoch, self._generations.get(user_id, 0)
+
+    def _changed(self, user_id):
+        self._generations[user_id] = self._generations.get(user_id, 0) + 1
+
+    def get(self, user_id, loader):
+        """Returns the cached count for user_id, calling loader(user_id) on a miss or expiry."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._counts.get(user_id)
+            if entry is not None and now - entry[1] < self.ttl_seconds:
+                return entry[0]
+            generation = self._generation(user_id)
+        count = loader(user_id)
+        if count is None: return 0 # Loader failed, don't cache
+        with self._lock:
+            if self._generation(user_id) == generation: self._counts[user_id] = (count, now)
+        return count
+
+    def increment(self, user_id, amount=1):
+        """Adds to a user's count if it is cached (an uncached user is loaded fresh on next get)."""
+        with self._lock:
+            self._changed(user_id)
+            entry = self._counts.get(user_id)
+            if entry is not None:
+                self._counts[user_id] = (entry[0] + amount, entry[1])
+
+    def decrement(self, user_id, amount=1):
+        """Subtracts from a user's count, never going below zero."""
+        if amount <= 0: return
+        with self._lock:
+            self._changed(user_id)
+            entry = self._counts.get(user_id)
+            if entry is not None:
+                self._counts[user_id] = (max(0, entry[0] - amount), entry[1])
+
+    def invalidate(self, user_id=None):
+        """Drops one user's count, or every count if user_id is None."""
+        with self._lock:
+            if user_id is None: self._counts.clear(); self._epoch += 1
+            else: self._counts.pop(user_id, None); self._changed(user_id)
+
+
+class ChatSubscription:
+    """One open chat stream: a bounded queue of messages for a single user."""
+
+    def __init__(self, user_id, maxsize=STREAM_QUEUE_SIZE):
+        self.user_id = user_id
+        self.overflowed = False # Set when messages were dropped; the stream must tell the client to resync
+        self._queue = queue.Queue(maxsize=maxsize)
+
+    def put(self, message):
+        try: self._queue.put_nowait(message)
+        except queue.Full: self.overflowed = True
+
+    def get(self, timeout):
+        """Returns the next message, or None if nothing arrived within timeout seconds."""
+        try: return self._queue.get(timeout=timeout)
+        except queue.Empty: return None
+
+
+class ChatBroker:
+    """In-process fan-out of newly sent chat messages to open chat streams.
+
+    send_message publishes each inserted message once; every stream subscribed by
+    the sender or the recipient gets a copy. Waiting streams hold no DB connection.
+    Only streams served by the same process are reached, so the app is expected to
+    run as one multi-threaded process.
+    """
+
+    def __init__(self):
+        self._subscribers = {} # user_id -> set of ChatSubscription
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id):
+        subscription = ChatSubscription(user_id)
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscribers.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions: del self._subscribers[subscription.user_id]
+
+    def publish(self, message):
+        """Delivers a message dict (with sender_id and recipient_id) to both participants' streams."""
+        with self._lock:
+            targets = []
+            for user_id in {message.get('sender_id'), message.get('recipient_id')}:
+                targets.extend(self._subscribers.get(user_id, ()))
+        for subscription in targets:
+            subscription.put(message)
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subs) for subs in self._subscribers.values())
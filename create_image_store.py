@@ -0,0 +1,70 @@
+# create_image_store.py
+import sys
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError, OperationalError
+
+# Assuming db_connector.py is in the same directory and defines 'engine'
+try:
+    from db_connector import engine
+except ImportError:
+    print("Error: Could not import 'engine' from db_connector.py.")
+    print("Ensure db_connector.py is in the same directory and defines the SQLAlchemy engine.")
+    sys.exit(1)
+
+# Columns added to 'images' so rows can point at the on-disk image store (image_store.py)
+# instead of holding base64 text. The old 'image' column is kept (made NULLable) so
+# existing rows keep working until migrate_images.py has converted them.
+NEW_COLUMNS = {
+    'sha256': "ALTER TABLE images ADD COLUMN sha256 CHAR(64) NULL",
+    'content_type': "ALTER TABLE images ADD COLUMN content_type VARCHAR(100) NULL",
+    'byte_size': "ALTER TABLE images ADD COLUMN byte_size INT UNSIGNED NULL",
+}
+
+SQL_IMAGE_COLUMNS = """
+SELECT COLUMN_NAME, COLUMN_TYPE, IS_NULLABLE
+FROM information_schema.COLUMNS
+WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'images'
+"""
+
+def create_image_store_columns():
+    """Connects to the database and adds the image store columns to the images table."""
+    if engine is None:
+        print("Error: Database engine is not configured.")
+        return
+
+    print("Attempting to connect to the database...")
+    try:
+        with engine.connect() as connection:
+            print("Connection successful.")
+            columns = {row.COLUMN_NAME: row for row in connection.execute(text(SQL_IMAGE_COLUMNS))}
+            if not columns:
+                print("Error: Table 'images' not found.")
+                return
+            connection.rollback() # End the probe's implicit transaction; begin() below would otherwise fail
+
+            with connection.begin():
+                for column_name, sql in NEW_COLUMNS.items():
+                    if column_name in columns:
+                        print(f"Column '{column_name}' already exists.")
+                        continue
+                    print(f"Adding column '{column_name}'...")
+                    connection.execute(text(sql))
+
+                image_column = columns.get('image')
+                if image_column is not None and image_column.IS_NULLABLE == 'NO':
+                    # Re-declare with the existing type so only the NULL constraint changes
+                    print("Making 'image' column NULLable...")
+                    connection.execute(text(f"ALTER TABLE images MODIFY COLUMN image {image_column.COLUMN_TYPE} NULL"))
+            print("Table 'images' is ready for the image store.")
+
+    except OperationalError as e:
+        print(f"\nDatabase Connection Error: Could not connect to the database.")
+        print(f"Please check your database server is running and connection details are correct.")
+        print(f"Error details: {e}")
+    except SQLAlchemyError as e:
+        print(f"\nAn error occurred while altering the images table: {e}")
+    except Exception as e:
+        print(f"\nAn unexpected error occurred: {e}")
+
+if __name__ == "__main__":
+    create_image_store_columns()
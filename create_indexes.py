@@ -0,0 +1,75 @@
+# create_indexes.py
+import argparse
+import sys
+import time
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError, OperationalError
+
+# Assuming db_connector.py is in the same directory and defines 'engine'
+try:
+    from db_connector import engine
+except ImportError:
+    print("Error: Could not import 'engine' from db_connector.py.")
+    print("Ensure db_connector.py is in the same directory and defines the SQLAlchemy engine.")
+    sys.exit(1)
+import schema
+
+# Checks the indexes declared in schema.py against the database and adds the missing ones.
+# Indexes are added with ALGORITHM=INPLACE, LOCK=NONE, so the tables stay readable and
+# writable while they build.
+#
+#   python create_indexes.py --check
+#   python create_indexes.py
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Report and create the indexes declared in schema.py.")
+    parser.add_argument('--check', action='store_true', help="Only report present and missing indexes; change nothing")
+    return parser.parse_args()
+
+def create_indexes(args):
+    """Connects to the database, reports the declared indexes and creates the missing ones."""
+    if engine is None:
+        print("Error: Database engine is not configured.")
+        return
+
+    print("Attempting to connect to the database...")
+    try:
+        with engine.connect() as connection:
+            print("Connection successful.")
+            present, missing, unavailable = schema.check(connection)
+            # Only drop a retired index once its replacement is present or about to be added
+            replaceable = {spec.name for spec, _ in present + missing}
+            retired = [entry for entry in schema.retired_present(connection) if entry[2] in replaceable]
+            column_types = schema.table_columns(connection)
+            connection.rollback() # End the reads' implicit transaction; DDL below commits on its own
+
+            for spec, covering in present: print(f"  OK       {spec}  (covered by {covering})")
+            for spec, reason in unavailable: print(f"  SKIPPED  {spec}  ({reason})")
+            for spec, _ in missing: print(f"  MISSING  {spec}  - {spec.reason}")
+            for table, name, replacement in retired: print(f"  RETIRED  {table}.{name}  - replaced by {replacement}")
+            print(f"{len(present)} present, {len(missing)} missing, {len(unavailable)} skipped, {len(retired)} to drop.")
+            if args.check or not (missing or retired): return
+
+            by_table = {} # table -> ([specs to add], [index names to drop])
+            for spec, _ in missing: by_table.setdefault(spec.table, ([], []))[0].append(spec)
+            for table, name, _ in retired: by_table.setdefault(table, ([], []))[1].append(name)
+            for table, (specs, drop_names) in by_table.items():
+                sql = schema.alter_indexes_sql(table, specs, column_types.get(table.lower(), {}), drop_names)
+                print(f"Adding {len(specs)} and dropping {len(drop_names)} index(es) on '{table}'...")
+                started = time.monotonic()
+                with connection.begin():
+                    connection.execute(text(sql))
+                print(f"  Done in {time.monotonic() - started:.1f}s.")
+            print("All declared indexes are now present and retired ones dropped.")
+
+    except OperationalError as e:
+        print(f"\nDatabase Connection Error: Could not connect to the database.")
+        print(f"Please check your database server is running and connection details are correct.")
+        print(f"Error details: {e}")
+    except SQLAlchemyError as e:
+        print(f"\nAn error occurred while creating indexes: {e}")
+    except Exception as e:
+        print(f"\nAn unexpected error occurred: {e}")
+
+if __name__ == "__main__":
+    create_indexes(parse_args())
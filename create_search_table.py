@@ -0,0 +1,53 @@
+# create_search_table.py
+import sys
+import time
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError, OperationalError
+
+# Assuming db_connector.py is in the same directory and defines 'engine'
+try:
+    from db_connector import engine
+except ImportError:
+    print("Error: Could not import 'engine' from db_connector.py.")
+    print("Ensure db_connector.py is in the same directory and defines the SQLAlchemy engine.")
+    sys.exit(1)
+import unit_search
+
+# Creates the unit_search table used by the dashboard search box and fills it from test_db.
+# Re-run at any time (e.g. nightly from cron) to rebuild it; this picks up edits other
+# systems make to existing test_db rows, which the app's incremental sync does not see.
+
+def create_search_table():
+    """Connects to the database, creates unit_search if needed and rebuilds its contents."""
+    if engine is None:
+        print("Error: Database engine is not configured.")
+        return
+
+    print("Attempting to connect to the database...")
+    try:
+        with engine.connect() as connection:
+            print("Connection successful.")
+
+            print("Executing CREATE TABLE statement for unit_search...")
+            with connection.begin():
+                connection.execute(text(unit_search.SQL_CREATE_TABLE))
+            print("Table 'unit_search' exists.")
+
+            print("Rebuilding search rows from test_db...")
+            started = time.monotonic()
+            with connection.begin():
+                unit_search.rebuild(connection)
+            count = connection.execute(text("SELECT COUNT(*) FROM unit_search")).scalar_one()
+            print(f"Indexed {count} unit(s) in {time.monotonic() - started:.1f}s.")
+
+    except OperationalError as e:
+        print(f"\nDatabase Connection Error: Could not connect to the database.")
+        print(f"Please check your database server is running and connection details are correct.")
+        print(f"Error details: {e}")
+    except SQLAlchemyError as e:
+        print(f"\nAn error occurred while creating or filling unit_search: {e}")
+    except Exception as e:
+        print(f"\nAn unexpected error occurred: {e}")
+
+if __name__ == "__main__":
+    create_search_table()
@@ -0,0 +1,68 @@
+# create_step_rollup.py
+import argparse
+import sys
+import time
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError, OperationalError
+
+# Assuming db_connector.py is in the same directory and defines 'engine'
+try:
+    from db_connector import engine
+except ImportError:
+    print("Error: Could not import 'engine' from db_connector.py.")
+    print("Ensure db_connector.py is in the same directory and defines the SQLAlchemy engine.")
+    sys.exit(1)
+import step_rollup
+
+# Creates the step_duration_daily rollup used by the step-time report and builds it from
+# newDaysInStep. The app keeps it current incrementally; run with --rebuild (e.g. nightly
+# from cron) to also pick up deleted or re-dated steps.
+#
+#   python create_step_rollup.py
+#   python create_step_rollup.py --rebuild
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Create and build the step_duration_daily rollup of newDaysInStep.")
+    parser.add_argument('--rebuild', action='store_true', help="Recompute every day even if the rollup is already built")
+    return parser.parse_args()
+
+def create_step_rollup(args):
+    """Connects to the database, creates the rollup tables if needed and builds the rollup."""
+    if engine is None:
+        print("Error: Database engine is not configured.")
+        return
+
+    print("Attempting to connect to the database...")
+    try:
+        with engine.connect() as connection:
+            print("Connection successful.")
+
+            print("Executing CREATE TABLE statements for step_duration_daily...")
+            with connection.begin():
+                for sql in step_rollup.SQL_CREATE_TABLES:
+                    connection.execute(text(sql))
+            print("Tables 'step_duration_daily' and 'step_duration_daily_state' exist.")
+
+            built = connection.execute(text("SELECT COUNT(*) FROM step_duration_daily_state")).scalar_one() > 0
+            connection.rollback()
+            if built and not args.rebuild:
+                print("Rollup is already built; the app refreshes it incrementally. Use --rebuild to recompute it.")
+                return
+
+            print("Building rollup from newDaysInStep...")
+            started = time.monotonic()
+            with connection.begin():
+                rows = step_rollup.rebuild(connection)
+            print(f"Rollup built: {rows} (day, step) rows in {time.monotonic() - started:.1f}s.")
+
+    except OperationalError as e:
+        print(f"\nDatabase Connection Error: Could not connect to the database.")
+        print(f"Please check your database server is running and connection details are correct.")
+        print(f"Error details: {e}")
+    except SQLAlchemyError as e:
+        print(f"\nAn error occurred while building the rollup: {e}")
+    except Exception as e:
+        print(f"\nAn unexpected error occurred: {e}")
+
+if __name__ == "__main__":
+    create_step_rollup(parse_args())
@@ -0,0 +1,55 @@
+# csv_export.py
+import csv
+import io
+import os
+from sqlalchemy.exc import SQLAlchemyError
+
+# Streams query results to the browser as CSV. Rows are read in keyset-paged batches of
+# EXPORT_BATCH_ROWS (WHERE key > :last ORDER BY key LIMIT n, as in migrate_images.py) and written
+# out batch by batch, so a worker only ever holds one batch in memory however many rows the export
+# has. Server-side cursors (stream_results) can't be relied on for this: the mysqlconnector dialect
+# does not support them and buffers the whole result. Columns are (header, row key) pairs.
+
+EXPORT_BATCH_ROWS = int(os.getenv('EXPORT_BATCH_ROWS', '1000'))
+_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r') # Spreadsheets would run these as formulas
+
+
+def _cell(value):
+    if value is None: return ''
+    if isinstance(value, str) and value.startswith(_FORMULA_PREFIXES): return "'" + value
+    return value
+
+def _format_row(row, columns):
+    return [_cell(row[key]) for _, key in columns]
+
+def stream_pages(engine, columns, fetch_page):
+    """Yields CSV text: a header line, then rows from fetch_page(connection, last_row) batch by batch.
+
+    fetch_page returns up to limit rows (mappings) in its key order, starting after last_row
+    (None for the first batch); it is called again until it returns a short batch. Each batch
+    checks a pool connection out only while it runs, so a slow download holds none.
+    """
+    buffer = io.StringIO(); writer = csv.writer(buffer)
+    writer.writerow([header for header, _ in columns])
+    yield buffer.getvalue()
+    last_row = None
+    while True:
+        try:
+            with engine.connect() as connection:
+                page = fetch_page(connection, last_row, EXPORT_BATCH_ROWS)
+        except SQLAlchemyError as e:
+            print(f"DB error streaming CSV export: {e}")
+            raise # Headers are already sent; aborting the response marks the download as failed
+        if page:
+            buffer.seek(0); buffer.truncate()
+            writer.writerows(_format_row(row, columns) for row in page)
+            yield buffer.getvalue()
+        if len(page) < EXPORT_BATCH_ROWS: return
+        last_row = page[-1]
+
+def rows(columns, items):
+    """CSV text for rows already in memory (small aggregate reports), in the same format as stream_pages."""
+    buffer = io.StringIO(); writer = csv.writer(buffer)
+    writer.writerow([header for header, _ in columns])
+    writer.writerows(_format_row(item, columns) for item in items)
+    return buffer.getvalue()
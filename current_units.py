@@ -0,0 +1,103 @@
+# current_units.py
+import os
+import threading
+import time
+from sqlalchemy import text
+
+# Stock numbers repeat in test_db. current_units holds the latest test_db row (highest id) per
+# stockNumber, so list pages can read units directly instead of running
+# ROW_NUMBER() OVER(PARTITION BY stockNumber ...) over the whole table on every request.
+#
+# New test_db rows are copied in by id watermark (sync_new_rows); routes that update existing
+# rows call sync_unit in the same transaction. Edits other systems make to existing rows are
+# picked up by reconcile_current_units.py, which also creates the table.
+
+SQL_CREATE_TABLE = """
+CREATE TABLE IF NOT EXISTS current_units (
+    stockNumber VARCHAR(200) NOT NULL PRIMARY KEY,
+    id INT NOT NULL, -- test_db.id of the row this copy came from
+    vin VARCHAR(64) NULL,
+    year VARCHAR(10) NULL,
+    make VARCHAR(100) NULL,
+    model VARCHAR(100) NULL,
+    location VARCHAR(100) NULL,
+    dateIn DATETIME NULL,
+    promiseDate DATETIME NULL,
+    sort_date DATETIME NOT NULL, -- dateIn, or NULL_SORT_DATE so undated units sort last
+
+    UNIQUE INDEX idx_id (id),
+    INDEX idx_sort (sort_date, id),
+    INDEX idx_location (location, sort_date),
+    INDEX idx_promise_date (promiseDate)
+) ENGINE=InnoDB;
+"""
+
+NULL_SORT_DATE = '1000-01-01'
+COLUMNS = ('stockNumber', 'id', 'vin', 'year', 'make', 'model', 'location', 'dateIn', 'promiseDate', 'sort_date')
+_SELECT_COLUMNS = f"""
+    SELECT t.stockNumber, t.id, t.vin, t.year, t.make, t.model, t.location, t.dateIn, t.promiseDate,
+           COALESCE(t.dateIn, CAST('{NULL_SORT_DATE}' AS DATETIME))
+"""
+_INSERT = f"INSERT INTO current_units ({', '.join(COLUMNS)})"
+_DATA_COLUMNS = [column for column in COLUMNS if column not in ('stockNumber', 'id')]
+# Incremental sync: only a newer test_db row replaces the stored one. id is assigned last because
+# MySQL evaluates the assignments left to right and the comparisons must see the old id.
+_UPDATE_IF_NEWER = "ON DUPLICATE KEY UPDATE " + ", ".join(
+    [f"{column} = IF(VALUES(id) >= id, VALUES({column}), {column})" for column in _DATA_COLUMNS] + ["id = GREATEST(id, VALUES(id))"])
+# Reconcile/one-unit refresh: the row being written is known to be the latest, so it always wins
+_UPDATE_ALWAYS = "ON DUPLICATE KEY UPDATE " + ", ".join(f"{column} = VALUES({column})" for column in _DATA_COLUMNS + ['id'])
+
+_LATEST_ROWS = "test_db t JOIN (SELECT stockNumber, MAX(id) AS id FROM test_db WHERE stockNumber IS NOT NULL GROUP BY stockNumber) latest ON t.id = latest.id"
+
+SQL_SYNC_NEW_ROWS = f"{_INSERT} {_SELECT_COLUMNS} FROM test_db t WHERE t.id > :watermark AND t.stockNumber IS NOT NULL ORDER BY t.id {_UPDATE_IF_NEWER}"
+SQL_SYNC_ONE_UNIT = f"{_INSERT} {_SELECT_COLUMNS} FROM test_db t WHERE t.stockNumber = :sn ORDER BY t.id DESC LIMIT 1 {_UPDATE_ALWAYS}"
+SQL_UPSERT_ALL = f"{_INSERT} {_SELECT_COLUMNS} FROM {_LATEST_ROWS} {_UPDATE_ALWAYS}"
+SQL_DELETE_ORPHANS = """
+    DELETE c FROM current_units c
+    LEFT JOIN test_db t ON t.stockNumber = c.stockNumber
+    WHERE t.stockNumber IS NULL
+"""
+# Drift between the projection and test_db, for reconcile reports
+SQL_COUNT_STALE = f"""
+    SELECT COUNT(*) FROM {_LATEST_ROWS}
+    LEFT JOIN current_units c ON c.stockNumber = t.stockNumber
+    WHERE c.stockNumber IS NULL OR c.id <> t.id
+       OR NOT (c.vin <=> t.vin AND c.year <=> CAST(t.year AS CHAR) AND c.make <=> t.make AND c.model <=> t.model
+               AND c.location <=> t.location AND c.dateIn <=> t.dateIn AND c.promiseDate <=> t.promiseDate)
+"""
+SQL_COUNT_ORPHANS = "SELECT COUNT(*) FROM current_units c LEFT JOIN test_db t ON t.stockNumber = c.stockNumber WHERE t.stockNumber IS NULL"
+
+SYNC_INTERVAL_SECONDS = int(os.getenv('CURRENT_UNITS_SYNC_INTERVAL', '30')) # How often list pages first pull new test_db rows
+
+_last_sync = 0.0
+_sync_lock = threading.Lock()
+
+
+def sync_new_rows(engine, force=False):
+    """Copies test_db rows added since the last sync into current_units (at most every SYNC_INTERVAL_SECONDS).
+
+    Runs in its own short transaction so it never mixes with the caller's work.
+    """
+    global _last_sync
+    if not force and time.monotonic() - _last_sync < SYNC_INTERVAL_SECONDS: return
+    if not _sync_lock.acquire(blocking=False): return # Another request is already syncing
+    try:
+        with engine.begin() as connection:
+            watermark = connection.execute(text("SELECT COALESCE(MAX(id), 0) FROM current_units")).scalar_one()
+            connection.execute(text(SQL_SYNC_NEW_ROWS), {"watermark": watermark})
+        _last_sync = time.monotonic()
+    finally:
+        _sync_lock.release()
+
+def sync_unit(connection, stock_number):
+    """Refreshes one unit after the app updates its test_db rows. Call inside the transaction that made the change."""
+    connection.execute(text(SQL_SYNC_ONE_UNIT), {"sn": stock_number})
+
+def drift(connection):
+    """Returns (stale_or_missing, orphaned) row counts between current_units and test_db."""
+    return connection.execute(text(SQL_COUNT_STALE)).scalar_one(), connection.execute(text(SQL_COUNT_ORPHANS)).scalar_one()
+
+def reconcile(connection):
+    """Rewrites every unit from its latest test_db row and drops units no longer in test_db."""
+    connection.execute(text(SQL_UPSERT_ALL))
+    return connection.execute(text(SQL_DELETE_ORPHANS)).rowcount
@@ -0,0 +1,66 @@
+# dashboard_summary.py
+import datetime
+import os
+import threading
+import time
+from sqlalchemy import text
+import date_ranges
+
+# Header counters shown on the dashboard. Every login and most redirects land on the
+# dashboard, so these are kept in process and only re-counted when a route that changes
+# them calls invalidate(), or after SUMMARY_TTL_SECONDS to pick up writes made by other systems.
+
+SUMMARY_TTL_SECONDS = int(os.getenv('DASHBOARD_SUMMARY_TTL', '300'))
+
+# Counter name -> scalar subquery. Date bounds are a half-open range (date_ranges) so the dateTime index can be used.
+COUNTER_SQL = {
+    'units_in_detail': "SELECT COUNT(DISTINCT stockNumber) FROM jobs WHERE complete = 1",
+    'ready_pickup_count': "SELECT COUNT(*) FROM test_db WHERE location = 'Ready for Pickup'",
+    'notes_today_count': "SELECT COUNT(*) FROM notes WHERE dateTime >= :today AND dateTime < :tomorrow",
+}
+
+
+class DashboardSummary:
+    """In-process store for the dashboard counters.
+
+    Stale counters are re-counted together in a single query. A counter invalidated while
+    it is being loaded is not overwritten with the (possibly older) loaded value.
+    """
+
+    def __init__(self, ttl_seconds=SUMMARY_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._values = {} # name -> (value, loaded_at)
+        self._generation = {name: 0 for name in COUNTER_SQL} # Bumped by invalidate()
+        self._day = None
+        self._lock = threading.Lock()
+
+    def get(self, connection):
+        """Returns {counter name: value}, re-counting only what is missing or expired."""
+        today = datetime.date.today()
+        now = time.monotonic()
+        with self._lock:
+            if self._day != today: # notes_today_count belongs to a calendar day
+                self._values.clear(); self._day = today
+            stale = [name for name in COUNTER_SQL
+                     if name not in self._values or now - self._values[name][1] >= self.ttl_seconds]
+            generations = {name: self._generation[name] for name in stale}
+        if stale:
+            columns = ", ".join(f"({COUNTER_SQL[name]}) AS {name}" for name in stale)
+            day_start, day_end = date_ranges.day_range(today)
+            row = connection.execute(text(f"SELECT {columns}"), {"today": day_start, "tomorrow": day_end}).mappings().one()
+            with self._lock:
+                for name in stale:
+                    if self._generation[name] == generations[name] and self._day == today:
+                        self._values[name] = (row[name] or 0, now)
+            loaded = {name: row[name] or 0 for name in stale}
+        else:
+            loaded = {}
+        with self._lock:
+            return {name: loaded.get(name, self._values.get(name, (0, None))[0]) for name in COUNTER_SQL}
+
+    def invalidate(self, *names):
+        """Forces the named counters (or all of them) to be re-counted on the next dashboard load."""
+        with self._lock:
+            for name in names or tuple(COUNTER_SQL):
+                self._values.pop(name, None)
+                self._generation[name] += 1
@@ -0,0 +1,24 @@
+# date_ranges.py
+import datetime
+
+# Half-open [start, end) datetime bounds for day/year filters. Queries compare the raw column
+#   WHERE col >= :start AND col < :end
+# instead of wrapping it (DATE(col) = :day, YEAR(col) = :year), so MySQL can range-scan an
+# index on the column. The results are the same: a DATETIME falls on day D exactly when it is
+# >= D 00:00:00 and < (D + 1) 00:00:00.
+
+def _as_date(value):
+    return value.date() if isinstance(value, datetime.datetime) else value
+
+def day_range(day):
+    """Bounds covering one calendar day (a date or datetime)."""
+    start = datetime.datetime.combine(_as_date(day), datetime.time.min)
+    return start, start + datetime.timedelta(days=1)
+
+def days_range(first_day, last_day):
+    """Bounds covering first_day through last_day, both inclusive."""
+    return day_range(first_day)[0], day_range(last_day)[1]
+
+def year_range(year):
+    """Bounds covering one calendar year."""
+    return datetime.datetime(year, 1, 1), datetime.datetime(year + 1, 1, 1)
@@ -0,0 +1,78 @@
+# image_renditions.py
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageOps
+import image_store
+
+# --- Configuration ---
+# Fixed sizes generated for every stored image. 'original' is the stored blob itself.
+RENDITIONS = {
+    'thumb': (320, 320),   # Gallery grid
+    'medium': (1600, 1600), # Lightbox view
+}
+RENDITION_QUALITY = 82 # JPEG quality for generated renditions
+RENDITION_WORKERS = int(os.getenv('IMAGE_RENDITION_WORKERS', '2'))
+RENDITION_DIR = os.path.join(image_store.IMAGE_STORE_DIR, 'renditions')
+
+def rendition_path(sha256, size):
+    """Returns where the given rendition of a stored image lives (whether or not it exists yet)."""
+    return os.path.join(RENDITION_DIR, size, sha256[0:2], f"{sha256}.jpg")
+
+def _render(sha256):
+    """Decodes the stored original once and writes every rendition size for it."""
+    with Image.open(image_store.blob_path(sha256)) as source:
+        largest = max(RENDITIONS.values())
+        source.draft('RGB', largest) # Lets JPEG decode at a reduced scale, much faster for phone photos
+        image = ImageOps.exif_transpose(source) # Phones store rotation in EXIF; bake it in
+        if image.mode not in ('RGB', 'L'): image = image.convert('RGB')
+        for size, box in sorted(RENDITIONS.items(), key=lambda item: item[1], reverse=True):
+            rendition = image.copy()
+            rendition.thumbnail(box, Image.Resampling.LANCZOS)
+            path = rendition_path(sha256, size)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            rendition.save(tmp_path, 'JPEG', quality=RENDITION_QUALITY, optimize=True)
+            os.replace(tmp_path, path) # Never expose a half-written file
+            image = rendition # Next (smaller) size is made from this one
+
+
+class RenditionPipeline:
+    """Background thread pool that generates renditions for stored images.
+
+    Pillow releases the GIL while decoding and resizing, so threads are enough and
+    avoid pickling images across processes. Status is kept in process only; the
+    files on disk are the source of truth for what is ready.
+    """
+
+    def __init__(self, workers=RENDITION_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='image-rendition')
+        self._status = {} # sha256 -> 'pending' | 'failed'
+        self._lock = threading.Lock()
+
+    def submit(self, sha256):
+        """Queues rendition generation for an image unless it is already queued or has failed."""
+        with self._lock:
+            if sha256 in self._status: return
+            self._status[sha256] = 'pending'
+        self._executor.submit(self._run, sha256)
+
+    def _run(self, sha256):
+        try:
+            _render(sha256)
+            with self._lock: self._status.pop(sha256, None)
+        except Exception as e:
+            print(f"Error generating renditions for image {sha256}: {e}")
+            with self._lock: self._status[sha256] = 'failed'
+
+    def status(self, sha256):
+        with self._lock:
+            return self._status.get(sha256)
+
+    def get_path(self, sha256, size):
+        """Returns the rendition's path if it is ready. Otherwise queues it (for images stored
+        before this pipeline existed) and returns None so the caller serves the original."""
+        path = rendition_path(sha256, size)
+        if os.path.isfile(path): return path
+        if self.status(sha256) is None: self.submit(sha256)
+        return None
@@ -0,0 +1,85 @@
+# image_store.py
+import hashlib
+import io
+import os
+import tempfile
+
+# --- Configuration ---
+# Unit photos are stored once per distinct content, named by their SHA-256 hash:
+#   <IMAGE_STORE_DIR>/ab/cd/abcd1234...  (first two byte pairs fan out the directories)
+# Anchored to this file's directory (not the working directory) so every entry point, and Flask's
+# send_file (which resolves relative paths against app.root_path), agree on where blobs live
+_BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+IMAGE_STORE_DIR = os.path.join(_BASE_DIR, os.getenv('IMAGE_STORE_DIR', os.path.join('data', 'image_store')))
+CHUNK_SIZE = 64 * 1024 # Bytes read/written per step while streaming an upload
+
+# Leading bytes of the image types ALLOWED_EXTENSIONS permits in app.py
+_MAGIC_NUMBERS = [
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+]
+
+ALLOWED_CONTENT_TYPES = {'image/jpeg', 'image/png', 'image/gif', 'image/webp'}
+
+
+class UnsupportedImageType(ValueError):
+    """Raised by save_stream() when the content is not one of ALLOWED_CONTENT_TYPES."""
+
+
+def blob_path(sha256):
+    """Returns the on-disk path for a stored image hash."""
+    return os.path.join(IMAGE_STORE_DIR, sha256[0:2], sha256[2:4], sha256)
+
+def exists(sha256):
+    return bool(sha256) and os.path.isfile(blob_path(sha256))
+
+def sniff_content_type(header_bytes, default='application/octet-stream'):
+    """Guesses an image MIME type from the first bytes of the file."""
+    for magic, content_type in _MAGIC_NUMBERS:
+        if header_bytes.startswith(magic): return content_type
+    if header_bytes[0:4] == b'RIFF' and header_bytes[8:12] == b'WEBP': return 'image/webp'
+    return default
+
+def save_stream(stream):
+    """Copies a file-like object into the store in chunks, hashing as it goes.
+
+    Returns (sha256_hex, size_in_bytes, content_type). The data is written to a temp
+    file first and renamed into place, so readers never see a partial blob. If the
+    same content is already stored the temp copy is discarded. The type is sniffed from
+    the content (never taken from the client); anything outside ALLOWED_CONTENT_TYPES
+    raises UnsupportedImageType and nothing is stored.
+    """
+    tmp_dir = os.path.join(IMAGE_STORE_DIR, 'tmp')
+    os.makedirs(tmp_dir, exist_ok=True)
+    hasher = hashlib.sha256()
+    size = 0
+    header = b''
+    tmp_file = tempfile.NamedTemporaryFile(dir=tmp_dir, delete=False)
+    try:
+        with tmp_file:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk: break
+                if len(header) < 16: header += chunk[:16 - len(header)]
+                hasher.update(chunk)
+                tmp_file.write(chunk)
+                size += len(chunk)
+        content_type = sniff_content_type(header)
+        if content_type not in ALLOWED_CONTENT_TYPES: raise UnsupportedImageType(content_type)
+        sha256 = hasher.hexdigest()
+        final_path = blob_path(sha256)
+        if os.path.isfile(final_path):
+            os.remove(tmp_file.name) # Already stored (same photo uploaded twice)
+        else:
+            os.makedirs(os.path.dirname(final_path), exist_ok=True)
+            os.replace(tmp_file.name, final_path)
+    except Exception:
+        if os.path.exists(tmp_file.name): os.remove(tmp_file.name)
+        raise
+    return sha256, size, content_type
+
+def save_bytes(data):
+    """Stores an in-memory image; same return value as save_stream()."""
+    return save_stream(io.BytesIO(data))
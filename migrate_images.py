@@ -0,0 +1,163 @@
+# migrate_images.py
+import argparse
+import base64
+import binascii
+import json
+import os
+import sys
+import time
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError, OperationalError
+
+# Assuming db_connector.py is in the same directory and defines 'engine'
+try:
+    from db_connector import engine
+except ImportError:
+    print("Error: Could not import 'engine' from db_connector.py.")
+    print("Ensure db_connector.py is in the same directory and defines the SQLAlchemy engine.")
+    sys.exit(1)
+import image_store
+
+# Converts existing Base64 rows in 'images' to the on-disk image store (see image_store.py).
+# Run create_image_store.py first. Safe to stop and re-run: rows are read in id order
+# after the last id recorded in the progress file, and converted rows are skipped anyway.
+#
+#   python migrate_images.py --dry-run
+#   python migrate_images.py --batch-size 100 --pause 2
+
+DEFAULT_PROGRESS_FILE = os.path.join('data', 'migrate_images_progress.json')
+MAX_BATCH_SIZE = 1000
+
+SQL_FETCH_BATCH = """
+SELECT id, image
+FROM images
+WHERE id > :last_id AND sha256 IS NULL AND image IS NOT NULL
+ORDER BY id
+LIMIT :batch_size
+"""
+SQL_UPDATE_ROW = """
+UPDATE images
+SET sha256 = :sha256, content_type = :content_type, byte_size = :byte_size {clear_image}
+WHERE id = :id AND sha256 IS NULL
+"""
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Move Base64 images out of the images table into the image store.")
+    parser.add_argument('--batch-size', type=int, default=200, help=f"Rows per batch (max {MAX_BATCH_SIZE}, default 200)")
+    parser.add_argument('--pause', type=float, default=1.0, help="Seconds to sleep between batches (default 1.0)")
+    parser.add_argument('--limit', type=int, default=None, help="Stop after this many rows")
+    parser.add_argument('--dry-run', action='store_true', help="Decode and hash rows but write nothing")
+    parser.add_argument('--keep-base64', action='store_true', help="Leave the old image text in place after converting")
+    parser.add_argument('--progress-file', default=DEFAULT_PROGRESS_FILE, help="Where the last converted id is recorded")
+    parser.add_argument('--restart', action='store_true', help="Ignore saved progress and start from the first row")
+    return parser.parse_args()
+
+def load_progress(path):
+    try:
+        with open(path) as f: return json.load(f)
+    except FileNotFoundError: return {'last_id': 0, 'failed_ids': []}
+
+def save_progress(path, progress):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f: json.dump(progress, f)
+    os.replace(tmp_path, path)
+
+def check_schema(connection):
+    """Returns True if create_image_store.py has added the sha256 column."""
+    sql = text("SELECT COUNT(*) FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'images' AND COLUMN_NAME = 'sha256'")
+    return connection.execute(sql).scalar_one() > 0
+
+def convert_batch(last_id, batch_size, dry_run, failed_ids):
+    """Streams one batch of rows with a server-side cursor and writes each image to the store.
+
+    Only (id, hash, type, size) is kept per row, so memory stays at one row's image.
+    Returns (rows_seen, last_id, updates, bytes_decoded).
+    """
+    rows_seen = 0; bytes_decoded = 0; updates = []
+    with engine.connect() as connection:
+        streaming = connection.execution_options(stream_results=True)
+        result = streaming.execute(text(SQL_FETCH_BATCH), {"last_id": last_id, "batch_size": batch_size})
+        for row in result:
+            rows_seen += 1
+            last_id = row.id
+            try:
+                image_bytes = base64.b64decode(row.image, validate=False)
+            except (binascii.Error, ValueError, TypeError) as e:
+                print(f"  Skipping image {row.id}: invalid Base64 ({e})")
+                failed_ids.append(row.id)
+                continue
+            if not image_bytes:
+                print(f"  Skipping image {row.id}: empty data")
+                failed_ids.append(row.id)
+                continue
+            bytes_decoded += len(image_bytes)
+            content_type = image_store.sniff_content_type(image_bytes[:16])
+            if content_type not in image_store.ALLOWED_CONTENT_TYPES:
+                print(f"  Skipping image {row.id}: not a png/jpeg/gif/webp image")
+                failed_ids.append(row.id)
+                continue
+            if dry_run:
+                sha256 = None
+            else:
+                sha256, _, _ = image_store.save_bytes(image_bytes)
+            updates.append({"id": row.id, "sha256": sha256, "content_type": content_type, "byte_size": len(image_bytes)})
+            del image_bytes
+        result.close()
+    return rows_seen, last_id, updates, bytes_decoded
+
+def migrate_images(args):
+    if engine is None:
+        print("Error: Database engine is not configured.")
+        return
+    batch_size = max(1, min(args.batch_size, MAX_BATCH_SIZE))
+    progress = {'last_id': 0, 'failed_ids': []} if args.restart else load_progress(args.progress_file)
+    clear_image = "" if args.keep_base64 else ", image = NULL"
+    sql_update = text(SQL_UPDATE_ROW.format(clear_image=clear_image))
+
+    with engine.connect() as connection:
+        if not check_schema(connection):
+            print("Error: images.sha256 column not found. Run create_image_store.py first.")
+            return
+        remaining = connection.execute(text("SELECT COUNT(*) FROM images WHERE id > :last_id AND sha256 IS NULL AND image IS NOT NULL"),
+                                       {"last_id": progress['last_id']}).scalar_one()
+    print(f"{'DRY RUN: ' if args.dry_run else ''}{remaining} row(s) to convert, starting after id {progress['last_id']} (batch size {batch_size}).")
+
+    total_rows = 0; total_converted = 0; total_bytes = 0
+    started = time.monotonic()
+    while args.limit is None or total_rows < args.limit:
+        this_batch = batch_size if args.limit is None else min(batch_size, args.limit - total_rows)
+        batch_started = time.monotonic()
+        rows_seen, last_id, updates, bytes_decoded = convert_batch(progress['last_id'], this_batch, args.dry_run, progress['failed_ids'])
+        if rows_seen == 0: break
+
+        if updates and not args.dry_run:
+            with engine.connect() as connection:
+                with connection.begin():
+                    connection.execute(sql_update, updates) # executemany, one short transaction per batch
+        progress['last_id'] = last_id
+        if not args.dry_run: save_progress(args.progress_file, progress)
+
+        total_rows += rows_seen; total_converted += len(updates); total_bytes += bytes_decoded
+        batch_seconds = max(time.monotonic() - batch_started, 1e-6)
+        elapsed = max(time.monotonic() - started, 1e-6)
+        print(f"  Batch up to id {last_id}: {len(updates)}/{rows_seen} converted, "
+              f"{bytes_decoded / 1e6:.1f} MB in {batch_seconds:.2f}s ({rows_seen / batch_seconds:.0f} rows/s) | "
+              f"total {total_converted} rows, {total_bytes / 1e6:.1f} MB, {total_rows / elapsed:.0f} rows/s, {total_bytes / 1e6 / elapsed:.1f} MB/s")
+        if args.pause > 0: time.sleep(args.pause) # Give live traffic room between batches
+
+    elapsed = max(time.monotonic() - started, 1e-6)
+    print(f"\n{'DRY RUN complete' if args.dry_run else 'Done'}: {total_converted} of {total_rows} row(s) converted, "
+          f"{total_bytes / 1e6:.1f} MB in {elapsed:.1f}s ({total_rows / elapsed:.0f} rows/s, {total_bytes / 1e6 / elapsed:.1f} MB/s).")
+    if progress['failed_ids']: print(f"{len(progress['failed_ids'])} row(s) could not be decoded: {progress['failed_ids'][:20]}{' ...' if len(progress['failed_ids']) > 20 else ''}")
+
+if __name__ == "__main__":
+    try:
+        migrate_images(parse_args())
+    except OperationalError as e:
+        print(f"\nDatabase Connection Error: Could not connect to the database.")
+        print(f"Error details: {e}")
+    except SQLAlchemyError as e:
+        print(f"\nA database error occurred during migration: {e}")
+    except KeyboardInterrupt:
+        print("\nInterrupted. Progress up to the last completed batch has been saved; re-run to continue.")
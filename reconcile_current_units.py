@@ -0,0 +1,74 @@
+# reconcile_current_units.py
+import argparse
+import sys
+import time
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError, OperationalError
+
+# Assuming db_connector.py is in the same directory and defines 'engine'
+try:
+    from db_connector import engine
+except ImportError:
+    print("Error: Could not import 'engine' from db_connector.py.")
+    print("Ensure db_connector.py is in the same directory and defines the SQLAlchemy engine.")
+    sys.exit(1)
+import current_units
+
+# Creates the current_units projection (latest test_db row per stockNumber) if needed and
+# brings it back in line with test_db. The app only copies in new test_db rows and the rows
+# it updates itself; run this (e.g. nightly from cron) to pick up edits made by other systems.
+#
+#   python reconcile_current_units.py --check
+#   python reconcile_current_units.py
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Create and reconcile the current_units projection of test_db.")
+    parser.add_argument('--check', action='store_true', help="Only report how far current_units has drifted; change nothing")
+    return parser.parse_args()
+
+def table_exists(connection):
+    sql = text("SELECT COUNT(*) FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'current_units'")
+    return connection.execute(sql).scalar_one() > 0
+
+def reconcile_current_units(args):
+    """Connects to the database, creates current_units if needed, reports drift and fixes it."""
+    if engine is None:
+        print("Error: Database engine is not configured.")
+        return
+
+    print("Attempting to connect to the database...")
+    try:
+        with engine.connect() as connection:
+            print("Connection successful.")
+
+            if not args.check:
+                print("Executing CREATE TABLE statement for current_units...")
+                with connection.begin():
+                    connection.execute(text(current_units.SQL_CREATE_TABLE))
+                print("Table 'current_units' exists.")
+            elif not table_exists(connection):
+                print("Table 'current_units' does not exist yet. Run without --check to create it.")
+                return
+
+            stale, orphaned = current_units.drift(connection)
+            connection.rollback() # End the read's implicit transaction before the write below
+            print(f"Drift: {stale} unit(s) missing or out of date, {orphaned} unit(s) no longer in test_db.")
+            if args.check: return
+
+            started = time.monotonic()
+            with connection.begin():
+                deleted = current_units.reconcile(connection)
+            count = connection.execute(text("SELECT COUNT(*) FROM current_units")).scalar_one()
+            print(f"Reconciled {count} unit(s) ({deleted} removed) in {time.monotonic() - started:.1f}s.")
+
+    except OperationalError as e:
+        print(f"\nDatabase Connection Error: Could not connect to the database.")
+        print(f"Please check your database server is running and connection details are correct.")
+        print(f"Error details: {e}")
+    except SQLAlchemyError as e:
+        print(f"\nAn error occurred while reconciling current_units: {e}")
+    except Exception as e:
+        print(f"\nAn unexpected error occurred: {e}")
+
+if __name__ == "__main__":
+    reconcile_current_units(parse_args())
@@ -0,0 +1,130 @@
+# reference_data.py
+import os
+import threading
+import time
+from sqlalchemy import text
+
+# Small lookup tables (service pricing, techs, status colors) that change a few times a month
+# but are read by the busiest pages. Each table is loaded once per process and served from
+# memory. Every VERSION_CHECK_SECONDS one cheap probe query fingerprints all of them
+# (row count + XOR of row CRCs) and only tables whose fingerprint changed are reloaded.
+# invalidate() forces a reload straight away, e.g. after the app edits one of the tables.
+
+VERSION_CHECK_SECONDS = int(os.getenv('REFERENCE_DATA_CHECK_INTERVAL', '30'))
+
+
+class Dataset:
+    """One cached table: the query that loads it and the columns that fingerprint it."""
+
+    def __init__(self, name, table, columns, load_sql, shape=None):
+        self.name = name
+        self.table = table
+        self.columns = columns
+        self.load_sql = load_sql
+        self.shape = shape # Optional function turning the loaded rows into the cached value
+
+    @property
+    def version_sql(self):
+        return (f"SELECT CONCAT(COUNT(*), ':', COALESCE(BIT_XOR(CRC32(CONCAT_WS('|', {', '.join(self.columns)}))), 0)) "
+                f"FROM {self.table}")
+
+
+def status_key(status):
+    """Normalises a status name the way MySQL's default collation compares it (case and trailing spaces ignored)."""
+    return str(status).rstrip().lower() if status is not None else None
+
+def _color_map(rows):
+    return {status_key(row['status']): row['color'] for row in rows if row['status'] is not None}
+
+DATASETS = (
+    Dataset('services', 'AutospaPricing', ('id', 'service', 'cost'), "SELECT id, service, cost FROM AutospaPricing ORDER BY service"),
+    Dataset('techs', 'techs', ('techNumber', 'techName'), "SELECT techNumber, techName FROM techs ORDER BY techName"),
+    Dataset('location_colors', 'reconStatus', ('status', 'color'), "SELECT status, color FROM reconStatus", _color_map),
+    Dataset('step_colors', 'newStatus', ('status', 'color'), "SELECT status, color FROM newStatus", _color_map),
+)
+
+
+class ReferenceData:
+    """Thread-safe, versioned in-process cache for the DATASETS tables, with hit/load metrics."""
+
+    def __init__(self, datasets=DATASETS, check_interval=VERSION_CHECK_SECONDS):
+        self.datasets = {dataset.name: dataset for dataset in datasets}
+        self.check_interval = check_interval
+        self._values = {} # name -> cached value
+        self._versions = {} # name -> fingerprint the cached value was loaded at
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+        self._check_lock = threading.Lock()
+        self._metrics = {name: {'hits': 0, 'loads': 0, 'last_load_ms': None, 'loaded_at': None} for name in self.datasets}
+        self._version_checks = 0; self._last_check_ms = None; self._invalidations = 0
+
+    def get(self, name, connection):
+        """Returns the cached rows for name (a tuple of dicts, or a dict for the color maps),
+        loading them with connection on first use or after a change."""
+        self._check_versions(connection)
+        with self._lock:
+            if name in self._values:
+                self._metrics[name]['hits'] += 1
+                return self._values[name]
+        return self._load(name, connection)
+
+    def services(self, connection): return self.get('services', connection)
+    def techs(self, connection): return self.get('techs', connection)
+
+    def location_color(self, location, connection):
+        """reconStatus color for a test_db location, or None."""
+        return self.get('location_colors', connection).get(status_key(location))
+
+    def step_color(self, step, connection):
+        """newStatus color for a newDaysInStep step, or None."""
+        return self.get('step_colors', connection).get(status_key(step))
+
+    def invalidate(self, name=None):
+        """Drops one dataset (or all of them) so the next read reloads it."""
+        with self._lock:
+            for key in ([name] if name else list(self.datasets)):
+                self._values.pop(key, None); self._versions.pop(key, None)
+            self._invalidations += 1
+
+    def version(self, name, connection):
+        """Fingerprint of the cached copy of name (loading it first if needed), for use in ETags."""
+        self.get(name, connection)
+        with self._lock:
+            return self._versions.get(name)
+
+    def stats(self):
+        """Hit/load counts per dataset plus version-check timings."""
+        with self._lock:
+            datasets = {name: dict(metrics, cached=name in self._values, version=self._versions.get(name))
+                        for name, metrics in self._metrics.items()}
+            return {'datasets': datasets, 'version_checks': self._version_checks, 'last_check_ms': self._last_check_ms,
+                    'invalidations': self._invalidations, 'check_interval_seconds': self.check_interval}
+
+    def _load(self, name, connection):
+        dataset = self.datasets[name]
+        started = time.perf_counter()
+        version = connection.execute(text(dataset.version_sql)).scalar_one()
+        rows = tuple(dict(row) for row in connection.execute(text(dataset.load_sql)).mappings())
+        value = dataset.shape(rows) if dataset.shape else rows
+        with self._lock:
+            self._values[name] = value; self._versions[name] = version
+            metrics = self._metrics[name]
+            metrics['loads'] += 1; metrics['last_load_ms'] = round((time.perf_counter() - started) * 1000, 2); metrics['loaded_at'] = time.time()
+        return value
+
+    def _check_versions(self, connection):
+        """At most every check_interval, fingerprints every table in one query and drops changed ones."""
+        if time.monotonic() - self._last_check < self.check_interval: return
+        if not self._check_lock.acquire(blocking=False): return # Another request is checking; serve what we have
+        try:
+            started = time.perf_counter()
+            columns = ", ".join(f"({dataset.version_sql}) AS {name}" for name, dataset in self.datasets.items())
+            current = connection.execute(text(f"SELECT {columns}")).mappings().one()
+            with self._lock:
+                for name in self.datasets:
+                    if name in self._versions and self._versions[name] != current[name]:
+                        self._values.pop(name, None); self._versions.pop(name, None)
+                self._version_checks += 1; self._last_check_ms = round((time.perf_counter() - started) * 1000, 2)
+            self._last_check = time.monotonic()
+        finally:
+            self._check_lock.release()
@@ -0,0 +1,95 @@
+# report_engine.py
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# Cached report results keyed by (report, start_date, end_date).
+#   - Fresh (younger than fresh_seconds): served from memory.
+#   - Stale but younger than max_stale_seconds: served from memory straight away while one
+#     background refresh runs (stale-while-revalidate).
+#   - Missing or older: computed in the request.
+# Identical requests never compute twice at once: whoever arrives while a computation for the
+# same key is running waits for that one (single-flight). Each worker process has its own copy.
+
+REPORT_FRESH_SECONDS = int(os.getenv('REPORT_FRESH_SECONDS', '60'))
+REPORT_MAX_STALE_SECONDS = int(os.getenv('REPORT_MAX_STALE_SECONDS', '900'))
+REPORT_REFRESH_WORKERS = int(os.getenv('REPORT_REFRESH_WORKERS', '2'))
+
+
+class ReportResult:
+    """A report value plus when it was computed."""
+
+    def __init__(self, value, generated_at, generated_wall):
+        self.value = value
+        self.generated_at = generated_at # time.monotonic() when computed
+        self.generated_wall = generated_wall # time.time() when computed, for display
+
+    @property
+    def age_seconds(self):
+        return time.monotonic() - self.generated_at
+
+
+class ReportEngine:
+    """Stale-while-revalidate, single-flight cache for report queries.
+
+    Loaders take no arguments and must open their own connection, since refreshes run on a
+    background thread after the request that scheduled them has finished.
+    """
+
+    def __init__(self, fresh_seconds=REPORT_FRESH_SECONDS, max_stale_seconds=REPORT_MAX_STALE_SECONDS,
+                 workers=REPORT_REFRESH_WORKERS, max_entries=256):
+        self.fresh_seconds = fresh_seconds
+        self.max_stale_seconds = max_stale_seconds
+        self.max_entries = max_entries
+        self._results = {} # key -> ReportResult
+        self._inflight = {} # key -> Future of the running computation
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='report-refresh')
+        self.stats = {'hits': 0, 'stale_hits': 0, 'misses': 0, 'joined': 0, 'refreshes': 0, 'refresh_errors': 0}
+
+    def get(self, report, start_date, end_date, loader):
+        """Returns a ReportResult for (report, start_date, end_date), calling loader() only when needed."""
+        key = (report, start_date, end_date)
+        with self._lock:
+            result = self._results.get(key)
+            if result is not None and result.age_seconds < self.max_stale_seconds:
+                if result.age_seconds < self.fresh_seconds: self.stats['hits'] += 1
+                else:
+                    self.stats['stale_hits'] += 1
+                    if key not in self._inflight: # One background refresh per key
+                        self._inflight[key] = Future()
+                        self._executor.submit(self._compute, key, loader, True)
+                return result
+            future = self._inflight.get(key)
+            if future is None:
+                future = self._inflight[key] = Future(); owner = True; self.stats['misses'] += 1
+            else:
+                owner = False; self.stats['joined'] += 1
+        if owner: self._compute(key, loader, False)
+        return future.result() # Raises the loader's exception for every waiter
+
+    def invalidate(self, report=None):
+        """Drops cached results for one report (or all of them) so the next request recomputes."""
+        with self._lock:
+            for key in [key for key in self._results if report is None or key[0] == report]: del self._results[key]
+
+    def _compute(self, key, loader, background):
+        with self._lock: future = self._inflight[key]
+        try:
+            result = ReportResult(loader(), time.monotonic(), time.time())
+        except Exception as e:
+            with self._lock: self._inflight.pop(key, None)
+            if background:
+                self.stats['refresh_errors'] += 1
+                print(f"Error refreshing report {key}: {e}") # Keep serving the stale result until max_stale_seconds
+            future.set_exception(e)
+            return
+        with self._lock:
+            if len(self._results) >= self.max_entries and key not in self._results:
+                oldest_key = min(self._results, key=lambda k: self._results[k].generated_at)
+                del self._results[oldest_key]
+            self._results[key] = result
+            self._inflight.pop(key, None)
+            if background: self.stats['refreshes'] += 1
+        future.set_result(result)
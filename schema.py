@@ -0,0 +1,106 @@
+# schema.py
+from sqlalchemy import text
+
+# Secondary indexes the app's queries rely on, declared in one place. create_indexes.py
+# compares them with information_schema and adds the missing ones online.
+# An existing index counts as present when its leading columns match the declared columns
+# (e.g. a declared (stockNumber) is covered by an existing (stockNumber, dateIn)).
+
+class IndexSpec:
+    """One index: the table, a name for it if it has to be created, its columns, and why it exists."""
+
+    def __init__(self, table, name, columns, reason):
+        self.table = table
+        self.name = name
+        self.columns = tuple(columns)
+        self.reason = reason
+
+    def __repr__(self):
+        return f"{self.table}.{self.name} ({', '.join(self.columns)})"
+
+
+INDEXES = (
+    # Unit page sections: lookups by stock number, newest first
+    IndexSpec('images', 'idx_images_stock', ('stockNumber', 'id'), "unit images section, ORDER BY id"),
+    IndexSpec('notes', 'idx_notes_stock_time', ('stockNumber', 'dateTime'), "unit notes section, ORDER BY dateTime"),
+    IndexSpec('newDaysInStep', 'idx_steps_stock_in', ('stockNumber', 'dateIn'), "unit step history, ORDER BY dateIn"),
+    IndexSpec('jobs', 'idx_jobs_stock_added', ('stockNumber', 'dateAdded'), "unit open jobs, ORDER BY dateAdded"),
+    IndexSpec('preApproved', 'idx_preapproved_stock_in', ('stockNumber', 'dateIn'), "unit POs section, ORDER BY dateIn"),
+    IndexSpec('unitInventory', 'idx_inventory_stock_changed', ('stockNumber', 'changed'), "unit inventory, latest by changed"),
+    IndexSpec('test_db', 'idx_test_db_stock_id', ('stockNumber', 'id'), "unit header, latest row per stock number"),
+    # Date-range filters (see date_ranges.py)
+    IndexSpec('notes', 'idx_notes_time', ('dateTime',), "notes_history and notes-today counter"),
+    IndexSpec('newDaysInStep', 'idx_steps_in', ('dateIn',), "calendar and view_active date ranges"),
+    IndexSpec('newDaysInStep', 'idx_steps_out', ('dateOut',), "calendar change token MAX(dateOut)"),
+    # Dashboard, pickup list and reports
+    IndexSpec('jobs', 'idx_jobs_complete_stock_added', ('complete', 'stockNumber', 'dateAdded'), "units-in-detail counter and completed jobs pages"),
+    IndexSpec('test_db', 'idx_test_db_location', ('location',), "ready-for-pickup list and counter"),
+    IndexSpec('test_db', 'idx_test_db_promise', ('promiseDate',), "overdue units report"),
+)
+
+# Indexes an earlier version of INDEXES created that a wider declared index now covers. An index's
+# columns are never changed under the same name (re-adding an existing name fails with MySQL 1061),
+# so widened indexes get a new name and the old one is listed here, as (table, name, replacement name),
+# to be dropped once the replacement exists or is being added.
+RETIRED_INDEXES = (
+    ('jobs', 'idx_jobs_complete_stock', 'idx_jobs_complete_stock_added'),
+)
+
+TEXT_TYPES = {'tinytext', 'text', 'mediumtext', 'longtext', 'tinyblob', 'blob', 'mediumblob', 'longblob'}
+TEXT_PREFIX_LENGTH = 64 # TEXT/BLOB columns can only be indexed on a prefix
+
+SQL_EXISTING_INDEXES = """
+SELECT TABLE_NAME, INDEX_NAME, COLUMN_NAME
+FROM information_schema.STATISTICS
+WHERE TABLE_SCHEMA = DATABASE()
+ORDER BY TABLE_NAME, INDEX_NAME, SEQ_IN_INDEX
+"""
+SQL_COLUMNS = """
+SELECT TABLE_NAME, COLUMN_NAME, DATA_TYPE
+FROM information_schema.COLUMNS
+WHERE TABLE_SCHEMA = DATABASE()
+"""
+
+
+def existing_indexes(connection):
+    """Returns {table: {index name: (columns...)}} (table names lower-cased) from information_schema."""
+    indexes = {}
+    for row in connection.execute(text(SQL_EXISTING_INDEXES)):
+        table = indexes.setdefault(row.TABLE_NAME.lower(), {})
+        table[row.INDEX_NAME] = table.get(row.INDEX_NAME, ()) + (row.COLUMN_NAME.lower(),)
+    return indexes
+
+def table_columns(connection):
+    """Returns {table: {column: data type}} (names lower-cased) from information_schema."""
+    columns = {}
+    for row in connection.execute(text(SQL_COLUMNS)):
+        columns.setdefault(row.TABLE_NAME.lower(), {})[row.COLUMN_NAME.lower()] = row.DATA_TYPE.lower()
+    return columns
+
+def check(connection, specs=INDEXES):
+    """Compares specs with the database. Returns (present, missing, unavailable) lists of
+    (spec, detail): detail is the covering index name, or why the index cannot be created."""
+    indexes = existing_indexes(connection); columns = table_columns(connection)
+    present, missing, unavailable = [], [], []
+    for spec in specs:
+        table = spec.table.lower(); wanted = tuple(column.lower() for column in spec.columns)
+        if table not in columns: unavailable.append((spec, "table not found")); continue
+        absent = [column for column in spec.columns if column.lower() not in columns[table]]
+        if absent: unavailable.append((spec, f"column(s) not found: {', '.join(absent)}")); continue
+        covering = next((name for name, index_columns in indexes.get(table, {}).items() if index_columns[:len(wanted)] == wanted), None)
+        if covering: present.append((spec, covering))
+        else: missing.append((spec, None))
+    return present, missing, unavailable
+
+def retired_present(connection, retired=RETIRED_INDEXES):
+    """The RETIRED_INDEXES entries that still exist, as (table, name, replacement name)."""
+    indexes = existing_indexes(connection)
+    return [(table, name, replacement) for table, name, replacement in retired if name in indexes.get(table.lower(), {})]
+
+def alter_indexes_sql(table, specs, column_types, drop_names=()):
+    """One online ALTER TABLE adding every spec and dropping every named index for a table (a single pass over the table)."""
+    def column_sql(column):
+        return f"`{column}`({TEXT_PREFIX_LENGTH})" if column_types.get(column.lower()) in TEXT_TYPES else f"`{column}`"
+    clauses = [f"DROP INDEX `{name}`" for name in drop_names]
+    clauses += [f"ADD INDEX `{spec.name}` ({', '.join(column_sql(column) for column in spec.columns)})" for spec in specs]
+    return f"ALTER TABLE `{table}` {', '.join(clauses)}, ALGORITHM=INPLACE, LOCK=NONE"
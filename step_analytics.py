@@ -0,0 +1,74 @@
+# step_analytics.py
+import time
+import numpy as np
+from sqlalchemy import text
+
+# Step-duration distributions for the reports page and /api/reports/step_durations. Means hide
+# the long tail (units that sit for weeks), so this reports p50/p90/p99 and a histogram per step.
+# Durations for the whole range are fetched in one query into NumPy arrays and every statistic is
+# computed for all steps at once: one sort by (step, minutes), then per-step slices are found from
+# the counts, so there is no per-row or per-step Python loop. A year of newDaysInStep is a few
+# hundred thousand values at most, which this handles in milliseconds.
+
+PERCENTILES = (50, 90, 99)
+# Histogram bin lower edges in minutes; the last bin is open-ended. Roughly logarithmic, since
+# most steps take hours but the interesting ones take weeks.
+HISTOGRAM_EDGES = np.array([0, 60, 4 * 60, 8 * 60, 24 * 60, 2 * 1440, 3 * 1440, 5 * 1440, 7 * 1440, 14 * 1440, 28 * 1440], dtype=np.float64)
+HISTOGRAM_LABELS = ('<1h', '1-4h', '4-8h', '8-24h', '1-2d', '2-3d', '3-5d', '5-7d', '1-2w', '2-4w', '4w+')
+
+SQL_DURATIONS = """
+    SELECT COALESCE(step, '') AS step, TIMESTAMPDIFF(MINUTE, dateIn, dateOut) AS minutes
+    FROM newDaysInStep
+    WHERE dateIn >= :range_start AND dateIn < :range_end AND dateOut IS NOT NULL
+"""
+
+
+def load_durations(connection, range_start, range_end):
+    """Returns (steps, minutes) arrays for completed steps with range_start <= dateIn < range_end."""
+    rows = connection.execute(text(SQL_DURATIONS), {"range_start": range_start, "range_end": range_end}).fetchall()
+    if not rows: return np.array([], dtype=str), np.array([], dtype=np.float64)
+    steps, minutes = zip(*rows)
+    return np.array(steps, dtype=str), np.array(minutes, dtype=np.float64)
+
+def summarize(steps, minutes):
+    """Per-step count, mean, percentiles, max and histogram counts, as a list of dicts ordered by step.
+
+    Percentiles use linear interpolation between the closest ranks (numpy.percentile's default).
+    Negative durations (dateOut before dateIn) are data-entry errors and are left out.
+    """
+    valid = minutes >= 0
+    names, codes = np.unique(steps[valid], return_inverse=True)
+    minutes = minutes[valid]
+    if not len(names): return []
+
+    counts = np.bincount(codes, minlength=len(names))
+    sums = np.bincount(codes, weights=minutes, minlength=len(names))
+    sorted_minutes = minutes[np.lexsort((minutes, codes))] # Grouped by step, ascending within each
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    percentiles = {}
+    for p in PERCENTILES:
+        position = starts + (counts - 1) * (p / 100)
+        lower = np.floor(position).astype(np.int64); upper = np.ceil(position).astype(np.int64)
+        percentiles[p] = sorted_minutes[lower] + (sorted_minutes[upper] - sorted_minutes[lower]) * (position - lower)
+    maxima = sorted_minutes[starts + counts - 1]
+
+    bins = np.searchsorted(HISTOGRAM_EDGES, minutes, side='right') - 1
+    histogram = np.bincount(codes * len(HISTOGRAM_EDGES) + bins, minlength=len(names) * len(HISTOGRAM_EDGES)).reshape(len(names), len(HISTOGRAM_EDGES))
+
+    columns = {'count': counts.tolist(), 'mean_minutes': np.round(sums / counts, 1).tolist(), 'max_minutes': maxima.tolist(),
+               **{f"p{p}_minutes": np.round(values, 1).tolist() for p, values in percentiles.items()}}
+    return [dict({name: values[i] for name, values in columns.items()}, step=step or None, histogram=histogram[i].tolist())
+            for i, step in enumerate(names.tolist())]
+
+def step_durations(connection, range_start, range_end):
+    """Loads and summarizes one range; the payload for the report and the JSON endpoint."""
+    started = time.perf_counter()
+    steps, minutes = load_durations(connection, range_start, range_end)
+    summary = summarize(steps, minutes)
+    return {
+        'steps': summary,
+        'bins': [{'label': label, 'min_minutes': int(edge)} for label, edge in zip(HISTOGRAM_LABELS, HISTOGRAM_EDGES)],
+        'percentiles': list(PERCENTILES),
+        'rows': int(minutes.size),
+        'compute_ms': round((time.perf_counter() - started) * 1000, 1),
+    }
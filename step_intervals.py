@@ -0,0 +1,267 @@
+# step_intervals.py
+import bisect
+import datetime
+import os
+import threading
+import time
+from sqlalchemy import text, bindparam
+
+# In-memory index of newDaysInStep intervals for "which steps overlap this window" queries
+# (the overview calendar and view_active). SQL cannot answer
+#   dateIn < :end AND (dateOut IS NULL OR dateOut > :start)
+# from one index, so wide calendar views scan most of the table.
+#
+# Intervals are kept sorted by dateIn, with a segment tree holding the latest end (dateOut, or
+# "open") over each block of positions. An overlap query bisects to the last interval starting
+# before the window ends, then walks down only into blocks whose latest end is after the window
+# starts: O(log n) per interval returned.
+#
+# A background thread loads the index at startup and refreshes it every REFRESH_SECONDS by id
+# watermark (new rows) and by re-reading intervals that are still open (closed steps). Every
+# FULL_RELOAD_SECONDS it reloads from scratch to pick up other edits and deletes. Callers check
+# is_fresh() and fall back to SQL when the index is not loaded or has not refreshed recently.
+# Each load/refresh also records the table's MAX(id)/MAX(dateOut) as read in the same snapshot,
+# so callers holding newer watermarks from SQL can tell the index has not caught up (covers()).
+
+REFRESH_SECONDS = int(os.getenv('STEP_INDEX_REFRESH_SECONDS', '15'))
+FULL_RELOAD_SECONDS = int(os.getenv('STEP_INDEX_FULL_RELOAD_SECONDS', '3600'))
+MAX_STALE_SECONDS = int(os.getenv('STEP_INDEX_MAX_STALE', '120')) # Older than this and callers use SQL
+OVERFLOW_LIMIT = 2000 # Out-of-order inserts held aside before the sorted arrays are rebuilt
+OPEN_ID_BATCH = 1000
+LOAD_BATCH_ROWS = 10000 # A full load reads the table in id-keyset pages (the mysqlconnector driver buffers whole results)
+
+SQL_LOAD_PAGE = "SELECT id, stockNumber, step, dateIn, dateOut FROM newDaysInStep WHERE id > :after_id AND dateIn IS NOT NULL ORDER BY id LIMIT :limit"
+SQL_LOAD_NEW = "SELECT id, stockNumber, step, dateIn, dateOut FROM newDaysInStep WHERE id > :max_id AND dateIn IS NOT NULL ORDER BY id"
+SQL_RECHECK_OPEN = "SELECT id, dateOut FROM newDaysInStep WHERE id IN :ids AND dateOut IS NOT NULL"
+SQL_WATERMARK = "SELECT MAX(id) AS max_id, MAX(dateOut) AS max_out FROM newDaysInStep"
+
+_NO_END = datetime.datetime.min # Empty tree slot
+_OPEN_END = datetime.datetime.max # Step still in progress
+
+# Row tuple layout
+ID, STOCK_NUMBER, STEP, DATE_IN, DATE_OUT = range(5)
+
+
+def _as_datetime(value):
+    if isinstance(value, datetime.datetime) or value is None: return value
+    return datetime.datetime.combine(value, datetime.time.min) # DATE columns / date-only window bounds
+
+def _end_of(row):
+    return _OPEN_END if row[DATE_OUT] is None else row[DATE_OUT]
+
+def _to_dict(row):
+    return {'id': row[ID], 'stockNumber': row[STOCK_NUMBER], 'step': row[STEP], 'dateIn': row[DATE_IN], 'dateOut': row[DATE_OUT]}
+
+
+class StepIntervalIndex:
+    """Thread-safe overlap index over newDaysInStep rows (see module comment)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._empty()
+        self.max_id = 0
+        self.synced = None # (MAX(id), MAX(dateOut)) of the table as of the last load/refresh
+        self.refreshed_at = None # time.monotonic() of the last successful load/refresh
+        self.last_full_load = None
+        self.stats = {'full_loads': 0, 'refreshes': 0, 'queries': 0, 'last_load_ms': None, 'last_refresh_ms': None, 'rows': 0}
+        self._thread = None
+
+    # --- Structure ---
+    def _empty(self):
+        self._rows = {} # id -> row tuple
+        self._order = [] # ids sorted by (dateIn, id)
+        self._starts = [] # dateIn of each position, for bisect
+        self._pos = {} # id -> position in _order
+        self._overflow = {} # id -> row inserted out of dateIn order, not yet in _order
+        self._cap = 1
+        self._tree = [_NO_END, _NO_END]
+
+    def _build(self, rows):
+        """Rebuilds the sorted arrays and segment tree from all rows. Caller holds the lock (or owns self)."""
+        self._rows = rows
+        self._order = sorted(rows, key=lambda row_id: (rows[row_id][DATE_IN], row_id))
+        self._starts = [rows[row_id][DATE_IN] for row_id in self._order]
+        self._pos = {row_id: position for position, row_id in enumerate(self._order)}
+        self._overflow = {}
+        cap = 1024
+        while cap < len(self._order) * 2: cap *= 2 # Leave room to append new (latest) steps without a rebuild
+        self._cap = cap
+        tree = [_NO_END] * (2 * cap)
+        for position, row_id in enumerate(self._order): tree[cap + position] = _end_of(rows[row_id])
+        for node in range(cap - 1, 0, -1): tree[node] = max(tree[2 * node], tree[2 * node + 1])
+        self._tree = tree
+
+    def _set_end(self, position, end):
+        node = self._cap + position
+        self._tree[node] = end
+        node //= 2
+        while node:
+            self._tree[node] = max(self._tree[2 * node], self._tree[2 * node + 1])
+            node //= 2
+
+    def _add(self, row):
+        """Adds or replaces one row. Caller holds the lock."""
+        row_id = row[ID]
+        if row_id in self._pos and self._rows[row_id][DATE_IN] == row[DATE_IN]:
+            self._rows[row_id] = row; self._set_end(self._pos[row_id], _end_of(row)); return
+        if row_id in self._pos: # dateIn changed: the sorted position is wrong, so rebuild
+            self._rows[row_id] = row; self._build(dict(self._rows)); return
+        self._rows[row_id] = row
+        appendable = (not self._order or (row[DATE_IN], row_id) >= (self._starts[-1], self._order[-1])) and len(self._order) < self._cap
+        if appendable and row_id not in self._overflow:
+            self._pos[row_id] = len(self._order); self._order.append(row_id); self._starts.append(row[DATE_IN])
+            self._set_end(self._pos[row_id], _end_of(row))
+        else:
+            self._overflow[row_id] = row
+            if len(self._overflow) > OVERFLOW_LIMIT or len(self._order) >= self._cap: self._build(dict(self._rows))
+
+    def _close(self, row_id, date_out):
+        row = self._rows.get(row_id)
+        if row is None: return
+        row = row[:DATE_OUT] + (_as_datetime(date_out),)
+        self._rows[row_id] = row
+        if row_id in self._overflow: self._overflow[row_id] = row
+        else: self._set_end(self._pos[row_id], _end_of(row))
+
+    # --- Queries ---
+    def is_fresh(self):
+        """True when the index is loaded and refreshed within MAX_STALE_SECONDS."""
+        return self.refreshed_at is not None and time.monotonic() - self.refreshed_at <= MAX_STALE_SECONDS
+
+    def covers(self, max_id, max_out):
+        """True when the last load/refresh saw the table at least up to these MAX(id)/MAX(dateOut) values."""
+        synced = self.synced
+        if synced is None: return False
+        def at_least(have, want): return want is None or (have is not None and _as_datetime(have) >= _as_datetime(want))
+        return (max_id is None or (synced[0] is not None and synced[0] >= max_id)) and at_least(synced[1], max_out)
+
+    def overlapping(self, start, end):
+        """Steps with dateIn < end and (dateOut is NULL or dateOut > start), ordered by dateIn, as dicts."""
+        start = _as_datetime(start); end = _as_datetime(end)
+        with self._lock:
+            self.stats['queries'] += 1
+            hi = bisect.bisect_left(self._starts, end)
+            found = []
+            stack = [(1, 0, self._cap)]
+            while stack:
+                node, lo, high = stack.pop()
+                if lo >= hi or self._tree[node] <= start: continue # Block is past the window, or every step in it ended before
+                if high - lo == 1: found.append(self._rows[self._order[lo]]); continue
+                middle = (lo + high) // 2
+                stack.append((2 * node + 1, middle, high)); stack.append((2 * node, lo, middle)) # Left first, so results stay sorted
+            extra = [row for row in self._overflow.values() if row[DATE_IN] < end and _end_of(row) > start]
+        if extra: found = sorted(found + extra, key=lambda row: (row[DATE_IN], row[ID]))
+        return [_to_dict(row) for row in found]
+
+    def started_between(self, start, end, newest_first=False):
+        """Steps with start <= dateIn < end, ordered by dateIn, as dicts."""
+        start = _as_datetime(start); end = _as_datetime(end)
+        with self._lock:
+            self.stats['queries'] += 1
+            lo = bisect.bisect_left(self._starts, start); hi = bisect.bisect_left(self._starts, end)
+            found = [self._rows[row_id] for row_id in self._order[lo:hi]]
+            extra = [row for row in self._overflow.values() if start <= row[DATE_IN] < end]
+        if extra: found = sorted(found + extra, key=lambda row: (row[DATE_IN], row[ID]))
+        if newest_first: found.reverse()
+        return [_to_dict(row) for row in found]
+
+    # --- Loading ---
+    def load(self, engine):
+        """Reads every step with a dateIn and swaps in a freshly built index."""
+        started = time.perf_counter()
+        rows = {}
+        with engine.connect() as connection:
+            synced = tuple(connection.execute(text(SQL_WATERMARK)).one()) # Same snapshot as the pages read below
+            after_id = 0
+            while True:
+                page = connection.execute(text(SQL_LOAD_PAGE), {"after_id": after_id, "limit": LOAD_BATCH_ROWS}).all()
+                for row in page:
+                    rows[row.id] = (row.id, row.stockNumber, row.step, _as_datetime(row.dateIn), _as_datetime(row.dateOut))
+                if len(page) < LOAD_BATCH_ROWS: break
+                after_id = page[-1].id
+        fresh = StepIntervalIndex.__new__(StepIntervalIndex); fresh._build(rows) # Build off-lock, then swap
+        with self._lock:
+            self._rows, self._order, self._starts, self._pos = fresh._rows, fresh._order, fresh._starts, fresh._pos
+            self._overflow, self._cap, self._tree = fresh._overflow, fresh._cap, fresh._tree
+            self.max_id = max(rows, default=0); self.synced = synced
+            self.refreshed_at = self.last_full_load = time.monotonic()
+            self.stats['full_loads'] += 1; self.stats['rows'] = len(rows)
+            self.stats['last_load_ms'] = round((time.perf_counter() - started) * 1000, 1)
+
+    def refresh(self, engine):
+        """Adds steps inserted since the last load and closes steps whose dateOut has been set."""
+        started = time.perf_counter()
+        with self._lock:
+            max_id = self.max_id
+            open_ids = [row_id for row_id, row in self._rows.items() if row[DATE_OUT] is None]
+        with engine.connect() as connection:
+            synced = tuple(connection.execute(text(SQL_WATERMARK)).one())
+            new_rows = connection.execute(text(SQL_LOAD_NEW), {"max_id": max_id}).all()
+            closed = []
+            recheck = text(SQL_RECHECK_OPEN).bindparams(bindparam('ids', expanding=True))
+            for i in range(0, len(open_ids), OPEN_ID_BATCH):
+                closed.extend(connection.execute(recheck, {"ids": open_ids[i:i + OPEN_ID_BATCH]}).all())
+        with self._lock:
+            for row in new_rows:
+                self._add((row.id, row.stockNumber, row.step, _as_datetime(row.dateIn), _as_datetime(row.dateOut)))
+                self.max_id = max(self.max_id, row.id)
+            for row in closed: self._close(row.id, row.dateOut)
+            self.synced = synced
+            self.refreshed_at = time.monotonic()
+            self.stats['refreshes'] += 1; self.stats['rows'] = len(self._rows)
+            self.stats['last_refresh_ms'] = round((time.perf_counter() - started) * 1000, 1)
+
+    def start(self, engine):
+        """Starts the background load/refresh thread (once per process)."""
+        if self._thread is not None or engine is None: return
+        self._thread = threading.Thread(target=self._run, args=(engine,), name='step-interval-index', daemon=True)
+        self._thread.start()
+
+    def _run(self, engine):
+        while True:
+            try:
+                if self.last_full_load is None or time.monotonic() - self.last_full_load >= FULL_RELOAD_SECONDS: self.load(engine)
+                else: self.refresh(engine)
+            except Exception as e:
+                print(f"Error refreshing step interval index: {e}") # Index goes stale; callers fall back to SQL
+            time.sleep(REFRESH_SECONDS)
+
+
+def daily_step_counts(steps, window_start, window_end, today):
+    """Counts units in each step per day over [window_start, window_end) with a sweep over interval endpoints.
+
+    steps are dicts with stockNumber, step, dateIn and dateOut (as returned by overlapping()). A unit is
+    in a step from its dateIn day up to, not including, its dateOut day (same-day steps count for
+    that day), matching how the calendar draws events; open steps run through today. Overlapping
+    intervals of the same unit and step are merged first so a unit is only counted once per day.
+    Returns (step, first_day, end_day, count) runs, end_day exclusive, where count is the same on
+    every day of the run.
+    """
+    spans = {} # (stockNumber, step) -> [(first_day, end_day), ...]
+    for item in steps:
+        date_in = item.get('dateIn'); date_out = item.get('dateOut')
+        if date_in is None: continue
+        first_day = date_in.date() if isinstance(date_in, datetime.datetime) else date_in
+        if date_out is None: end_day = max(today + datetime.timedelta(days=1), first_day + datetime.timedelta(days=1))
+        else: end_day = max(date_out.date() if isinstance(date_out, datetime.datetime) else date_out, first_day + datetime.timedelta(days=1))
+        first_day = max(first_day, window_start); end_day = min(end_day, window_end)
+        if first_day < end_day: spans.setdefault((item.get('stockNumber'), str(item.get('step') or '')), []).append((first_day, end_day))
+
+    deltas = {} # step -> {day: change in count}
+    for (_, step), unit_spans in spans.items():
+        unit_spans.sort()
+        merged_first, merged_end = unit_spans[0]
+        for first_day, end_day in unit_spans[1:] + [(None, None)]:
+            if first_day is not None and first_day <= merged_end: merged_end = max(merged_end, end_day); continue
+            step_deltas = deltas.setdefault(step, {})
+            step_deltas[merged_first] = step_deltas.get(merged_first, 0) + 1
+            step_deltas[merged_end] = step_deltas.get(merged_end, 0) - 1
+            merged_first, merged_end = first_day, end_day
+
+    runs = []
+    for step in sorted(deltas):
+        count = 0; run_start = None
+        for day in sorted(deltas[step]): # Count only changes at endpoints, so each run covers consecutive equal days
+            if count > 0: runs.append((step, run_start, day, count))
+            count += deltas[step][day]; run_start = day
+    return runs
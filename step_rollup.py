@@ -0,0 +1,141 @@
+# step_rollup.py
+import datetime
+import os
+import threading
+import time
+from sqlalchemy import text
+import date_ranges
+
+# Daily rollup of completed step durations for the "Average Time in Steps" report. One row per
+# (day the step started, step) holds the count, total, shortest and longest duration in minutes,
+# so any report range is a small GROUP BY over the rollup instead of a scan of newDaysInStep.
+#
+# A step only counts once it has a dateOut. The refresh finds the days touched since the last
+# pass (new ids, plus steps whose dateOut is at or after the dateOut watermark minus an overlap
+# window) and recomputes those days from newDaysInStep, so repeated or overlapping passes are
+# harmless. Deleted rows, and steps reopened or re-dated long after the fact, are only picked up
+# by a rebuild: create_step_rollup.py creates the tables and does the first full build.
+
+SQL_CREATE_TABLES = (
+    """
+    CREATE TABLE IF NOT EXISTS step_duration_daily (
+        day DATE NOT NULL, -- DATE(newDaysInStep.dateIn)
+        step VARCHAR(100) NOT NULL, -- '' for steps without a name
+        step_count INT NOT NULL,
+        total_minutes BIGINT NOT NULL,
+        min_minutes INT NOT NULL,
+        max_minutes INT NOT NULL,
+
+        PRIMARY KEY (day, step)
+    ) ENGINE=InnoDB;
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS step_duration_daily_state (
+        id TINYINT NOT NULL PRIMARY KEY, -- Always 1
+        max_id INT NOT NULL, -- Highest newDaysInStep.id seen by the last pass
+        date_out_mark DATETIME NOT NULL, -- Latest dateOut seen by the last pass (never in the future)
+        refreshed_at DATETIME NOT NULL
+    ) ENGINE=InnoDB;
+    """,
+)
+
+REFRESH_SECONDS = int(os.getenv('STEP_ROLLUP_REFRESH_SECONDS', '60'))
+OVERLAP_MINUTES = int(os.getenv('STEP_ROLLUP_OVERLAP_MINUTES', '1440')) # Re-check steps closed this long before the watermark
+
+_DURATION_COLUMNS = """
+    COUNT(*), SUM(TIMESTAMPDIFF(MINUTE, dateIn, dateOut)),
+    MIN(TIMESTAMPDIFF(MINUTE, dateIn, dateOut)), MAX(TIMESTAMPDIFF(MINUTE, dateIn, dateOut))
+"""
+_INSERT = "INSERT INTO step_duration_daily (day, step, step_count, total_minutes, min_minutes, max_minutes)"
+SQL_ROLLUP_RANGE = f"""
+    {_INSERT}
+    SELECT DATE(dateIn), COALESCE(step, ''), {_DURATION_COLUMNS}
+    FROM newDaysInStep
+    WHERE dateIn >= :start AND dateIn < :end AND dateOut IS NOT NULL
+    GROUP BY DATE(dateIn), COALESCE(step, '')
+"""
+SQL_ROLLUP_ALL = f"""
+    {_INSERT}
+    SELECT DATE(dateIn), COALESCE(step, ''), {_DURATION_COLUMNS}
+    FROM newDaysInStep
+    WHERE dateIn IS NOT NULL AND dateOut IS NOT NULL
+    GROUP BY DATE(dateIn), COALESCE(step, '')
+"""
+SQL_CURRENT_MARKS = "SELECT COALESCE(MAX(id), 0) AS max_id, LEAST(COALESCE(MAX(dateOut), NOW()), NOW()) AS date_out_mark FROM newDaysInStep"
+SQL_LOCK_STATE = "SELECT max_id, date_out_mark FROM step_duration_daily_state WHERE id = 1 FOR UPDATE"
+SQL_SAVE_STATE = """
+    INSERT INTO step_duration_daily_state (id, max_id, date_out_mark, refreshed_at) VALUES (1, :max_id, :date_out_mark, NOW())
+    ON DUPLICATE KEY UPDATE max_id = VALUES(max_id), date_out_mark = VALUES(date_out_mark), refreshed_at = VALUES(refreshed_at)
+"""
+# Two index range scans (id, dateOut) rather than one OR that would scan the table
+SQL_DIRTY_DAYS = """
+    SELECT DATE(dateIn) AS day FROM newDaysInStep WHERE id > :max_id AND dateIn IS NOT NULL AND dateOut IS NOT NULL
+    UNION
+    SELECT DATE(dateIn) AS day FROM newDaysInStep WHERE dateOut >= :since AND dateIn IS NOT NULL
+"""
+SQL_REPORT = """
+    SELECT NULLIF(step, '') AS step, SUM(step_count) AS step_count, SUM(total_minutes) / SUM(step_count) AS avg_minutes,
+           MIN(min_minutes) AS min_minutes, MAX(max_minutes) AS max_minutes
+    FROM step_duration_daily
+    WHERE day >= :first_day AND day <= :last_day
+    GROUP BY step
+    ORDER BY step
+"""
+
+
+def rebuild(connection):
+    """Recomputes the whole rollup. Call inside a transaction; returns the number of (day, step) rows."""
+    marks = connection.execute(text(SQL_CURRENT_MARKS)).mappings().one()
+    connection.execute(text("DELETE FROM step_duration_daily"))
+    rows = connection.execute(text(SQL_ROLLUP_ALL)).rowcount
+    connection.execute(text(SQL_SAVE_STATE), dict(marks))
+    return rows
+
+def refresh(engine):
+    """Recomputes the days touched since the last pass. Returns how many days were rebuilt, or None
+    if the rollup has not been built yet (run create_step_rollup.py)."""
+    with engine.begin() as connection:
+        state = connection.execute(text(SQL_LOCK_STATE)).mappings().first() # Serialises passes across processes
+        if state is None: return None
+        marks = connection.execute(text(SQL_CURRENT_MARKS)).mappings().one()
+        since = state['date_out_mark'] - datetime.timedelta(minutes=OVERLAP_MINUTES)
+        days = sorted(row.day for row in connection.execute(text(SQL_DIRTY_DAYS), {"max_id": state['max_id'], "since": since}))
+        for day in days:
+            start, end = date_ranges.day_range(day)
+            connection.execute(text("DELETE FROM step_duration_daily WHERE day = :day"), {"day": day})
+            connection.execute(text(SQL_ROLLUP_RANGE), {"start": start, "end": end})
+        connection.execute(text(SQL_SAVE_STATE), dict(marks))
+    return len(days)
+
+def report(connection, first_day, last_day):
+    """Per-step count and average/min/max minutes for steps that started from first_day through last_day."""
+    return connection.execute(text(SQL_REPORT), {"first_day": first_day, "last_day": last_day}).mappings().all()
+
+
+class RollupRefresher:
+    """Background thread that calls refresh() every REFRESH_SECONDS."""
+
+    def __init__(self, refresh_seconds=REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self.refreshed_at = None
+        self.stats = {'passes': 0, 'days_rebuilt': 0, 'last_refresh_ms': None}
+        self._thread = None
+
+    def start(self, engine):
+        """Starts the refresh thread (once per process)."""
+        if self._thread is not None or engine is None: return
+        self._thread = threading.Thread(target=self._run, args=(engine,), name='step-rollup', daemon=True)
+        self._thread.start()
+
+    def _run(self, engine):
+        while True:
+            try:
+                started = time.perf_counter()
+                days = refresh(engine)
+                if days is not None:
+                    self.refreshed_at = time.monotonic()
+                    self.stats['passes'] += 1; self.stats['days_rebuilt'] += days
+                    self.stats['last_refresh_ms'] = round((time.perf_counter() - started) * 1000, 1)
+            except Exception as e:
+                print(f"Error refreshing step_duration_daily: {e}") # Report keeps serving the last rollup
+            time.sleep(self.refresh_seconds)
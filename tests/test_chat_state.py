@@ -0,0 +1,39 @@
+from chat_state import UnreadCounter
+
+
+def test_get_caches_loaded_count():
+    counter = UnreadCounter()
+    loads = []
+    def loader(user_id): loads.append(user_id); return 3
+    assert counter.get(1, loader) == 3
+    counter.increment(1); counter.decrement(1, 2)
+    assert counter.get(1, loader) == 2
+    assert loads == [1]
+
+def test_load_overlapping_a_change_is_not_cached():
+    # The loader reads MySQL outside the lock; a message sent meanwhile must not be lost by caching the older count
+    counter = UnreadCounter()
+    def loader(user_id):
+        counter.increment(user_id) # Another request sends a message while the count is being read
+        return 0
+    assert counter.get(1, loader) == 0
+    assert counter.get(1, lambda user_id: 1) == 1 # Reloaded, not served from the stale load
+
+def test_load_overlapping_invalidate_all_is_not_cached():
+    counter = UnreadCounter()
+    def loader(user_id):
+        counter.invalidate()
+        return 5
+    assert counter.get(1, loader) == 5
+    assert counter.get(1, lambda user_id: 2) == 2
+
+def test_failed_load_is_not_cached():
+    counter = UnreadCounter()
+    assert counter.get(1, lambda user_id: None) == 0
+    assert counter.get(1, lambda user_id: 4) == 4
+
+def test_decrement_never_goes_below_zero():
+    counter = UnreadCounter()
+    counter.get(1, lambda user_id: 1)
+    counter.decrement(1, 5)
+    assert counter.get(1, lambda user_id: 9) == 0
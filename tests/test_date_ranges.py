@@ -0,0 +1,79 @@
+import datetime
+import random
+
+import pytest
+
+import date_ranges
+
+# Each range must select exactly the rows the DATE()/YEAR() predicates it replaced selected:
+#   DATE(col) = :day, DATE(col) BETWEEN :first AND :last, YEAR(col) = :year
+# The old predicates are computed here in Python the way MySQL evaluates them on a DATETIME.
+
+ONE_MICROSECOND = datetime.timedelta(microseconds=1)
+
+
+def in_range(value, bounds):
+    start, end = bounds
+    return start <= value < end
+
+def around(day):
+    """DATETIMEs at and next to the edges of day, plus a few inside it."""
+    midnight = datetime.datetime.combine(day, datetime.time.min)
+    next_midnight = midnight + datetime.timedelta(days=1)
+    return [midnight - ONE_MICROSECOND, midnight, midnight + ONE_MICROSECOND,
+            midnight + datetime.timedelta(hours=12), next_midnight - datetime.timedelta(seconds=1),
+            next_midnight - ONE_MICROSECOND, next_midnight, next_midnight + ONE_MICROSECOND]
+
+EDGE_DAYS = [
+    datetime.date(2023, 12, 31), datetime.date(2024, 1, 1), # Year boundary
+    datetime.date(2024, 1, 31), datetime.date(2024, 2, 1), # Month boundary
+    datetime.date(2024, 2, 28), datetime.date(2024, 2, 29), datetime.date(2024, 3, 1), # Leap day
+    datetime.date(2023, 2, 28), datetime.date(2023, 3, 1), # No leap day
+]
+
+
+@pytest.mark.parametrize('day', EDGE_DAYS)
+def test_day_range_matches_date_equals(day):
+    bounds = date_ranges.day_range(day)
+    for other in EDGE_DAYS:
+        for value in around(other):
+            assert in_range(value, bounds) == (value.date() == day), value
+
+@pytest.mark.parametrize('day', EDGE_DAYS)
+def test_day_range_accepts_datetime(day):
+    assert date_ranges.day_range(datetime.datetime.combine(day, datetime.time(15, 30))) == date_ranges.day_range(day)
+
+@pytest.mark.parametrize('first_day, last_day', [
+    (datetime.date(2023, 12, 31), datetime.date(2024, 1, 1)), # Dec 31 -> Jan 1
+    (datetime.date(2024, 2, 28), datetime.date(2024, 3, 1)), # Across the leap day
+    (datetime.date(2024, 2, 29), datetime.date(2024, 2, 29)), # Only the leap day
+    (datetime.date(2024, 1, 31), datetime.date(2024, 1, 31)), # Single day, end == start
+    (datetime.date(2023, 1, 1), datetime.date(2024, 12, 31)), # Whole years
+])
+def test_days_range_matches_date_between(first_day, last_day):
+    bounds = date_ranges.days_range(first_day, last_day)
+    for other in EDGE_DAYS + [first_day, last_day]:
+        for value in around(other):
+            assert in_range(value, bounds) == (first_day <= value.date() <= last_day), value
+
+def test_days_range_single_day_is_day_range():
+    day = datetime.date(2024, 2, 29)
+    assert date_ranges.days_range(day, day) == date_ranges.day_range(day)
+
+@pytest.mark.parametrize('year', [2023, 2024])
+def test_year_range_matches_year_equals(year):
+    bounds = date_ranges.year_range(year)
+    for other in EDGE_DAYS:
+        for value in around(other):
+            assert in_range(value, bounds) == (value.year == year), value
+
+def test_random_datetimes_match_old_predicates():
+    rng = random.Random(17)
+    base = datetime.datetime(2022, 12, 1)
+    for _ in range(2000):
+        value = base + datetime.timedelta(seconds=rng.randrange(0, 3 * 366 * 86400), microseconds=rng.randrange(1000000))
+        first_day = (base + datetime.timedelta(days=rng.randrange(0, 3 * 366))).date()
+        last_day = first_day + datetime.timedelta(days=rng.randrange(0, 60))
+        assert in_range(value, date_ranges.day_range(first_day)) == (value.date() == first_day)
+        assert in_range(value, date_ranges.days_range(first_day, last_day)) == (first_day <= value.date() <= last_day)
+        assert in_range(value, date_ranges.year_range(first_day.year)) == (value.year == first_day.year)
@@ -0,0 +1,150 @@
+import datetime
+import random
+
+import pytest
+
+pytest.importorskip('sqlalchemy') # step_intervals builds its refresh queries with sqlalchemy.text
+import step_intervals
+from step_intervals import StepIntervalIndex, daily_step_counts
+
+# Randomized checks of the overlap index and the daily count sweep against brute-force answers.
+# Timestamps fall on a small range of days at a few times of day, so open intervals, same-day
+# intervals and intervals starting or ending exactly on a window edge all come up often.
+
+BASE = datetime.datetime(2024, 2, 20)
+STEPS = ['Detail', 'Mechanical', 'Photos']
+
+
+def random_moment(rng, days=20):
+    return BASE + datetime.timedelta(days=rng.randrange(days), hours=rng.choice([0, 0, 9, 17, 23]))
+
+def random_row(rng, row_id, stock_numbers=15):
+    date_in = random_moment(rng)
+    roll = rng.random()
+    if roll < 0.25: date_out = None # Still open
+    elif roll < 0.45: date_out = date_in.replace(hour=23) if date_in.hour < 23 else date_in # Same day
+    else: date_out = date_in + datetime.timedelta(days=rng.randrange(0, 8), hours=rng.randrange(0, 24))
+    return (row_id, f"S{rng.randrange(stock_numbers)}", rng.choice(STEPS), date_in, date_out)
+
+def random_window(rng):
+    start = random_moment(rng, days=24) - datetime.timedelta(days=2)
+    if rng.random() < 0.5: start = start.replace(hour=0) # Midnight, like the calendar's date-only bounds
+    return start, start + datetime.timedelta(days=rng.randrange(0, 10), hours=rng.choice([0, 0, 12]))
+
+def brute_overlapping(rows, start, end):
+    found = [row for row in rows.values() if row[step_intervals.DATE_IN] < end and (row[step_intervals.DATE_OUT] is None or row[step_intervals.DATE_OUT] > start)]
+    return [step_intervals._to_dict(row) for row in sorted(found, key=lambda row: (row[step_intervals.DATE_IN], row[step_intervals.ID]))]
+
+def build_index(rows):
+    index = StepIntervalIndex()
+    index._build(dict(rows))
+    return index
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_overlapping_matches_brute_force(seed):
+    rng = random.Random(seed)
+    rows = {row_id: random_row(rng, row_id) for row_id in range(1, rng.randrange(1, 300))}
+    index = build_index(rows)
+    for _ in range(50):
+        start, end = random_window(rng)
+        assert index.overlapping(start, end) == brute_overlapping(rows, start, end)
+
+@pytest.mark.parametrize('seed', range(20))
+def test_overlapping_after_incremental_changes(seed):
+    # New rows (in and out of dateIn order), closed steps and moved dateIns, as refresh() applies them
+    rng = random.Random(1000 + seed)
+    rows = {row_id: random_row(rng, row_id) for row_id in range(1, 100)}
+    index = build_index(rows)
+    next_id = 100
+    for _ in range(200):
+        roll = rng.random()
+        if roll < 0.5:
+            row = random_row(rng, next_id); next_id += 1
+        elif roll < 0.8:
+            row_id = rng.choice(list(rows)); row = rows[row_id]
+            if row[step_intervals.DATE_OUT] is not None: continue
+            date_out = row[step_intervals.DATE_IN] + datetime.timedelta(days=rng.randrange(0, 5))
+            index._close(row_id, date_out); rows[row_id] = row[:step_intervals.DATE_OUT] + (date_out,)
+            continue
+        else:
+            row_id = rng.choice(list(rows)); row = (row_id,) + random_row(rng, row_id)[1:]
+        index._add(row); rows[row[step_intervals.ID]] = row
+        start, end = random_window(rng)
+        assert index.overlapping(start, end) == brute_overlapping(rows, start, end)
+
+def test_overlapping_window_edges():
+    day = datetime.datetime(2024, 2, 29)
+    rows = {
+        1: (1, 'A', 'Detail', day - datetime.timedelta(days=1), day), # Ends exactly at the window start
+        2: (2, 'B', 'Detail', day + datetime.timedelta(days=1), None), # Starts exactly at the window end
+        3: (3, 'C', 'Detail', day, day), # Zero-length at the window start: not after it, so excluded (as in SQL)
+        4: (4, 'D', 'Detail', day - datetime.timedelta(days=5), None), # Open, started before the window
+        5: (5, 'E', 'Detail', day + datetime.timedelta(hours=10), day + datetime.timedelta(hours=11)), # Same day, inside
+    }
+    found = build_index(rows).overlapping(day, day + datetime.timedelta(days=1))
+    assert [item['id'] for item in found] == [4, 5]
+    assert found == brute_overlapping(rows, day, day + datetime.timedelta(days=1))
+
+
+def brute_daily_counts(steps, window_start, window_end, today):
+    """{(step, day): number of distinct units in step on day}, one day at a time."""
+    counts = {}
+    day = window_start
+    while day < window_end:
+        for step in {str(item['step'] or '') for item in steps}:
+            units = set()
+            for item in steps:
+                if str(item['step'] or '') != step or item['dateIn'] is None: continue
+                first_day = item['dateIn'].date()
+                if item['dateOut'] is None: in_step = first_day <= day <= max(today, first_day) # A future start still shows on its day
+                else: in_step = first_day <= day < item['dateOut'].date() or first_day == day # Same-day steps count that day
+                if in_step: units.add(item['stockNumber'])
+            if units: counts[(step, day)] = len(units)
+        day += datetime.timedelta(days=1)
+    return counts
+
+def expand_runs(runs):
+    counts = {}
+    for step, first_day, end_day, count in runs:
+        assert first_day < end_day and count > 0
+        day = first_day
+        while day < end_day:
+            assert (step, day) not in counts # Runs for one step never overlap
+            counts[(step, day)] = count
+            day += datetime.timedelta(days=1)
+    return counts
+
+@pytest.mark.parametrize('seed', range(30))
+def test_daily_step_counts_matches_brute_force(seed):
+    rng = random.Random(2000 + seed)
+    rows = {row_id: random_row(rng, row_id, stock_numbers=8) for row_id in range(1, rng.randrange(1, 120))}
+    today = (BASE + datetime.timedelta(days=rng.randrange(0, 25))).date()
+    for _ in range(10):
+        start, end = random_window(rng)
+        window_start = start.date(); window_end = max(end.date(), window_start + datetime.timedelta(days=1))
+        steps = brute_overlapping(rows, datetime.datetime.combine(window_start, datetime.time.min), datetime.datetime.combine(window_end, datetime.time.min))
+        runs = daily_step_counts(steps, window_start, window_end, today)
+        assert expand_runs(runs) == brute_daily_counts(steps, window_start, window_end, today)
+
+def test_daily_step_counts_clips_to_window():
+    today = datetime.date(2024, 3, 10)
+    steps = [
+        {'stockNumber': 'A', 'step': 'Detail', 'dateIn': datetime.datetime(2024, 2, 1), 'dateOut': None}, # Open, from before the window
+        {'stockNumber': 'B', 'step': 'Detail', 'dateIn': datetime.datetime(2024, 3, 4, 9), 'dateOut': datetime.datetime(2024, 3, 4, 17)}, # Same day
+        {'stockNumber': 'A', 'step': 'Detail', 'dateIn': datetime.datetime(2024, 3, 2), 'dateOut': datetime.datetime(2024, 3, 3)}, # Same unit again
+    ]
+    runs = daily_step_counts(steps, datetime.date(2024, 3, 1), datetime.date(2024, 3, 8), today)
+    assert expand_runs(runs) == brute_daily_counts(steps, datetime.date(2024, 3, 1), datetime.date(2024, 3, 8), today)
+    assert runs[0][1] == datetime.date(2024, 3, 1) and runs[-1][2] == datetime.date(2024, 3, 8)
+
+
+def test_covers_compares_watermarks():
+    index = StepIntervalIndex()
+    assert not index.covers(None, None) # Never loaded
+    index.synced = (10, datetime.datetime(2024, 3, 1, 12))
+    assert index.covers(10, datetime.datetime(2024, 3, 1, 12))
+    assert index.covers(9, None)
+    assert not index.covers(11, datetime.datetime(2024, 3, 1))
+    assert not index.covers(10, datetime.datetime(2024, 3, 1, 13))
+    assert index.covers(10, datetime.date(2024, 3, 1)) # DATE column values compare as midnight
@@ -0,0 +1,173 @@
+# unit_loader.py
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from sqlalchemy import text
+
+# Loads the data behind the unit_info page. The first response only needs the unit header
+# (test_db row, inventory, open jobs and the lookup lists), and those queries are independent
+# of each other, so they run concurrently: the request thread runs the unit row and lookup lists
+# on the connection it already holds while OFFLOADED_PARTS run on pooled connections from a
+# shared thread pool, so the page costs roughly one round trip to the database server instead
+# of one per query. The thread pool is sized from the engine's pool (at most half of it, leaving
+# the rest for request threads). A part is only offloaded when a worker is free; otherwise the
+# request thread runs it too, so a busy pool means sequential loads rather than queueing.
+# The other sections (steps, notes, chats, POs, images) are fetched on demand, a page at a
+# time, through load_section().
+
+LOADER_WORKERS = int(os.getenv('UNIT_LOADER_WORKERS', '0')) # 0: half the engine's pool_size
+OFFLOADED_PARTS = ('inventory', 'jobs') # Run on pool workers when free; the rest run on the request's connection
+SLOW_LOAD_MS = float(os.getenv('UNIT_LOADER_SLOW_MS', '500')) # Loads slower than this are logged
+SECTION_PAGE_SIZE = 25
+SECTION_PAGE_SIZE_MAX = 100
+
+log = logging.getLogger(__name__)
+
+SQL_MAIN = "SELECT * FROM test_db WHERE stockNumber = :sn ORDER BY id DESC LIMIT 1" # Latest row, same rule as current_units
+SQL_INVENTORY = """
+    SELECT stockNumber, lockingNutsIn, manualsIn, jacksIn, tunneauCoverIn,
+           floorMatsIn, cargoMatsIn, blockHeaterCordIn, changed,
+           lockingNutsOut, manualsOut, jacksOut, tunneauCoverOut,
+           floorMatsOut, cargoMatsOut, blockHeaterCordOut, checkOut
+    FROM unitInventory WHERE stockNumber = :sn ORDER BY changed DESC LIMIT 1
+"""
+SQL_JOBS = """
+    SELECT j.id as job_id, j.status, j.dateAdded, j.job1, j.priority, j.notes as job_notes, j.tech as assigned_tech_id, tech.techName as assigned_tech_name
+    FROM jobs j LEFT JOIN techs tech ON j.tech = tech.techNumber
+    WHERE j.stockNumber = :sn AND (j.status IS NULL OR j.status != 'Completed') ORDER BY j.dateAdded DESC
+"""
+
+# Lazily loaded sections, newest first. Each query is paged with LIMIT/OFFSET (one extra row tells
+# whether there is another page); a single unit only has tens of rows per section, so offsets stay small.
+SECTION_SQL = {
+    'steps': "SELECT id, step, dateIn, dateOut FROM newDaysInStep WHERE stockNumber = :sn ORDER BY dateIn DESC, id DESC",
+    'notes': "SELECT id, notes, dateTime, status FROM notes WHERE stockNumber = :sn ORDER BY dateTime DESC, id DESC",
+    'pos': "SELECT po, dateIn, service, status FROM preApproved WHERE stockNumber = :sn ORDER BY dateIn DESC",
+    'images': "SELECT id FROM images WHERE stockNumber = :sn ORDER BY id DESC", # The images themselves are served by unit_image
+    'chats': """
+        SELECT cm.message_id, cm.sender_id, cm.recipient_id, cm.message_text, cm.timestamp, cm.is_read,
+               sender.userName as sender_username, recipient.userName as recipient_username
+        FROM chat_messages cm
+        JOIN users sender ON cm.sender_id = sender.id
+        JOIN users recipient ON cm.recipient_id = recipient.id
+        WHERE cm.stockNumber = :sn
+        ORDER BY cm.timestamp DESC, cm.message_id DESC
+    """,
+}
+
+_executor = None # Created on first use, sized from the engine's pool (see _workers())
+_free_workers = None # Semaphore counting idle workers; a part is offloaded only if it can take one
+_executor_lock = threading.Lock()
+
+
+@dataclass
+class UnitBundle:
+    """What the first unit_info response renders for one stock number."""
+    stock_number: str
+    unit: dict = None # test_db row, or None if the unit was not found
+    inventory: dict = None # Latest unitInventory row, or None
+    jobs: list = field(default_factory=list) # Open jobs
+    techs: tuple = ()
+    services: tuple = ()
+    timings: dict = field(default_factory=dict) # Part name -> milliseconds, plus 'total'
+    errors: dict = field(default_factory=dict) # Part name -> error message for parts that failed
+
+    @property
+    def checkout_complete(self):
+        return bool(self.inventory) and self.inventory.get('checkOut') == 1
+
+    def server_timing(self):
+        """Timings formatted for a Server-Timing response header (shown in browser dev tools)."""
+        return ", ".join(f"{name};dur={ms:.1f}" for name, ms in self.timings.items())
+
+
+def _fetch_all(connection, sql, stock_number):
+    return [dict(row) for row in connection.execute(text(sql), {"sn": stock_number}).mappings()]
+
+def _fetch_first(connection, sql, stock_number):
+    row = connection.execute(text(sql), {"sn": stock_number}).mappings().first()
+    return dict(row) if row else None
+
+def _load_reference(connection, stock_number, reference_cache):
+    return reference_cache.techs(connection), reference_cache.services(connection)
+
+def _workers(engine):
+    """Starts the shared thread pool on first use: UNIT_LOADER_WORKERS, at most half the engine's pool_size."""
+    global _executor, _free_workers
+    with _executor_lock:
+        if _executor is None:
+            pool_size = engine.pool.size() if hasattr(engine.pool, 'size') else 1
+            workers = max(1, pool_size // 2)
+            if LOADER_WORKERS > 0: workers = min(LOADER_WORKERS, workers)
+            _free_workers = threading.BoundedSemaphore(workers)
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='unit-loader')
+    return _executor, _free_workers
+
+def _timed(part, connection, stock_number, argument):
+    started = time.perf_counter()
+    value = part(connection, stock_number, argument)
+    return value, (time.perf_counter() - started) * 1000
+
+def _run_offloaded(engine, free_workers, part, stock_number, argument):
+    """Runs one part on its own pooled connection, then frees its worker slot. Returns (value, elapsed_ms)."""
+    try:
+        with engine.connect() as connection:
+            return _timed(part, connection, stock_number, argument)
+    finally:
+        free_workers.release()
+
+def load_unit(engine, stock_number, reference_cache, connection):
+    """Loads a unit's header data and returns a UnitBundle. connection is the request's own;
+    the parts not offloaded to a free worker run on it, on the calling thread.
+
+    A part that fails is recorded in bundle.errors and left at its empty default,
+    so the page can still render whatever did load.
+    """
+    started = time.perf_counter()
+    parts = {
+        'main': (_fetch_first, SQL_MAIN),
+        'inventory': (_fetch_first, SQL_INVENTORY),
+        'jobs': (_fetch_all, SQL_JOBS),
+        'reference': (_load_reference, reference_cache),
+    }
+    executor, free_workers = _workers(engine)
+    futures = {}
+    for name in OFFLOADED_PARTS:
+        if not free_workers.acquire(blocking=False): break # Every worker is busy: run the rest here
+        function, argument = parts[name]
+        futures[name] = executor.submit(_run_offloaded, engine, free_workers, function, stock_number, argument)
+
+    bundle = UnitBundle(stock_number=stock_number)
+    results = {}
+    for name, (function, argument) in parts.items():
+        if name in futures: continue
+        try:
+            results[name], bundle.timings[name] = _timed(function, connection, stock_number, argument)
+        except Exception as e:
+            print(f"Error loading '{name}' for unit {stock_number}: {e}")
+            bundle.errors[name] = str(e)
+    for name, future in futures.items():
+        try:
+            results[name], bundle.timings[name] = future.result()
+        except Exception as e:
+            print(f"Error loading '{name}' for unit {stock_number}: {e}")
+            bundle.errors[name] = str(e)
+
+    bundle.unit = results.get('main')
+    bundle.inventory = results.get('inventory')
+    bundle.jobs = results.get('jobs', [])
+    bundle.techs, bundle.services = results.get('reference', ((), ()))
+    bundle.timings['total'] = (time.perf_counter() - started) * 1000
+    if bundle.timings['total'] >= SLOW_LOAD_MS:
+        log.info("Slow unit load (%s)", bundle.server_timing())
+    return bundle
+
+def load_section(connection, section, stock_number, offset=0, limit=SECTION_PAGE_SIZE):
+    """Fetches one page of a lazily loaded section. Returns (rows, has_more)."""
+    limit = max(1, min(limit, SECTION_PAGE_SIZE_MAX)); offset = max(0, offset)
+    sql = text(f"{SECTION_SQL[section]} LIMIT :limit OFFSET :offset")
+    rows = [dict(row) for row in connection.execute(sql, {"sn": stock_number, "limit": limit + 1, "offset": offset}).mappings()]
+    return rows[:limit], len(rows) > limit
@@ -0,0 +1,158 @@
+# unit_search.py
+import os
+import re
+import threading
+import time
+from sqlalchemy import text
+
+# Search index for the dashboard search box.
+#
+# unit_search holds one row per stockNumber (the latest test_db row, same rule as the
+# dashboard's ROW_NUMBER dedupe) with the columns laid out so every kind of search is
+# an index lookup:
+#   - stock numbers: PRIMARY KEY, exact or prefix match
+#   - VIN tails: VIN stored reversed, so "last 6 of the VIN" is a prefix match on an index
+#   - make/model/location/year: InnoDB FULLTEXT index, token and prefix (word*) search
+# Created and fully rebuilt by create_search_table.py.
+
+SQL_CREATE_TABLE = """
+CREATE TABLE IF NOT EXISTS unit_search (
+    stockNumber VARCHAR(200) NOT NULL PRIMARY KEY,
+    source_id INT NOT NULL, -- test_db.id this row was copied from
+    vin_reversed VARCHAR(64) NULL,
+    year_text VARCHAR(8) NULL,
+    make VARCHAR(100) NULL,
+    model VARCHAR(100) NULL,
+    location VARCHAR(100) NULL,
+
+    INDEX idx_source_id (source_id),
+    INDEX idx_vin_reversed (vin_reversed),
+    FULLTEXT INDEX ft_unit_text (make, model, location, year_text)
+) ENGINE=InnoDB;
+"""
+
+_UPSERT_COLUMNS = """
+    INSERT INTO unit_search (stockNumber, source_id, vin_reversed, year_text, make, model, location)
+    SELECT t.stockNumber, t.id, REVERSE(UPPER(TRIM(t.vin))), CAST(t.year AS CHAR), t.make, t.model, t.location
+    FROM test_db t
+"""
+_UPSERT_UPDATE = """
+    ON DUPLICATE KEY UPDATE
+        source_id = VALUES(source_id), vin_reversed = VALUES(vin_reversed), year_text = VALUES(year_text),
+        make = VALUES(make), model = VALUES(model), location = VALUES(location)
+"""
+# Rows are applied in id order, so when a stockNumber repeats the highest id wins
+SQL_SYNC_NEW_ROWS = _UPSERT_COLUMNS + "WHERE t.id > :watermark AND t.stockNumber IS NOT NULL ORDER BY t.id" + _UPSERT_UPDATE
+SQL_SYNC_ONE_UNIT = _UPSERT_COLUMNS + "WHERE t.stockNumber = :sn ORDER BY t.id" + _UPSERT_UPDATE
+SQL_REBUILD = _UPSERT_COLUMNS + "WHERE t.stockNumber IS NOT NULL ORDER BY t.id" + _UPSERT_UPDATE
+
+SYNC_INTERVAL_SECONDS = int(os.getenv('SEARCH_SYNC_INTERVAL', '30')) # How often a search first pulls new test_db rows
+MAX_RESULTS = 500
+MIN_VIN_TAIL = 4 # Shortest all-alphanumeric term also tried as a VIN tail
+FULLTEXT_MIN_WORD = 3 # InnoDB's default innodb_ft_min_token_size; shorter words are not indexed
+
+# Relevance scores (higher is better)
+RELEVANCE_EXACT = 100 # Stock number or full VIN
+RELEVANCE_VIN_TAIL = 90
+RELEVANCE_STOCK_PREFIX = 80
+RELEVANCE_TEXT_BASE = 50 # Plus the FULLTEXT score, capped below the prefix match
+
+_last_sync = 0.0
+_sync_lock = threading.Lock()
+
+
+class SearchResult:
+    """Stock numbers that matched a search, with relevance and how long the search took.
+
+    complete is False when the stock numbers may not be every match: a lookup hit the result
+    limit (truncated), or the term has words too short for the FULLTEXT index (short_words),
+    which would otherwise have been substring matches. Callers then fall back to a LIKE scan.
+    """
+
+    def __init__(self, term, relevance, elapsed_ms, truncated=False, short_words=()):
+        self.term = term
+        self.relevance = relevance # stockNumber -> score
+        self.elapsed_ms = elapsed_ms
+        self.truncated = truncated
+        self.short_words = list(short_words)
+
+    @property
+    def stock_numbers(self):
+        return list(self.relevance)
+
+    @property
+    def complete(self):
+        return not self.truncated and not self.short_words
+
+
+def _escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def _words(term):
+    return [w for w in re.split(r'[^0-9A-Za-z]+', term) if w]
+
+def _fulltext_query(term):
+    """Turns free text into a BOOLEAN MODE query where every word must match as a prefix."""
+    words = [w for w in _words(term) if len(w) >= FULLTEXT_MIN_WORD]
+    return ' '.join(f'+{w}*' for w in words)
+
+def sync_new_rows(engine, force=False):
+    """Copies test_db rows added since the last sync into unit_search (at most every SYNC_INTERVAL_SECONDS).
+
+    Runs in its own short transaction so it never mixes with the caller's work.
+    """
+    global _last_sync
+    if not force and time.monotonic() - _last_sync < SYNC_INTERVAL_SECONDS: return
+    if not _sync_lock.acquire(blocking=False): return # Another request is already syncing
+    try:
+        with engine.begin() as connection:
+            watermark = connection.execute(text("SELECT COALESCE(MAX(source_id), 0) FROM unit_search")).scalar_one()
+            connection.execute(text(SQL_SYNC_NEW_ROWS), {"watermark": watermark})
+        _last_sync = time.monotonic()
+    finally:
+        _sync_lock.release()
+
+def sync_unit(connection, stock_number):
+    """Refreshes one unit's search row after the app changes it (e.g. a location update).
+    Call inside the transaction that made the change."""
+    connection.execute(text(SQL_SYNC_ONE_UNIT), {"sn": stock_number})
+
+def rebuild(connection):
+    """Re-copies every unit. Picks up edits made to existing test_db rows by other systems."""
+    connection.execute(text(SQL_REBUILD))
+    connection.execute(text("DELETE s FROM unit_search s LEFT JOIN test_db t ON t.stockNumber = s.stockNumber WHERE t.stockNumber IS NULL"))
+
+def search(connection, term, limit=MAX_RESULTS):
+    """Finds units matching term in one round trip. Returns a SearchResult."""
+    started = time.perf_counter()
+    term = term.strip()
+    parts = []
+    params = {"term": term, "term_prefix": _escape_like(term) + '%', "limit": limit}
+    # Each lookup selects its position in parts, so a lookup that filled its LIMIT can be told apart
+    parts.append(f"SELECT stockNumber, {RELEVANCE_EXACT} AS relevance, 0 AS part FROM unit_search WHERE stockNumber = :term")
+    parts.append(f"SELECT stockNumber, {RELEVANCE_STOCK_PREFIX} AS relevance, 1 AS part FROM unit_search WHERE stockNumber LIKE :term_prefix")
+
+    vin_term = term.upper()
+    if len(vin_term) >= MIN_VIN_TAIL and vin_term.isalnum():
+        params['vin_reversed'] = vin_term[::-1]
+        params['vin_prefix'] = _escape_like(vin_term[::-1]) + '%'
+        parts.append(f"""SELECT stockNumber, CASE WHEN vin_reversed = :vin_reversed THEN {RELEVANCE_EXACT} ELSE {RELEVANCE_VIN_TAIL} END AS relevance, {len(parts)} AS part
+                         FROM unit_search WHERE vin_reversed LIKE :vin_prefix""")
+
+    fulltext = _fulltext_query(term)
+    if fulltext:
+        params['fulltext'] = fulltext
+        parts.append(f"""SELECT stockNumber, {RELEVANCE_TEXT_BASE} + LEAST({RELEVANCE_STOCK_PREFIX - RELEVANCE_TEXT_BASE - 1},
+                                MATCH(make, model, location, year_text) AGAINST (:fulltext IN BOOLEAN MODE)) AS relevance, {len(parts)} AS part
+                         FROM unit_search WHERE MATCH(make, model, location, year_text) AGAINST (:fulltext IN BOOLEAN MODE)""")
+
+    sql = text(" UNION ALL ".join(f"({part} LIMIT :limit)" for part in parts))
+    relevance = {}; per_part = [0] * len(parts)
+    for row in connection.execute(sql, params):
+        per_part[row.part] += 1
+        score = float(row.relevance)
+        if score > relevance.get(row.stockNumber, -1): relevance[row.stockNumber] = score
+    truncated = max(per_part) >= limit or len(relevance) > limit
+    ranked = dict(sorted(relevance.items(), key=lambda item: item[1], reverse=True)[:limit])
+    short_words = [w for w in _words(term) if len(w) < FULLTEXT_MIN_WORD]
+    return SearchResult(term, ranked, (time.perf_counter() - started) * 1000, truncated, short_words)